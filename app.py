@@ -1,10 +1,8 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from twilio.rest import Client
+from flask import Flask, render_template, request, jsonify, redirect, url_for, g
+from twilio_sender import CAMPANHA, CONVERSA, SendService, criar_cliente
 from dotenv import load_dotenv
 import os
 import json
-import time
-import threading
 from datetime import datetime
 
 # -------------------------------------------------------------
@@ -13,18 +11,22 @@ from datetime import datetime
 load_dotenv()
 
 # -------------------------------------------------------------
-#  GOOGLE SHEETS como BANCO (Página1 + LOGS)
-# -------------------------------------------------------------
-from google_sheets import (
-    abrir_planilha,
-    abrir_aba,
-    ensure_logs_worksheet,
-    append_log_row,
-    get_or_create_lead_row,
-    update_lead_fields,
-    delete_lead_and_logs,
-    LOGS_SHEET_NAME,
-    SHEET_NAME,
+#  BANCO: Google Sheets (Página1 + LOGS) ou SQLite espelhado no Sheets
+#  (STORE_BACKEND, ver lead_store.py)
+# -------------------------------------------------------------
+from lead_store import (
+    garantir_lead,
+    atualizar_lead,
+    registrar_log,
+    listar_conversa,
+    snapshot_leads,
+    snapshot_logs,
+    read_cache_stats,
+    dashboard_metricas,
+    dashboard_stats,
+    excluir_lead,
+    unidade_de_trabalho,
+    unidade_stats,
 )
 
 app = Flask(__name__)
@@ -36,103 +38,80 @@ ACCOUNT_SID = os.getenv("ACCOUNT_SID")
 AUTH_TOKEN = os.getenv("AUTH_TOKEN")
 FROM_WPP = os.getenv("FROM_WPP")  # Ex: whatsapp:+14155238886
 
-client = Client(ACCOUNT_SID, AUTH_TOKEN)
+# /logs mostra só os últimos N meses (lê só essas partições do LOGS)
+LOGS_VIEW_MONTHS = int(os.getenv("LOGS_VIEW_MONTHS", "2"))
+
+# sessão HTTP keep-alive + pool limitado de envios (ver twilio_sender.py)
+client = criar_cliente(ACCOUNT_SID, AUTH_TOKEN)
+twilio_envios = SendService(client)
+
+def enviar_mensagem(prioridade=CONVERSA, chave=None, **kwargs):
+    """
+    client.messages.create pela fila de envios (prioridade, limite por remetente,
+    retry); espera e devolve a mensagem. Mesma `chave` = no máximo um envio.
+    """
+    return twilio_envios.enviar(prioridade=prioridade, chave=chave, **kwargs).result()
+
+def chave_envio(*partes):
+    """Chave de idempotência a partir das partes (None se faltar alguma)."""
+    return ":".join(partes) if all(partes) else None
 
 # -------------------------------------------------------------
-#  MEMÓRIA LOCAL (curta) PARA OS LEADS (por dyno)
+#  ESTADO DOS LEADS (stage, respondeu, lembrete) compartilhado entre workers
+#  (SQLite, ver lead_state.py)
 # -------------------------------------------------------------
-lead_status = {}
+from lead_state import LeadState, lead_states
 
 # -------------------------------------------------------------
 #  HELPERS
 # -------------------------------------------------------------
+# telefone -> 'whatsapp:+55...': mesma regra (e cache) do google_sheets.py, ver phone_canon.py
+from phone_canon import normalize_to_wpp
+from google_sheets import prioridade_sheets, sheets_quota_stats
+from sheets_quota import SEGUNDO_PLANO
+from followups import criar_agendador
+from webhook_queue import criar_fila
+from sid_dedup import SidDedup
+
 def safe_str(v):
     """Sheets às vezes retorna int/float/None. Sempre normalize para string."""
     if v is None:
         return ""
     return str(v).strip()
 
-def normalize_phone_digits(phone: str) -> str:
-    """Retorna apenas dígitos; aplica regra Brasil."""
-    digits = "".join(filter(str.isdigit, safe_str(phone)))
-
-    # BR: se veio sem o 9 (55 + DDD + 8 dígitos = 12), insere "9" após o DDD
-    if len(digits) == 12 and digits.startswith("55"):
-        digits = digits[:4] + "9" + digits[4:]
-
-    # 10 ou 11 dígitos (DDD + número) -> prefixa 55
-    if len(digits) in (10, 11):
-        return "55" + digits
-
-    # Já veio com 55
-    if len(digits) in (12, 13):
-        return digits
-
-    return ""
-
-def normalize_to_wpp(phone_any) -> str:
-    """Converte '6298...' ou '+5562...' ou 'whatsapp:+55...' em 'whatsapp:+55...'."""
-    s = safe_str(phone_any)
-    if not s:
-        return ""
-    if s.startswith("whatsapp:"):
-        # garante que esteja no padrão whatsapp:+<digits>
-        parts = s.split(":", 1)
-        rest = parts[1]
-        digits = normalize_phone_digits(rest)
-        return f"whatsapp:+{digits}" if digits else s
-    # sem whatsapp:
-    digits = normalize_phone_digits(s)
-    return f"whatsapp:+{digits}" if digits else ""
-
 def now_str():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+def inicio_do_mes(meses_atras: int = 0) -> datetime:
+    """Primeiro dia do mês, `meses_atras` meses antes do atual."""
+    agora = datetime.now()
+    total = agora.year * 12 + agora.month - 1 - meses_atras
+    return datetime(total // 12, total % 12 + 1, 1)
+
 # -------------------------------------------------------------
 #  ANTI-DUPLICIDADE (MessageSid)
 # -------------------------------------------------------------
+# janela das SIDs mais recentes + diário append-only compartilhado entre os workers
+# (ver sid_dedup.py). O processed_sids.json antigo é importado na primeira execução.
 PROCESSED_SIDS_FILE = "processed_sids.json"
+PROCESSED_SIDS_JOURNAL = os.getenv("PROCESSED_SIDS_JOURNAL", "processed_sids.log")
 
-def load_processed_sids():
-    if os.path.exists(PROCESSED_SIDS_FILE):
-        try:
-            with open(PROCESSED_SIDS_FILE, "r", encoding="utf-8") as f:
-                return set(json.load(f))
-        except Exception:
-            return set()
-    return set()
-
-def save_processed_sids(sids_set):
-    try:
-        with open(PROCESSED_SIDS_FILE, "w", encoding="utf-8") as f:
-            json.dump(list(sids_set), f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("[WARN] Falha ao salvar processed_sids:", e)
-
-processed_sids = load_processed_sids()
+processed_sids = SidDedup(PROCESSED_SIDS_JOURNAL, legado=PROCESSED_SIDS_FILE)
 
 def is_duplicate_message(message_sid: str) -> bool:
-    if not message_sid:
+    try:
+        return processed_sids.visto(message_sid)
+    except OSError as e:
+        # disco com problema: melhor processar de novo do que perder a mensagem
+        print("[WARN] Falha no anti-duplicidade de MessageSid:", e)
         return False
-    if message_sid in processed_sids:
-        return True
-    processed_sids.add(message_sid)
-
-    # limita crescimento
-    if len(processed_sids) > 5000:
-        processed_sids_list = list(processed_sids)[-2000:]
-        processed_sids.clear()
-        processed_sids.update(processed_sids_list)
-
-    save_processed_sids(processed_sids)
-    return False
 
 # -------------------------------------------------------------
 #  LOG PERSISTENTE NO SHEETS (Página1 + LOGS)
 # -------------------------------------------------------------
 def salvar_log(number_wpp: str, body: str, stage: str, direction: str, message_sid: str = "", template_sid: str = ""):
     """
-    Salva log PERSISTENTE no Google Sheets (aba LOGS) e atualiza a linha do lead na Página1.
+    Salva log PERSISTENTE (aba LOGS) e atualiza a linha do lead (Página1).
     number_wpp: 'whatsapp:+55...'
     """
     number_wpp = normalize_to_wpp(number_wpp)
@@ -141,7 +120,7 @@ def salvar_log(number_wpp: str, body: str, stage: str, direction: str, message_s
 
     try:
         # 1) append no LOGS
-        append_log_row(
+        registrar_log(
             telefone_wpp=number_wpp,
             direction=direction,
             stage=stage,
@@ -151,9 +130,6 @@ def salvar_log(number_wpp: str, body: str, stage: str, direction: str, message_s
         )
 
         # 2) update da Página1
-        ws = abrir_planilha()
-        row_idx, headers_l, _ = get_or_create_lead_row(ws, number_wpp)
-
         fields = {"stage": stage}
         if direction == "inbound":
             fields.update({"last_inbound": body, "last_inbound_at": now_str()})
@@ -165,7 +141,7 @@ def salvar_log(number_wpp: str, body: str, stage: str, direction: str, message_s
         if message_sid:
             fields["last_message_sid"] = message_sid
 
-        update_lead_fields(ws, row_idx, headers_l, **fields)
+        atualizar_lead(number_wpp, **fields)
 
     except Exception as e:
         print("[ERRO AO SALVAR LOG NO SHEETS]", e)
@@ -174,38 +150,57 @@ def salvar_log(number_wpp: str, body: str, stage: str, direction: str, message_s
 #  FOLLOW-UP (se não responder)
 # -------------------------------------------------------------
 def enviar_followup(to_number_wpp: str):
-    time.sleep(45)
+    """Roda no pool do agendador (followups.py) quando o follow-up vence."""
+    with prioridade_sheets(SEGUNDO_PLANO), unidade_de_trabalho():
+        _enviar_followup(to_number_wpp)
 
+def _enviar_followup(to_number_wpp: str):
     to_number_wpp = normalize_to_wpp(to_number_wpp)
-    if to_number_wpp not in lead_status:
+    lead = lead_states.get(to_number_wpp)
+    if lead is None:
         return
 
-    lead = lead_status[to_number_wpp]
-
-    if lead.get("answered"):
+    if lead.answered:
         return
 
-    if lead.get("reminder_sent"):
+    if lead.reminder_sent:
         return
 
     try:
-        msg = client.messages.create(
+        msg = enviar_mensagem(
+            prioridade=CAMPANHA,
+            chave=chave_envio("followup", to_number_wpp, str(int(lead.timestamp))),
             from_=FROM_WPP,
             to=to_number_wpp,
             content_sid="HX1c8acc6fb0b98f806baf1d20c8ee9d54"
         )
-        lead["reminder_sent"] = True
+    except Exception as e:
+        # sobe para o agendador, que tenta de novo (até FOLLOWUP_MAX_ATTEMPTS)
+        print("[ERRO] Falha ao enviar follow-up:", e)
+        raise
+
+    try:
+        lead_states.update(to_number_wpp, reminder_sent=True)
         salvar_log(
             number_wpp=to_number_wpp,
             body="(follow-up) lembrete automático enviado",
-            stage=lead.get("stage", "start"),
+            stage=lead.stage,
             direction="system",
             message_sid=getattr(msg, "sid", ""),
             template_sid="HX1c8acc6fb0b98f806baf1d20c8ee9d54"
         )
         print("[INFO] Lembrete enviado para", to_number_wpp)
     except Exception as e:
-        print("[ERRO] Falha ao enviar follow-up:", e)
+        # a mensagem já saiu: não devolve o erro (um retry mandaria de novo se a chave expirasse)
+        print("[ERRO] Follow-up enviado, mas falhou ao registrar:", e)
+
+# um timer + pool pequeno por processo; jobs persistidos (sobrevivem a restart)
+followups = criar_agendador(enviar_followup)
+
+@app.before_request
+def iniciar_agendador_followup():
+    # recarrega os pendentes no primeiro request do worker (depois do fork do gunicorn)
+    followups.iniciar()
 
 # -------------------------------------------------------------
 #  DETECTAR SIM / NÃO
@@ -248,7 +243,10 @@ def processar_novo_lead_sheet(nome: str, telefone: str, email: str = ""):
     vars_json = json.dumps({"nome": nome})
 
     try:
-        msg = client.messages.create(
+        # campanha: atrás das conversas; no máximo um template inicial por lead por dia
+        msg = enviar_mensagem(
+            prioridade=CAMPANHA,
+            chave=chave_envio("start", wpp, datetime.now().strftime("%Y-%m-%d")),
             from_=FROM_WPP,
             to=wpp,
             content_sid=template_sid,
@@ -257,12 +255,9 @@ def processar_novo_lead_sheet(nome: str, telefone: str, email: str = ""):
 
         # garante/atualiza linha do lead e marca ENVIADO
         try:
-            ws = abrir_planilha()
-            row_idx, headers_l, _ = get_or_create_lead_row(ws, wpp, nome_padrao=nome)
-            update_lead_fields(
-                ws,
-                row_idx,
-                headers_l,
+            atualizar_lead(
+                wpp,
+                nome_padrao=nome,
                 enviado=f"ENVIADO {now_str()}",
                 stage="start",
                 last_template_sid=template_sid,
@@ -273,14 +268,8 @@ def processar_novo_lead_sheet(nome: str, telefone: str, email: str = ""):
         except Exception as e:
             print("[SCHEDULER] Falha ao atualizar lead no Sheets:", e)
 
-        # memória local (curta)
-        lead_status[wpp] = {
-            "timestamp": time.time(),
-            "answered": False,
-            "reminder_sent": False,
-            "stage": "start",
-            "nome": nome
-        }
+        # estado compartilhado (todos os workers + sheet_checker)
+        lead_states.put(LeadState(wpp, stage="start", nome=nome))
 
         # log persistente (LOGS + update Page1)
         salvar_log(
@@ -292,8 +281,8 @@ def processar_novo_lead_sheet(nome: str, telefone: str, email: str = ""):
             template_sid=template_sid
         )
 
-        # follow-up
-        threading.Thread(target=enviar_followup, args=(wpp,), daemon=True).start()
+        # follow-up (em FOLLOWUP_DELAY segundos)
+        followups.agendar(wpp)
 
         print("[SCHEDULER] Envio OK para", wpp)
         return True
@@ -313,6 +302,21 @@ def home():
 def form():
     return render_template("form.html")
 
+# -------------------------------------------------------------
+#  LEITURAS DAS PÁGINAS: snapshot compartilhado (ver read_cache.py)
+# -------------------------------------------------------------
+def ler_leads_cache():
+    """Página1 do snapshot em cache; a idade vai no header X-Cache-Age da resposta."""
+    rows, g.cache_age = snapshot_leads()
+    return rows
+
+@app.after_request
+def informar_idade_cache(resp):
+    idade = g.get("cache_age")
+    if idade is not None:
+        resp.headers["X-Cache-Age"] = f"{idade:.1f}"
+    return resp
+
 # -------------------------------------------------------------
 #  ROTA: LEADS (SHEETS)
 # -------------------------------------------------------------
@@ -323,8 +327,7 @@ def leads_page():
     Observação: o Sheets pode retornar Telefone como int -> usamos safe_str + normalize_to_wpp.
     """
     try:
-        ws = abrir_planilha()
-        rows = ws.get_all_records()  # list[dict]
+        rows = ler_leads_cache()  # list[dict]
     except Exception as e:
         print("[ERRO AO LER LEADS DO SHEETS]", e)
         rows = []
@@ -348,8 +351,7 @@ def leads_page():
 @app.route("/conversas")
 def listar_conversas():
     try:
-        ws = abrir_planilha()
-        rows = ws.get_all_records()
+        rows = ler_leads_cache()
     except Exception as e:
         print("[ERRO AO LER CONVERSAS DO SHEETS]", e)
         rows = []
@@ -377,9 +379,7 @@ def conversa_individual(numero):
 
     mensagens = []
     try:
-        ensure_logs_worksheet()
-        ws_logs = abrir_aba(LOGS_SHEET_NAME)
-        logs = ws_logs.get_all_records()
+        logs = listar_conversa(numero)
     except Exception as e:
         print("[ERRO AO LER LOGS DO SHEETS]", e)
         logs = []
@@ -419,40 +419,31 @@ def enviar():
     template_sid = "HX3a3278be375c5f6368dc282229dfdd89"
 
     try:
-        msg = client.messages.create(
+        msg = enviar_mensagem(
             from_=FROM_WPP,
             to=wpp,
             content_sid=template_sid,
             content_variables=vars_json
         )
 
-        # garante linha no Sheets + stage
+        lead_states.put(LeadState(wpp, stage="start", nome=nome))
+
+        # linha no Sheets + stage + log outbound: gravados juntos no fim do bloco
         try:
-            ws = abrir_planilha()
-            row_idx, headers_l, _ = get_or_create_lead_row(ws, wpp, nome_padrao=nome or "profissional")
-            update_lead_fields(ws, row_idx, headers_l, enviado=f"ENVIADO {now_str()}", stage="start")
+            with unidade_de_trabalho():
+                atualizar_lead(wpp, nome_padrao=nome or "profissional", enviado=f"ENVIADO {now_str()}", stage="start")
+                salvar_log(
+                    number_wpp=wpp,
+                    body="(start) template enviado",
+                    stage="start",
+                    direction="outbound",
+                    message_sid=getattr(msg, "sid", ""),
+                    template_sid=template_sid
+                )
         except Exception as e:
             print("[WARN] Falha ao criar/atualizar lead no Sheets (manual):", e)
 
-        lead_status[wpp] = {
-            "timestamp": time.time(),
-            "answered": False,
-            "reminder_sent": False,
-            "stage": "start",
-            "nome": nome
-        }
-
-        # log outbound + metadados
-        salvar_log(
-            number_wpp=wpp,
-            body="(start) template enviado",
-            stage="start",
-            direction="outbound",
-            message_sid=getattr(msg, "sid", ""),
-            template_sid=template_sid
-        )
-
-        threading.Thread(target=enviar_followup, args=(wpp,), daemon=True).start()
+        followups.agendar(wpp)
         return jsonify({"status": "ok"})
     except Exception as e:
         return jsonify({"status": "erro", "erro": str(e)}), 500
@@ -462,6 +453,7 @@ def enviar():
 # -------------------------------------------------------------
 @app.route("/webhook-wpp", methods=["POST"])
 def webhook():
+    """Só valida e enfileira: a máquina de estágios roda nos workers (webhook_queue.py)."""
     message_sid = safe_str(request.form.get("MessageSid", ""))
 
     if is_duplicate_message(message_sid):
@@ -469,7 +461,6 @@ def webhook():
         return "ok", 200
 
     raw_body = safe_str(request.form.get("Body", ""))
-    body_lower = raw_body.lower()
 
     from_number_raw = safe_str(request.form.get("From", ""))
     print("\nRAW NUMBER:", from_number_raw)
@@ -480,32 +471,48 @@ def webhook():
     if not from_number:
         return "ok", 200
 
-    # garante lead local
-    if from_number not in lead_status:
+    fila_webhook.enfileirar(from_number, from_number=from_number, raw_body=raw_body, message_sid=message_sid)
+    return "ok", 200
+
+
+def processar_mensagem_wpp(from_number: str, raw_body: str, message_sid: str):
+    """Máquina de estágios de UMA mensagem recebida (roda no worker da fila do webhook)."""
+    lead = lead_states.get(from_number)
+    novo = lead is None
+    if novo:
         print("[INFO] Lead novo detectado via webhook")
-        lead_status[from_number] = {
-            "timestamp": time.time(),
-            "answered": True,
-            "reminder_sent": False,
-            "stage": "start",
-            "nome": ""
-        }
-
-    lead = lead_status[from_number]
-    lead["answered"] = True
-    if not lead.get("nome"):
-        lead["nome"] = "profissional"
+        lead = LeadState(from_number, stage="start")
+
+    lead.answered = True
+    if not lead.nome:
+        lead.nome = "profissional"
+
+    try:
+        # todas as escritas no Sheets desta mensagem saem juntas no fim
+        # (≤ 1 batch_update na Página1 + ≤ 1 append no LOGS)
+        with unidade_de_trabalho():
+            _processar_estagio(lead, novo, from_number, raw_body, message_sid)
+    finally:
+        # grava o estado mesmo se algo falhar no meio (stage já avançado)
+        lead_states.put(lead)
+
+
+def _processar_estagio(lead: LeadState, novo: bool, from_number: str, raw_body: str, message_sid: str):
+    body_lower = raw_body.lower()
 
     # garante lead no Sheets
     try:
-        ws = abrir_planilha()
-        row_idx, headers_l, data = get_or_create_lead_row(ws, from_number, nome_padrao=lead["nome"])
+        data = garantir_lead(from_number, nome_padrao=lead.nome)
         # Se já existe nome na planilha, use ele (evita "profissional" sobrescrever/duplicar)
         nome_sheet = (data or {}).get("nome") or (data or {}).get("Nome") or ""
-        if nome_sheet and lead.get("nome") in ("", "profissional"):
-            lead["nome"] = nome_sheet
+        if nome_sheet and lead.nome in ("", "profissional"):
+            lead.nome = nome_sheet
+        # sem estado salvo (restart/outro dyno/expirou): continua do STAGE da planilha
+        stage_sheet = safe_str((data or {}).get("stage"))
+        if novo and stage_sheet:
+            lead.stage = stage_sheet
         # mantém stage atual no Sheets
-        update_lead_fields(ws, row_idx, headers_l, stage=lead.get("stage", "start"))
+        atualizar_lead(from_number, stage=lead.stage)
     except Exception as e:
         print("[WARN] Falha ao garantir lead no Sheets (webhook):", e)
 
@@ -513,7 +520,7 @@ def webhook():
     salvar_log(
         number_wpp=from_number,
         body=raw_body,
-        stage=lead.get("stage", "start"),
+        stage=lead.stage,
         direction="inbound",
         message_sid=message_sid
     )
@@ -521,9 +528,9 @@ def webhook():
     # -------------------------------------------------------------
     # ETAPA 1 — start
     # -------------------------------------------------------------
-    if lead["stage"] == "start":
+    if lead.stage == "start":
         if respondeu_sim(body_lower):
-            lead["stage"] = "nutricao"
+            lead.stage = "nutricao"
 
             # outbound: fala + template
             salvar_log(
@@ -534,16 +541,16 @@ def webhook():
             )
             try:
                 template_sid = "HX056f4623440f90a7d063f35c11e51b21"
-                msg = client.messages.create(from_=FROM_WPP, to=from_number, content_sid=template_sid)
+                msg = enviar_mensagem(chave=chave_envio(message_sid, template_sid), from_=FROM_WPP, to=from_number, content_sid=template_sid)
                 salvar_log(number_wpp=from_number, body="(nutricao) template enviado", stage="nutricao",
                           direction="system", message_sid=getattr(msg, "sid", ""), template_sid=template_sid)
             except Exception as e:
                 print("[ERRO] envio template nutricao:", e)
 
-            return "ok", 200
+            return
 
         if respondeu_nao(body_lower):
-            lead["stage"] = "busca"
+            lead.stage = "busca"
             salvar_log(
                 number_wpp=from_number,
                 body="Sem problemas! Se um dia quiser aprender profissionalmente, é só me chamar 💖 Quer mesmo assim conhecer como funciona o método Glam?",
@@ -552,162 +559,177 @@ def webhook():
             )
             try:
                 template_sid = "HX4d904d8b40ca29f56b466b5bf29b27b4"
-                msg = client.messages.create(from_=FROM_WPP, to=from_number, content_sid=template_sid)
+                msg = enviar_mensagem(chave=chave_envio(message_sid, template_sid), from_=FROM_WPP, to=from_number, content_sid=template_sid)
                 salvar_log(number_wpp=from_number, body="(busca) template enviado", stage="busca",
                           direction="system", message_sid=getattr(msg, "sid", ""), template_sid=template_sid)
             except Exception as e:
                 print("[ERRO] envio template busca:", e)
 
-            return "ok", 200
+            return
 
-        return "ok", 200
+        return
 
     # -------------------------------------------------------------
     # ETAPA 2 — nutricao
     # -------------------------------------------------------------
-    if lead["stage"] == "nutricao":
+    if lead.stage == "nutricao":
         if respondeu_sim(body_lower):
-            lead["stage"] = "case"
+            lead.stage = "case"
             salvar_log(number_wpp=from_number, body="CASE REAL — A Virada de Chave Glam", stage="case", direction="outbound")
             try:
                 template_sid = "HX7dd20c1f849fbfef0e86969e3bb830ed"
-                msg = client.messages.create(from_=FROM_WPP, to=from_number, content_sid=template_sid)
+                msg = enviar_mensagem(chave=chave_envio(message_sid, template_sid), from_=FROM_WPP, to=from_number, content_sid=template_sid)
                 salvar_log(number_wpp=from_number, body="(case) template enviado", stage="case",
                           direction="system", message_sid=getattr(msg, "sid", ""), template_sid=template_sid)
             except Exception as e:
                 print("[ERRO] envio template case:", e)
-            return "ok", 200
+            return
 
         if respondeu_nao(body_lower):
-            lead["stage"] = "busca"
+            lead.stage = "busca"
             salvar_log(number_wpp=from_number, body="Sem problemas! Se um dia quiser aprender profissionalmente, é só me chamar 💖 Quer mesmo assim conhecer como funciona o método Glam?",
                       stage="busca", direction="outbound")
             try:
                 template_sid = "HX4d904d8b40ca29f56b466b5bf29b27b4"
-                msg = client.messages.create(from_=FROM_WPP, to=from_number, content_sid=template_sid)
+                msg = enviar_mensagem(chave=chave_envio(message_sid, template_sid), from_=FROM_WPP, to=from_number, content_sid=template_sid)
                 salvar_log(number_wpp=from_number, body="(busca) template enviado", stage="busca",
                           direction="system", message_sid=getattr(msg, "sid", ""), template_sid=template_sid)
             except Exception as e:
                 print("[ERRO] envio template busca:", e)
-            return "ok", 200
+            return
 
-        return "ok", 200
+        return
 
     # -------------------------------------------------------------
     # ETAPA 3 — case
     # -------------------------------------------------------------
-    if lead["stage"] == "case":
+    if lead.stage == "case":
         if respondeu_sim(body_lower):
-            lead["stage"] = "projecao"
+            lead.stage = "projecao"
             salvar_log(number_wpp=from_number, body="Deixa eu te revelar um ponto que, quando as profissionais entendem, a conversa muda de tom.",
                       stage="projecao", direction="outbound")
             try:
                 template_sid = "HX9c35981fd182b8bafb7ba86f82f787c9"
-                vars_json = json.dumps({"nome": lead.get("nome", "profissional")})
-                msg = client.messages.create(from_=FROM_WPP, to=from_number, content_sid=template_sid, content_variables=vars_json)
+                vars_json = json.dumps({"nome": (lead.nome or "profissional")})
+                msg = enviar_mensagem(chave=chave_envio(message_sid, template_sid), from_=FROM_WPP, to=from_number, content_sid=template_sid, content_variables=vars_json)
                 salvar_log(number_wpp=from_number, body="(projecao) template enviado", stage="projecao",
                           direction="system", message_sid=getattr(msg, "sid", ""), template_sid=template_sid)
             except Exception as e:
                 print("[ERRO] envio template projecao:", e)
-            return "ok", 200
+            return
 
         if respondeu_nao(body_lower):
-            lead["stage"] = "busca"
+            lead.stage = "busca"
             salvar_log(number_wpp=from_number, body="quer ver uma coisa que costuma abrir os olhos das profissionais?",
                       stage="busca", direction="outbound")
             try:
                 template_sid = "HX4d904d8b40ca29f56b466b5bf29b27b4"
-                msg = client.messages.create(from_=FROM_WPP, to=from_number, content_sid=template_sid)
+                msg = enviar_mensagem(chave=chave_envio(message_sid, template_sid), from_=FROM_WPP, to=from_number, content_sid=template_sid)
                 salvar_log(number_wpp=from_number, body="(busca) template enviado", stage="busca",
                           direction="system", message_sid=getattr(msg, "sid", ""), template_sid=template_sid)
             except Exception as e:
                 print("[ERRO] envio template busca:", e)
-            return "ok", 200
+            return
 
-        return "ok", 200
+        return
 
     # -------------------------------------------------------------
     # ETAPA — busca (recuperação)
     # -------------------------------------------------------------
-    if lead["stage"] == "busca":
+    if lead.stage == "busca":
         if respondeu_sim(body_lower):
-            lead["stage"] = "projecao"
+            lead.stage = "projecao"
             salvar_log(number_wpp=from_number, body="Retorno", stage="projecao", direction="outbound")
             try:
                 template_sid = "HX056f4623440f90a7d063f35c11e51b21"
-                vars_json = json.dumps({"nome": lead.get("nome", "profissional")})
-                msg = client.messages.create(from_=FROM_WPP, to=from_number, content_sid=template_sid, content_variables=vars_json)
+                vars_json = json.dumps({"nome": (lead.nome or "profissional")})
+                msg = enviar_mensagem(chave=chave_envio(message_sid, template_sid), from_=FROM_WPP, to=from_number, content_sid=template_sid, content_variables=vars_json)
                 salvar_log(number_wpp=from_number, body="(projecao) template enviado", stage="projecao",
                           direction="system", message_sid=getattr(msg, "sid", ""), template_sid=template_sid)
             except Exception as e:
                 print("[ERRO] envio template projecao:", e)
-            return "ok", 200
+            return
 
-        return "ok", 200
+        return
 
     # -------------------------------------------------------------
     # ETAPA 4 — projecao
     # -------------------------------------------------------------
-    if lead["stage"] == "projecao":
+    if lead.stage == "projecao":
         if respondeu_sim(body_lower):
-            lead["stage"] = "formacao_glam"
+            lead.stage = "formacao_glam"
             salvar_log(number_wpp=from_number, body="Módulos", stage="formacao_glam", direction="outbound")
             try:
                 template_sid = "HX5cf4af187864c97a446d5cbc1572ccca"
-                msg = client.messages.create(from_=FROM_WPP, to=from_number, content_sid=template_sid)
+                msg = enviar_mensagem(chave=chave_envio(message_sid, template_sid), from_=FROM_WPP, to=from_number, content_sid=template_sid)
                 salvar_log(number_wpp=from_number, body="(formacao_glam) template enviado", stage="formacao_glam",
                           direction="system", message_sid=getattr(msg, "sid", ""), template_sid=template_sid)
             except Exception as e:
                 print("[ERRO] envio template formacao_glam:", e)
-            return "ok", 200
+            return
 
         if respondeu_nao(body_lower):
-            lead["stage"] = "end"
+            lead.stage = "end"
             salvar_log(number_wpp=from_number, body="quer ver uma coisa que costuma abrir os olhos das profissionais?",
                       stage="end", direction="outbound")
             try:
                 template_sid = "HX4d904d8b40ca29f56b466b5bf29b27b4"
-                msg = client.messages.create(from_=FROM_WPP, to=from_number, content_sid=template_sid)
+                msg = enviar_mensagem(chave=chave_envio(message_sid, template_sid), from_=FROM_WPP, to=from_number, content_sid=template_sid)
                 salvar_log(number_wpp=from_number, body="(end) template enviado", stage="end",
                           direction="system", message_sid=getattr(msg, "sid", ""), template_sid=template_sid)
             except Exception as e:
                 print("[ERRO] envio template end:", e)
-            return "ok", 200
+            return
 
-        return "ok", 200
+        return
 
     # -------------------------------------------------------------
     # ETAPA 5 — formacao_glam
     # -------------------------------------------------------------
-    if lead["stage"] == "formacao_glam":
+    if lead.stage == "formacao_glam":
         if respondeu_sim(body_lower):
-            lead["stage"] = "checkout"
+            lead.stage = "checkout"
             salvar_log(number_wpp=from_number, body="Link pagamento", stage="checkout", direction="outbound")
             try:
                 template_sid = "HX8baef274f434c675cd1e1301dc8b4e4c"
-                msg = client.messages.create(from_=FROM_WPP, to=from_number, content_sid=template_sid)
+                msg = enviar_mensagem(chave=chave_envio(message_sid, template_sid), from_=FROM_WPP, to=from_number, content_sid=template_sid)
                 salvar_log(number_wpp=from_number, body="(checkout) template enviado", stage="checkout",
                           direction="system", message_sid=getattr(msg, "sid", ""), template_sid=template_sid)
             except Exception as e:
                 print("[ERRO] envio template checkout:", e)
-            return "ok", 200
+            return
 
         if respondeu_nao(body_lower):
-            lead["stage"] = "end"
+            lead.stage = "end"
             salvar_log(number_wpp=from_number, body="quer ver uma coisa que costuma abrir os olhos das profissionais?",
                       stage="end", direction="outbound")
             try:
                 template_sid = "HX4d904d8b40ca29f56b466b5bf29b27b4"
-                msg = client.messages.create(from_=FROM_WPP, to=from_number, content_sid=template_sid)
+                msg = enviar_mensagem(chave=chave_envio(message_sid, template_sid), from_=FROM_WPP, to=from_number, content_sid=template_sid)
                 salvar_log(number_wpp=from_number, body="(end) template enviado", stage="end",
                           direction="system", message_sid=getattr(msg, "sid", ""), template_sid=template_sid)
             except Exception as e:
                 print("[ERRO] envio template end:", e)
-            return "ok", 200
+            return
 
-        return "ok", 200
+        return
 
-    return "ok", 200
+
+fila_webhook = criar_fila(processar_mensagem_wpp)
+
+
+@app.route("/status")
+def status():
+    """Profundidade/latência da fila do webhook e uso da cota do Sheets (JSON)."""
+    return jsonify({
+        "webhook_queue": fila_webhook.relatorio(),
+        "followups": followups.relatorio(),
+        "twilio_sends": twilio_envios.relatorio(),
+        "store_units": unidade_stats(),
+        "read_cache": read_cache_stats(),
+        "dashboard": dashboard_stats(),
+        "sheets_quota": sheets_quota_stats(),
+    })
 
 # -------------------------------------------------------------
 #  LOGS (aba LOGS)
@@ -715,9 +737,7 @@ def webhook():
 @app.route("/logs")
 def visualizar_logs():
     try:
-        ensure_logs_worksheet()
-        ws_logs = abrir_aba(LOGS_SHEET_NAME)
-        logs_rows = ws_logs.get_all_records()
+        logs_rows, g.cache_age = snapshot_logs(desde=inicio_do_mes(LOGS_VIEW_MONTHS - 1))
     except Exception as e:
         print("[ERRO AO LER LOGS DO SHEETS]", e)
         logs_rows = []
@@ -740,54 +760,17 @@ def visualizar_logs():
 # -------------------------------------------------------------
 @app.route("/dashboard")
 def dashboard():
+    # contadores mantidos a cada escrita no snapshot da Página1 (ver dashboard_agg.py);
+    # ?recalcular=1 força a recontagem completa
+    recalcular = request.args.get("recalcular") == "1"
     try:
-        ws = abrir_planilha()
-        rows = ws.get_all_records()
+        metrics, g.cache_age = dashboard_metricas(recalcular=recalcular)
     except Exception as e:
         print("[ERRO AO LER DASHBOARD DO SHEETS]", e)
-        rows = []
-
-    agora = datetime.now()
-    hoje = agora.date()
-    mes_atual = agora.month
-    ano_atual = agora.year
+        metrics = {"dia": 0, "mes": 0, "total": 0, "etapas": {}, "etapas_nomes": [], "etapas_valores": []}
 
-    total = 0
-    dia = 0
-    mes = 0
-    etapas = {}
-
-    for r in rows:
-        # considera lead válido se tiver telefone
-        tel_raw = r.get("TELEFONE") or r.get("Telefone") or r.get("telefone") or ""
-        tel = normalize_to_wpp(tel_raw)
-        if not tel:
-            continue
-
-        total += 1
-
-        stage = safe_str(r.get("STAGE") or "start").lower() or "start"
-        etapas[stage] = etapas.get(stage, 0) + 1
-
-        dt_str = safe_str(r.get("UPDATED_AT") or r.get("LAST_OUTBOUND_AT") or r.get("Data") or "")
-        dt = None
-        if dt_str:
-            for fmt in ("%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M:%S"):
-                try:
-                    dt = datetime.strptime(dt_str, fmt)
-                    break
-                except Exception:
-                    continue
-
-        if dt:
-            if dt.date() == hoje:
-                dia += 1
-            if dt.year == ano_atual and dt.month == mes_atual:
-                mes += 1
-
-    # listas pro gráfico
-    etapas_nomes = list(etapas.keys())
-    etapas_valores = [etapas[k] for k in etapas_nomes]
+    total = metrics["total"]
+    etapas = metrics["etapas"]
 
     # conversão (% do total) nas etapas principais do seu template
     def pct(count):
@@ -804,15 +787,6 @@ def dashboard():
         "para_comprou": pct(etapas.get("comprou", 0)),
     }
 
-    metrics = {
-        "dia": dia,
-        "mes": mes,
-        "total": total,
-        "etapas": etapas,
-        "etapas_nomes": etapas_nomes,
-        "etapas_valores": etapas_valores,
-    }
-
     return render_template("dashboard.html", metrics=metrics, conversao=conversao)
 # -------------------------------------------------------------
 #  DELETAR LEAD
@@ -821,7 +795,8 @@ def dashboard():
 def delete_lead(numero):
     numero = normalize_to_wpp(numero)
     try:
-        delete_lead_and_logs(numero)
+        excluir_lead(numero)
+        lead_states.delete(numero)
     except Exception as e:
         print("[ERRO AO EXCLUIR NO SHEETS]", e)
 
@@ -834,9 +809,8 @@ def delete_lead(numero):
 def marcar_comprou(numero):
     numero = normalize_to_wpp(numero)
     try:
-        ws = abrir_planilha()
-        row_idx, headers_l, _ = get_or_create_lead_row(ws, numero)
-        update_lead_fields(ws, row_idx, headers_l, stage="comprou")
+        atualizar_lead(numero, stage="comprou")
+        lead_states.update(numero, stage="comprou")
         salvar_log(number_wpp=numero, body="Lead marcado como COMPROU manualmente", stage="comprou", direction="system")
     except Exception as e:
         print("[ERRO AO MARCAR COMPROU NO SHEETS]", e)
@@ -856,9 +830,7 @@ def click_checkout():
         salvar_log(number_wpp=tel_wpp, body="Lead clicou no botão do checkout", stage="checkout_visit", direction="system")
         # opcional: atualiza stage no Sheets
         try:
-            ws = abrir_planilha()
-            row_idx, headers_l, _ = get_or_create_lead_row(ws, tel_wpp)
-            update_lead_fields(ws, row_idx, headers_l, stage="checkout_visit")
+            atualizar_lead(tel_wpp, stage="checkout_visit")
         except Exception as e:
             print("[WARN] Falha ao atualizar stage checkout_visit:", e)
 
@@ -0,0 +1,14 @@
+# arquivar_logs.py
+# Roda no Heroku Scheduler (ex: 1x por dia)
+
+from google_sheets import arquivar_logs, prioridade_sheets, sheets_quota_stats
+from sheets_quota import SEGUNDO_PLANO
+
+print("=== ARQUIVANDO PARTIÇÕES ANTIGAS DE LOGS ===")
+
+with prioridade_sheets(SEGUNDO_PLANO):
+    arquivadas = arquivar_logs()
+print("Arquivadas:", ", ".join(arquivadas) if arquivadas else "nenhuma")
+
+print("Cota Sheets:", sheets_quota_stats())
+print("=== FINALIZADO ===")
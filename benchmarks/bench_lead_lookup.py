@@ -0,0 +1,59 @@
+"""
+Benchmark: chamadas de API por lookup de lead (get_or_create_lead_row) conforme a Página1 cresce.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.bench_lead_lookup
+    python -m benchmarks.bench_lead_lookup --sizes 100 1000 50000 --lookups 20
+
+Não acessa o Google: usa a planilha em memória de sheets_backend, que conta as chamadas.
+"""
+import argparse
+import time
+
+import google_sheets as gs
+from sheets_backend import new_spreadsheet
+from sheets_schema import LEADS_HEADER
+
+
+def _fake_sheet(n: int):
+    rows = [list(LEADS_HEADER)]
+    for i in range(n):
+        tel = f"whatsapp:+55629{i:08d}"
+        rows.append([f"Lead {i}", tel, "", "2026-01-01 10:00:00", "start", "2026-01-01 10:00:00"])
+    return rows
+
+
+def run(size: int, lookups: int):
+    """Retorna (API/lookup, ms/lookup, chamadas) com o índice frio (1º lookup) e quente (resto)."""
+    sh = new_spreadsheet()
+    ws = sh.load_rows(gs.SHEET_NAME, _fake_sheet(size))
+    gs._lead_indexes.pop(ws.id, None)
+    passo = max(1, size // lookups)
+    alvos = [f"629{i:08d}" for i in range(0, size, passo)][:lookups]
+
+    resultados = []
+    for fase in (alvos[:1], alvos[1:]):
+        sh.faults.reset()
+        inicio = time.perf_counter()
+        for tel in fase:
+            gs.get_or_create_lead_row(ws, tel)
+        elapsed = time.perf_counter() - inicio
+        n = max(1, len(fase))
+        resultados.append((sh.faults.total_calls / n, elapsed / n * 1000, dict(sh.faults.calls)))
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000, 20000, 50000])
+    parser.add_argument("--lookups", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'linhas':>8} | {'índice':>6} | {'API/lookup':>10} | {'ms/lookup':>9} | chamadas")
+    for size in args.sizes:
+        for fase, (por_lookup, ms, calls) in zip(("frio", "quente"), run(size, args.lookups)):
+            print(f"{size:>8} | {fase:>6} | {por_lookup:>10.1f} | {ms:>9.3f} | {calls}")
+
+
+if __name__ == "__main__":
+    main()
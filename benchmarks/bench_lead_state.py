@@ -0,0 +1,71 @@
+"""
+Benchmark: memória por 100k leads (dict antigo do lead_status x LeadState com
+__slots__) e custo/tamanho do LeadStateStore em SQLite.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.bench_lead_state
+    python -m benchmarks.bench_lead_state --n 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from lead_state import LeadState, LeadStateStore
+
+
+def _telefone(i: int) -> str:
+    return f"whatsapp:+55629{i:08d}"
+
+
+def _memoria(fabrica, n: int) -> int:
+    tracemalloc.start()
+    antes = tracemalloc.get_traced_memory()[0]
+    guardados = {}
+    for i in range(n):
+        tel = _telefone(i)
+        guardados[tel] = fabrica(tel)
+    depois = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del guardados
+    return depois - antes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n", type=int, default=100000)
+    args = parser.parse_args()
+    n = args.n
+    agora = time.time()
+
+    dict_antigo = _memoria(lambda tel: {
+        "timestamp": agora, "answered": False, "reminder_sent": False, "stage": "start", "nome": "profissional",
+    }, n)
+    slots = _memoria(lambda tel: LeadState(tel, "start", "profissional", False, False, agora, agora), n)
+
+    print(f"{n} leads em memória (telefone -> registro):")
+    print(f"  dict (lead_status antigo): {dict_antigo / 2 ** 20:7.1f} MiB  ({dict_antigo / n:.0f} B/lead)")
+    print(f"  LeadState (__slots__):     {slots / 2 ** 20:7.1f} MiB  ({slots / n:.0f} B/lead)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lead_state.db")
+        store = LeadStateStore(path)
+        inicio = time.perf_counter()
+        for i in range(n):
+            store.put(LeadState(_telefone(i), "start", "profissional"))
+        put_us = (time.perf_counter() - inicio) / n * 1e6
+
+        inicio = time.perf_counter()
+        for i in range(0, n, 7):
+            store.get(_telefone(i))
+        get_us = (time.perf_counter() - inicio) / len(range(0, n, 7)) * 1e6
+
+        store._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        tamanho = os.path.getsize(path)
+        print(f"SQLite ({n} leads): {tamanho / 2 ** 20:.1f} MiB em disco ({tamanho / n:.0f} B/lead), "
+              f"put {put_us:.1f} µs, get {get_us:.1f} µs; residente no processo: só a conexão")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark: normalização de telefone em 100k números de formatos variados.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.bench_phone_canon
+    python -m benchmarks.bench_phone_canon --n 100000 --distintos 20000
+
+Compara a função antiga (por célula, sem cache) com phone_canon.norm_digits
+(LRU frio e quente) e com norm_digits_many (coluna inteira). Também confere
+que os resultados são os mesmos das duas funções antigas (google_sheets e app).
+"""
+import argparse
+import random
+import time
+
+import phone_canon
+
+
+def _antigo_sheets(v) -> str:
+    """_norm_tel_digits antigo do google_sheets.py (referência)."""
+    s = "" if v is None else str(v).strip()
+    digits = "".join(ch for ch in s if ch.isdigit())
+    if len(digits) == 12 and digits.startswith("55"):
+        digits = digits[:4] + "9" + digits[4:]
+    if len(digits) in (10, 11):
+        return "55" + digits
+    if len(digits) in (12, 13) and digits.startswith("55"):
+        return digits
+    return digits
+
+
+def _antigo_app_wpp(v) -> str:
+    """normalize_to_wpp antigo do app.py (referência)."""
+    def digitos(phone):
+        digits = "".join(filter(str.isdigit, "" if phone is None else str(phone).strip()))
+        if len(digits) == 12 and digits.startswith("55"):
+            digits = digits[:4] + "9" + digits[4:]
+        if len(digits) in (10, 11):
+            return "55" + digits
+        if len(digits) in (12, 13):
+            return digits
+        return ""
+
+    s = "" if v is None else str(v).strip()
+    if not s:
+        return ""
+    if s.startswith("whatsapp:"):
+        d = digitos(s.split(":", 1)[1])
+        return f"whatsapp:+{d}" if d else s
+    d = digitos(s)
+    return f"whatsapp:+{d}" if d else ""
+
+
+def _numeros(n: int, distintos: int, seed: int = 42) -> list:
+    rnd = random.Random(seed)
+    formatos = [
+        lambda ddd, num: f"whatsapp:+55{ddd}9{num}",
+        lambda ddd, num: f"+55 ({ddd}) 9{num[:4]}-{num[4:]}",
+        lambda ddd, num: f"{ddd}9{num}",
+        lambda ddd, num: f"55{ddd}{num}",            # sem o 9
+        lambda ddd, num: int(f"55{ddd}9{num}"),      # Sheets devolve como número
+        lambda ddd, num: f" 0{ddd} 9{num} ",
+        lambda ddd, num: f"+1 415 {num[:3]} {num[3:]}",
+        lambda ddd, num: "",
+    ]
+    base = []
+    for _ in range(distintos):
+        ddd = rnd.choice(["11", "21", "31", "62", "71", "85"])
+        num = f"{rnd.randrange(10 ** 8):08d}"
+        base.append(rnd.choice(formatos)(ddd, num))
+    return [rnd.choice(base) for _ in range(n)]
+
+
+def _medir(fn, valores) -> float:
+    inicio = time.perf_counter()
+    fn(valores)
+    return (time.perf_counter() - inicio) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n", type=int, default=100000)
+    parser.add_argument("--distintos", type=int, default=20000, help="números diferentes entre os N")
+    args = parser.parse_args()
+
+    valores = _numeros(args.n, args.distintos)
+
+    divergentes = sum(1 for v in valores if phone_canon.norm_digits(v) != _antigo_sheets(v))
+    divergentes += sum(1 for v in valores if phone_canon.normalize_to_wpp(v) != _antigo_app_wpp(v))
+    phone_canon._canon.cache_clear()
+
+    casos = [
+        ("antigo (por célula)", lambda vs: [_antigo_sheets(v) for v in vs]),
+        ("norm_digits, LRU frio", lambda vs: [phone_canon.norm_digits(v) for v in vs]),
+        ("norm_digits, LRU quente", lambda vs: [phone_canon.norm_digits(v) for v in vs]),
+        ("norm_digits_many", phone_canon.norm_digits_many),
+    ]
+    print(f"{args.n} números ({args.distintos} distintos), divergências com as funções antigas: {divergentes}")
+    print(f"{'caso':>24} | {'ms':>8} | {'µs/número':>9}")
+    for nome, fn in casos:
+        ms = _medir(fn, valores)
+        print(f"{nome:>24} | {ms:>8.1f} | {ms * 1000 / args.n:>9.3f}")
+    print("cache:", phone_canon.cache_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark: custo por mensagem do anti-duplicidade de MessageSid.
+
+Uso (na raiz do projeto):
+    python -m benchmarks.bench_sid_dedup
+    python -m benchmarks.bench_sid_dedup --n 1000000 --dup-rate 0.05 --antigo 5000
+
+Compara o is_duplicate_message antigo (set + reescrita do JSON inteiro a cada
+mensagem; medido só nas primeiras --antigo mensagens, é lento demais p/ 1M)
+com sid_dedup.SidDedup (janela ordenada + diário append-only) em N mensagens,
+com uma fração de reenvios recentes.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from sid_dedup import SidDedup
+
+
+def _mensagens(n: int, dup_rate: float, seed: int = 7):
+    rnd = random.Random(seed)
+    recentes = []
+    for i in range(n):
+        if recentes and rnd.random() < dup_rate:
+            yield rnd.choice(recentes)  # reenvio do Twilio
+            continue
+        sid = f"SM{i:032x}"
+        recentes.append(sid)
+        if len(recentes) > 100:
+            recentes.pop(0)
+        yield sid
+
+
+def _antigo(path: str, sids) -> float:
+    processed = set()
+
+    def is_duplicate(sid):
+        if sid in processed:
+            return True
+        processed.add(sid)
+        if len(processed) > 5000:
+            manter = list(processed)[-2000:]
+            processed.clear()
+            processed.update(manter)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(list(processed), f, ensure_ascii=False, indent=2)
+        return False
+
+    inicio = time.perf_counter()
+    n = 0
+    for sid in sids:
+        is_duplicate(sid)
+        n += 1
+    return (time.perf_counter() - inicio) / max(1, n) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n", type=int, default=1000000)
+    parser.add_argument("--dup-rate", type=float, default=0.05)
+    parser.add_argument("--window", type=int, default=50000)
+    parser.add_argument("--antigo", type=int, default=5000, help="mensagens medidas na versão antiga")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        us_antigo = _antigo(os.path.join(tmp, "processed_sids.json"), _mensagens(args.antigo, args.dup_rate))
+
+        dedup = SidDedup(os.path.join(tmp, "processed_sids.log"), window=args.window)
+        duplicadas = 0
+        inicio = time.perf_counter()
+        for sid in _mensagens(args.n, args.dup_rate):
+            duplicadas += dedup.visto(sid)
+        us_novo = (time.perf_counter() - inicio) / args.n * 1e6
+        tamanho = os.path.getsize(dedup.path)
+
+    print(f"antigo (JSON reescrito por msg, {args.antigo} msgs): {us_antigo:9.1f} µs/msg")
+    print(f"SidDedup ({args.n} msgs, janela {args.window}):      {us_novo:9.1f} µs/msg")
+    print(f"  duplicadas detectadas: {duplicadas}, diário final: {tamanho / 2 ** 20:.1f} MiB, {dedup.relatorio()}")
+
+
+if __name__ == "__main__":
+    main()
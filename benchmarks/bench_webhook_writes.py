@@ -0,0 +1,111 @@
+"""
+Benchmark/checagem: chamadas à API do Sheets por mensagem do webhook, com e sem a
+unidade de trabalho (lead_store.unidade_de_trabalho).
+
+Uso (na raiz do projeto):
+    python -m benchmarks.bench_webhook_writes
+    python -m benchmarks.bench_webhook_writes --leads 200
+
+Não acessa o Google nem o Twilio: planilha em memória (sheets_backend conta as
+chamadas por método) e um cliente Twilio falso. Com a unidade de trabalho cada
+webhook tem que fazer no máximo UM append no LOGS, UM batch_update na Página1 e
+UM append_row (só quando o lead é novo); o script falha (AssertionError) se não.
+"""
+import argparse
+import collections
+import contextlib
+import itertools
+import os
+import sys
+import tempfile
+
+# antes de importar o app: planilha em memória, LOGS gravado na hora, webhook sem fila
+os.environ.setdefault("SHEETS_BACKEND", "memory")
+os.environ["LOGS_MAX_DELAY"] = "0"
+os.environ["WEBHOOK_WORKERS"] = "0"
+os.environ.setdefault("SHEETS_READS_PER_MIN", "1000000")
+os.environ.setdefault("SHEETS_WRITES_PER_MIN", "1000000")
+os.environ.setdefault("TWILIO_SENDER_MPS", "1000000")
+os.environ.setdefault("ACCOUNT_SID", "AC" + "0" * 32)
+os.environ.setdefault("AUTH_TOKEN", "x")
+os.environ.setdefault("FROM_WPP", "whatsapp:+14155238886")
+
+# mensagens de cada lead (lead novo -> nutricao -> ...)
+CONVERSA = ["sim", "quero", "2", "ok"]
+LIMITES = {"append_rows": 1, "batch_update": 1, "append_row": 1}
+
+
+class _Mensagens:
+    _sids = itertools.count()
+
+    def create(self, **kwargs):
+        return type("Msg", (), {"sid": f"SM{next(self._sids):032x}"})()
+
+
+class _TwilioFalso:
+    messages = _Mensagens()
+
+
+def _rodar(app, sh, leads: int, com_unidade: bool):
+    original = app.unidade_de_trabalho
+    if not com_unidade:
+        app.unidade_de_trabalho = contextlib.nullcontext
+    client = app.app.test_client()
+    por_webhook = []
+    sid = itertools.count()
+    try:
+        for i in range(leads):
+            tel = f"whatsapp:+55629{i + (0 if com_unidade else leads):08d}"
+            for texto in CONVERSA:
+                sh.faults.reset()
+                client.post("/webhook-wpp", data={"From": tel, "Body": texto, "MessageSid": f"SMW{com_unidade:d}{next(sid)}"})
+                por_webhook.append(dict(sh.faults.calls))
+    finally:
+        app.unidade_de_trabalho = original
+    return por_webhook
+
+
+def _resumo(por_webhook) -> dict:
+    total = collections.Counter()
+    maximo = collections.Counter()
+    for calls in por_webhook:
+        total.update(calls)
+        for metodo, n in calls.items():
+            maximo[metodo] = max(maximo[metodo], n)
+    n = max(1, len(por_webhook))
+    return {
+        "api_por_webhook": round(sum(total.values()) / n, 2),
+        "media": {m: round(v / n, 2) for m, v in sorted(total.items())},
+        "max": dict(sorted(maximo.items())),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--leads", type=int, default=50)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())  # lead_state.db, processed_sids.log etc. ficam no temporário
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app
+    import google_sheets as gs
+    import sheets_backend
+
+    app.client = app.twilio_envios.client = _TwilioFalso()
+    sh = sheets_backend.memory_client(gs.SHEET_NAME).spreadsheet
+
+    for nome, com_unidade in (("sem unidade de trabalho", False), ("com unidade de trabalho", True)):
+        por_webhook = _rodar(app, sh, args.leads, com_unidade)
+        resumo = _resumo(por_webhook)
+        print(f"{nome} ({len(por_webhook)} webhooks): {resumo['api_por_webhook']} chamadas/webhook")
+        print(f"  média por método: {resumo['media']}")
+        print(f"  máximo por método: {resumo['max']}")
+        if com_unidade:
+            for metodo, limite in LIMITES.items():
+                assert resumo["max"].get(metodo, 0) <= limite, f"{metodo}: {resumo['max'][metodo]} > {limite} por webhook"
+            print("  OK: ≤ 1 append_rows (LOGS), ≤ 1 batch_update (Página1), ≤ 1 append_row (lead novo) por webhook")
+    print("unidades:", app.unidade_stats())
+
+
+if __name__ == "__main__":
+    main()
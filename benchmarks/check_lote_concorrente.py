@@ -0,0 +1,79 @@
+"""
+Checagem: escritas de várias threads no lote de escritas (lead_store.lote_escritas)
+enquanto outra thread chama descarregar_escritas() (checkpoint da campanha).
+
+Uso (na raiz do projeto):
+    python -m benchmarks.check_lote_concorrente
+    python -m benchmarks.check_lote_concorrente --workers 16 --leads 400
+
+Planilha em memória (sheets_backend). Cada worker marca ENVIADO/STAGE nos seus
+leads e grava um log por lead; no fim toda marca e todo log têm que estar na
+planilha, sem erro no descarregar (o script falha com AssertionError se não).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+
+# antes de importar o lead_store: planilha em memória, LOGS gravado na hora
+os.environ.setdefault("SHEETS_BACKEND", "memory")
+os.environ["LOGS_MAX_DELAY"] = "0"
+os.environ.setdefault("SHEETS_READS_PER_MIN", "1000000")
+os.environ.setdefault("SHEETS_WRITES_PER_MIN", "1000000")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--leads", type=int, default=200)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import google_sheets as gs
+    import lead_store
+
+    telefones = [f"whatsapp:+55629{i:08d}" for i in range(args.leads)]
+    fim = threading.Event()
+    erros = []
+
+    def worker(meus):
+        try:
+            for tel in meus:
+                lead_store.atualizar_lead(tel, ENVIADO="sim", STAGE="nutricao")
+                lead_store.registrar_log(tel, "outbound", "start", "template enviado")
+        except Exception as e:
+            erros.append(e)
+
+    def checkpoints():
+        while not fim.is_set():
+            try:
+                lead_store.descarregar_escritas()
+            except Exception as e:
+                erros.append(e)
+
+    with lead_store.lote_escritas():
+        cp = threading.Thread(target=checkpoints)
+        cp.start()
+        threads = [threading.Thread(target=worker, args=(telefones[i::args.workers],)) for i in range(args.workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        fim.set()
+        cp.join()
+    gs.flush_logs()
+
+    assert not erros, erros
+    rows = gs.abrir_planilha().get_all_records()
+    marcados = {r["TELEFONE"] for r in rows if r.get("ENVIADO") == "sim" and r.get("STAGE") == "nutricao"}
+    faltando = set(telefones) - marcados
+    assert not faltando, f"{len(faltando)} leads sem ENVIADO/STAGE: {sorted(faltando)[:5]}"
+    logs = [r for r in gs.ler_logs() if r.get("BODY") == "template enviado"]
+    assert len(logs) == len(telefones), f"{len(logs)} logs para {len(telefones)} leads"
+    print(f"OK: {len(telefones)} leads e {len(logs)} logs gravados com {args.workers} workers e checkpoints concorrentes")
+
+
+if __name__ == "__main__":
+    main()
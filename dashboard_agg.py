@@ -0,0 +1,103 @@
+"""
+Agregados do /dashboard mantidos incrementalmente.
+
+Antes o /dashboard varria todas as linhas da Página1 (e tentava até dois
+strptime por linha) a cada carregamento. Agora cada linha do snapshot da
+Página1 (lead_store._Tabela) tem a sua contribuição (stage, dia) e os
+contadores (total, por stage, por dia, por mês) são ajustados a cada escrita
+que passa pelo snapshot (mudança de stage/UPDATED_AT via atualizar_lead /
+salvar_log). O dashboard só lê os contadores: custo constante, qualquer que seja
+o nº de leads.
+
+Recontagem completa só quando o snapshot é relido (em segundo plano), sob
+demanda (/dashboard?recalcular=1) ou quando a conferência acha diferença
+(drift) entre os contadores e uma recontagem das mesmas linhas.
+"""
+import collections
+from datetime import datetime
+
+from phone_canon import normalize_to_wpp
+
+# formatos aceitos em UPDATED_AT / LAST_OUTBOUND_AT (os mesmos do dashboard antigo)
+_FORMATOS = ("%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M:%S")
+
+
+def _str(v) -> str:
+    return "" if v is None else str(v).strip()
+
+
+def _dia(dt_str: str):
+    """'YYYY-MM-DD' da data/hora, ou None se não estiver num dos formatos."""
+    for fmt in _FORMATOS:
+        try:
+            return datetime.strptime(dt_str, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def contribuicao(row: dict):
+    """(stage, dia) com que a linha entra nos contadores; None se não tiver telefone válido."""
+    tel_raw = row.get("TELEFONE") or row.get("Telefone") or row.get("telefone") or ""
+    if not normalize_to_wpp(tel_raw):
+        return None
+    stage = _str(row.get("STAGE") or "start").lower() or "start"
+    dt_str = _str(row.get("UPDATED_AT") or row.get("LAST_OUTBOUND_AT") or row.get("Data") or "")
+    return stage, (_dia(dt_str) if dt_str else None)
+
+
+class DashboardAgregados:
+    def __init__(self):
+        self.total = 0
+        self.etapas = collections.Counter()
+        self.por_dia = collections.Counter()
+        self.por_mes = collections.Counter()
+
+    @classmethod
+    def de_contribuicoes(cls, contribuicoes) -> "DashboardAgregados":
+        agg = cls()
+        for c in contribuicoes:
+            agg.somar(c)
+        return agg
+
+    def copia(self) -> "DashboardAgregados":
+        agg = DashboardAgregados()
+        agg.total = self.total
+        agg.etapas, agg.por_dia, agg.por_mes = self.etapas.copy(), self.por_dia.copy(), self.por_mes.copy()
+        return agg
+
+    def somar(self, c, sinal: int = 1):
+        if c is None:
+            return
+        stage, dia = c
+        self.total += sinal
+        self.etapas[stage] += sinal
+        if self.etapas[stage] <= 0:
+            del self.etapas[stage]
+        if dia:
+            for contador, chave in ((self.por_dia, dia), (self.por_mes, dia[:7])):
+                contador[chave] += sinal
+                if contador[chave] <= 0:
+                    del contador[chave]
+
+    def trocar(self, antiga, nova):
+        if antiga != nova:
+            self.somar(antiga, -1)
+            self.somar(nova)
+
+    def __eq__(self, outro):
+        return (isinstance(outro, DashboardAgregados) and self.total == outro.total
+                and self.etapas == outro.etapas and self.por_dia == outro.por_dia and self.por_mes == outro.por_mes)
+
+    def metricas(self, agora: datetime = None) -> dict:
+        """Os números do dashboard (dia, mês, total, por etapa) sem olhar as linhas."""
+        agora = agora or datetime.now()
+        etapas = dict(self.etapas)
+        return {
+            "dia": self.por_dia.get(agora.strftime("%Y-%m-%d"), 0),
+            "mes": self.por_mes.get(agora.strftime("%Y-%m"), 0),
+            "total": self.total,
+            "etapas": etapas,
+            "etapas_nomes": list(etapas.keys()),
+            "etapas_valores": list(etapas.values()),
+        }
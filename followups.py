@@ -0,0 +1,246 @@
+"""
+Agendador de follow-ups (lembrete quando o lead não responde).
+
+Antes: uma thread com time.sleep(45) por lead (2.000 leads = 2.000 threads) e
+tudo perdido em restart. Agora:
+- cada follow-up é uma linha na tabela `followups` (SQLite WAL em
+  FOLLOWUP_DB_PATH, o mesmo arquivo do lead_state por padrão);
+- UMA thread de timer por processo, com um min-heap dos vencimentos, acorda no
+  próximo vencimento (ou a cada FOLLOWUP_POLL s para pegar jobs de outros
+  processos e os pendentes de antes do restart);
+- os jobs vencidos são "reservados" em lote no banco (UPDATE atômico, então
+  dois workers não disparam o mesmo) e rodam num pool de FOLLOWUP_WORKERS threads;
+- job reservado por um processo que morreu volta a pendente depois de FOLLOWUP_STALE s.
+"""
+import heapq
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+FOLLOWUP_DB_PATH = os.getenv("FOLLOWUP_DB_PATH", os.getenv("LEAD_STATE_PATH", "lead_state.db"))
+FOLLOWUP_DELAY = float(os.getenv("FOLLOWUP_DELAY", "45"))
+FOLLOWUP_WORKERS = int(os.getenv("FOLLOWUP_WORKERS", "2"))
+FOLLOWUP_BATCH = int(os.getenv("FOLLOWUP_BATCH", "50"))
+FOLLOWUP_POLL = float(os.getenv("FOLLOWUP_POLL", "15"))
+FOLLOWUP_STALE = float(os.getenv("FOLLOWUP_STALE", "300"))
+FOLLOWUP_MAX_ATTEMPTS = int(os.getenv("FOLLOWUP_MAX_ATTEMPTS", "3"))
+# jobs concluídos/falhos ficam na tabela por esse tempo (consulta/debug)
+FOLLOWUP_KEEP_DONE = float(os.getenv("FOLLOWUP_KEEP_DONE", str(86400)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS followups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telefone TEXT NOT NULL,
+    due_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    claimed_by TEXT NOT NULL DEFAULT '',
+    claimed_at REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    erro TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS followups_due ON followups (status, due_at);
+CREATE INDEX IF NOT EXISTS followups_telefone ON followups (telefone, status);
+"""
+
+
+class FollowupScheduler:
+    def __init__(self, path: str, handler, workers: int = 2, batch: int = 50, poll: float = 15.0):
+        self.path = path
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.batch = max(1, batch)
+        self.poll = poll
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+        self._cond = threading.Condition()
+        self._heap = []  # (due_at, id) dos jobs conhecidos por este processo
+        self._thread = None
+        self._pool = None
+        self._rodando = 0
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.stats = {"scheduled": 0, "fired": 0, "sent": 0, "errors": 0, "reclaimed": 0}
+
+    # ---------- banco ----------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    conn.executescript(_SCHEMA)
+                    self._ready = True
+        return conn
+
+    def _reservar(self, agora: float) -> list:
+        """Marca como 'running' (deste processo) até `batch` jobs vencidos; retorna [(id, telefone, attempts)]."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # job preso num processo que morreu volta pra fila
+            reabertos = conn.execute(
+                "UPDATE followups SET status = 'pending' WHERE status = 'running' AND claimed_at < ?",
+                (agora - FOLLOWUP_STALE,),
+            ).rowcount
+            conn.execute(
+                "DELETE FROM followups WHERE status IN ('done', 'failed') AND due_at < ?",
+                (agora - FOLLOWUP_KEEP_DONE,),
+            )
+            linhas = conn.execute(
+                "SELECT id, telefone, attempts FROM followups WHERE status = 'pending' AND due_at <= ? "
+                "ORDER BY due_at LIMIT ?", (agora, self.batch),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE followups SET status = 'running', claimed_by = ?, claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(self._owner, agora, job_id) for job_id, _, _ in linhas],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.stats["reclaimed"] += reabertos
+        return linhas
+
+    def _proximo_vencimento(self):
+        row = self._conn().execute("SELECT MIN(due_at) FROM followups WHERE status = 'pending'").fetchone()
+        return row[0] if row else None
+
+    # ---------- API ----------
+    def agendar(self, telefone: str, atraso: float = None) -> int:
+        """Agenda (ou reagenda) o follow-up do telefone; um pendente por telefone."""
+        due_at = time.time() + (FOLLOWUP_DELAY if atraso is None else atraso)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM followups WHERE telefone = ? AND status = 'pending'", (telefone,))
+            job_id = conn.execute(
+                "INSERT INTO followups (telefone, due_at) VALUES (?, ?)", (telefone, due_at)
+            ).lastrowid
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.stats["scheduled"] += 1
+        self.iniciar()
+        with self._cond:
+            heapq.heappush(self._heap, (due_at, job_id))
+            self._cond.notify()
+        return job_id
+
+    def cancelar(self, telefone: str) -> int:
+        conn = self._conn()
+        return conn.execute("DELETE FROM followups WHERE telefone = ? AND status = 'pending'", (telefone,)).rowcount
+
+    def iniciar(self):
+        """Sobe o timer e o pool (uma vez por processo, depois do fork do gunicorn)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="followup")
+            # pendentes de antes do restart entram no heap pelo próximo vencimento do banco
+            proximo = self._proximo_vencimento()
+            if proximo is not None:
+                heapq.heappush(self._heap, (proximo, 0))
+            self._thread = threading.Thread(target=self._run, name="followup-timer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        ultima_consulta = time.time()
+        while True:
+            with self._cond:
+                agora = time.time()
+                # no máximo `poll` s sem olhar o banco: jobs de outros processos e
+                # 'running' presos (processo que morreu) só aparecem lá
+                espera = ultima_consulta + self.poll - agora
+                if self._heap:
+                    espera = min(espera, self._heap[0][0] - agora)
+                if espera > 0:
+                    self._cond.wait(espera)
+                    continue
+                while self._heap and self._heap[0][0] <= agora:
+                    heapq.heappop(self._heap)
+            ultima_consulta = time.time()
+            self.disparar_vencidos()
+
+    def disparar_vencidos(self) -> int:
+        """Reserva e dispara (no pool) os jobs vencidos, em lotes. Retorna quantos."""
+        total = 0
+        try:
+            while True:
+                jobs = self._reservar(time.time())
+                for job_id, telefone, attempts in jobs:
+                    with self._cond:
+                        self._rodando += 1
+                    self._pool.submit(self._executar, job_id, telefone, attempts)
+                total += len(jobs)
+                if len(jobs) < self.batch:
+                    break
+            proximo = self._proximo_vencimento()
+            if proximo is not None:
+                with self._cond:
+                    heapq.heappush(self._heap, (proximo, 0))
+        except Exception as e:
+            print("[ERRO] Agendador de follow-up:", e)
+        self.stats["fired"] += total
+        return total
+
+    def _executar(self, job_id: int, telefone: str, attempts: int):
+        status, erro = "done", ""
+        try:
+            self.handler(telefone)
+            self.stats["sent"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            erro = str(e)[:500]
+            # tenta de novo mais tarde (até FOLLOWUP_MAX_ATTEMPTS)
+            status = "pending" if attempts + 1 < FOLLOWUP_MAX_ATTEMPTS else "failed"
+            print("[ERRO] Falha ao executar follow-up:", e)
+        due_at = time.time() + FOLLOWUP_DELAY
+        try:
+            self._conn().execute(
+                "UPDATE followups SET status = ?, erro = ?, due_at = CASE WHEN ? = 'pending' THEN ? ELSE due_at END WHERE id = ?",
+                (status, erro, status, due_at, job_id),
+            )
+        finally:
+            with self._cond:
+                self._rodando -= 1
+                if status == "pending":
+                    # o disparar_vencidos já calculou o próximo vencimento sem este retry
+                    heapq.heappush(self._heap, (due_at, 0))
+                self._cond.notify_all()
+
+    def drenar(self, timeout: float) -> bool:
+        """
+        Espera os follow-ups pendentes deste processo vencerem e rodarem (ex: sheet_checker
+        antes de sair). True se não sobrou nada pendente/rodando.
+        """
+        limite = time.time() + timeout
+        while time.time() < limite:
+            conn = self._conn()
+            pendentes = conn.execute(
+                "SELECT COUNT(*) FROM followups WHERE status = 'pending' OR (status = 'running' AND claimed_by = ?)",
+                (self._owner,),
+            ).fetchone()[0]
+            if not pendentes:
+                return True
+            with self._cond:
+                self._cond.wait(min(1.0, max(0.0, limite - time.time())))
+        return False
+
+    def relatorio(self) -> dict:
+        por_status = dict(self._conn().execute("SELECT status, COUNT(*) FROM followups GROUP BY status").fetchall())
+        with self._cond:
+            return dict(self.stats, heap=len(self._heap), running=self._rodando, by_status=por_status)
+
+
+def criar_agendador(handler) -> FollowupScheduler:
+    return FollowupScheduler(FOLLOWUP_DB_PATH, handler, FOLLOWUP_WORKERS, FOLLOWUP_BATCH, FOLLOWUP_POLL)
@@ -1,8 +1,19 @@
+import atexit
 import gspread
 import json
-from datetime import datetime
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
 
+import sheets_backend
+import sheets_quota
+from phone_canon import canon_wpp, norm_digits, norm_digits_many
+from sheets_schema import LOGS_HEADER
+
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 SERVICE_ACCOUNT_FILE = "credenciais/service_account.json"
 
@@ -12,6 +23,55 @@ LOGS_SHEET_NAME = "LOGS"
 
 PROGRESS_FILE = "sheet_progress.json"
 
+# sheet_checker em modo campanha: leads novos despachados em CAMPANHA_WORKERS threads;
+# a cada CAMPANHA_CHECKPOINT_EVERY leads (ou CAMPANHA_CHECKPOINT_SECS) grava os
+# ENVIADO, descarrega as escritas acumuladas e avança o cursor
+CAMPANHA_WORKERS = int(os.getenv("CAMPANHA_WORKERS", "8"))
+CAMPANHA_CHECKPOINT_EVERY = int(os.getenv("CAMPANHA_CHECKPOINT_EVERY", "50"))
+CAMPANHA_CHECKPOINT_SECS = float(os.getenv("CAMPANHA_CHECKPOINT_SECS", "10"))
+# valor provisório do ENVIADO enquanto o lead está sendo enviado (ver _despachar_campanha)
+RESERVA_ENVIO = "ENVIANDO"
+
+# "google" (padrão) ou "memory" (planilha em memória p/ teste de carga, ver sheets_backend.py)
+SHEETS_BACKEND = os.getenv("SHEETS_BACKEND", "google").strip().lower()
+
+# renova o token alguns minutos ANTES de expirar (evita 401 no meio do webhook)
+CREDS_REFRESH_MARGIN = int(os.getenv("SHEETS_CREDS_REFRESH_MARGIN", "300"))
+# handles de planilha/aba são reabertos depois desse tempo (segundos)
+HANDLE_TTL = int(os.getenv("SHEETS_HANDLE_TTL", "900"))
+
+# LOGS em lote: grava quando juntar LOGS_BATCH_SIZE linhas ou quando a mais antiga
+# estiver esperando há LOGS_MAX_DELAY segundos (0 = grava na hora, sem buffer)
+LOGS_BATCH_SIZE = int(os.getenv("LOGS_BATCH_SIZE", "50"))
+LOGS_MAX_DELAY = float(os.getenv("LOGS_MAX_DELAY", "2.0"))
+LOGS_BUFFER_MAX = int(os.getenv("LOGS_BUFFER_MAX", "5000"))
+# depois de um append incerto (timeout/5xx), quantas linhas além do lote são lidas
+# do fim da partição para ver se ele entrou (appends de outros processos no meio)
+LOGS_VERIFY_SLACK = int(os.getenv("LOGS_VERIFY_SLACK", "200"))
+# depois de um flush que falhou: espera 1s, 2s, 4s... até este teto antes de tentar de novo
+LOGS_RETRY_MAX_DELAY = float(os.getenv("LOGS_RETRY_MAX_DELAY", "60"))
+
+# LOGS particionado por mês (LOGS_2026_10, LOGS_2026_11, ...). A aba LOGS antiga
+# continua sendo lida como a partição mais antiga. LOGS_PARTITIONED=0 grava tudo em LOGS.
+LOGS_PARTITIONED = os.getenv("LOGS_PARTITIONED", "1") == "1"
+# partições mais velhas que isso (em meses) saem da planilha principal em arquivar_logs()
+LOGS_HOT_MONTHS = int(os.getenv("LOGS_HOT_MONTHS", "6"))
+LOGS_ARCHIVE_SPREADSHEET_ID = os.getenv("LOGS_ARCHIVE_SPREADSHEET_ID", "")
+
+# índice telefone -> linhas do LOGS (por partição), salvo em disco a cada CONVERSAS_INDEX_SAVE_EVERY s
+CONVERSAS_INDEX_FILE = os.getenv("CONVERSAS_INDEX_FILE", "conversas_index.json")
+CONVERSAS_INDEX_SAVE_EVERY = float(os.getenv("CONVERSAS_INDEX_SAVE_EVERY", "30"))
+
+# cabeçalho (linha 1) de cada aba fica em cache; relido depois de HEADERS_TTL segundos,
+# quando o nº de colunas muda ou quando uma coluna pedida não é encontrada
+HEADERS_TTL = float(os.getenv("SHEETS_HEADERS_TTL", "600"))
+HEADERS_MISS_RELOAD = float(os.getenv("SHEETS_HEADERS_MISS_RELOAD", "60"))
+
+# índice telefone->linha da Página1: revalida (lendo só a coluna TELEFONE) depois de
+# LEADS_INDEX_TTL segundos e relê a aba inteira no máximo a cada LEADS_INDEX_MAX_AGE
+LEADS_INDEX_TTL = float(os.getenv("LEADS_INDEX_TTL", "30"))
+LEADS_INDEX_MAX_AGE = float(os.getenv("LEADS_INDEX_MAX_AGE", "600"))
+
 
 def _now_str():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -23,90 +83,875 @@ def _safe_str(v):
     return str(v).strip()
 
 
-def _norm_tel_digits(v) -> str:
-    """
-    Normaliza qualquer telefone para SOMENTE DÍGITOS com país 55 quando possível.
-    Aceita:
-      - 6298...
-      - +556298...
-      - whatsapp:+556298...
-    """
-    s = _safe_str(v)
-    digits = "".join(ch for ch in s if ch.isdigit())
+# -------------------------------------------------------------
+#  COTA DA API (toda chamada ao Sheets passa pelo agendador)
+# -------------------------------------------------------------
+_quota = sheets_quota.QuotaScheduler.from_env()
+
+# chamadas que não podem ser repetidas depois de um 5xx (podem ter sido aplicadas)
+_NAO_IDEMPOTENTES = {"append_row", "append_rows", "delete_rows", "add_worksheet", "del_worksheet", "spreadsheet_batch_update"}
 
 
-    # BR: se veio sem o 9 (55 + DDD + 8 dígitos = 12), insere "9" após o DDD
-    if len(digits) == 12 and digits.startswith("55"):
-        digits = digits[:4] + "9" + digits[4:]
+def _idempotente_http(method: str, endpoint: str) -> bool:
+    if method.lower() in ("get", "put"):
+        return True
+    # values:append e spreadsheets:batchUpdate (deleteDimension, addSheet...) não são
+    return not (endpoint.endswith(":append") or (endpoint.endswith(":batchUpdate") and "/values:" not in endpoint))
+
+
+class _ClientComCota(gspread.Client):
+    """gspread.Client cujas requests HTTP passam pelo agendador de cota."""
+
+    def request(self, method, endpoint, *args, **kwargs):
+        kind = "read" if method.lower() == "get" else "write"
+        return _quota.chamar(
+            kind,
+            lambda: super(_ClientComCota, self).request(method, endpoint, *args, **kwargs),
+            idempotente=_idempotente_http(method, endpoint),
+        )
 
-    # DDD + número (10/11) -> prefixa 55
-    if len(digits) in (10, 11):
-        return "55" + digits
 
-    # Já veio com 55 (12/13)
-    if len(digits) in (12, 13) and digits.startswith("55"):
-        return digits
+def _memory_hook(kind: str, method: str, fn):
+    return _quota.chamar(kind, fn, idempotente=method not in _NAO_IDEMPOTENTES)
 
-    return digits
 
+def prioridade_sheets(nivel: str):
+    """Context manager: chamadas desta thread como sheets_quota.INTERATIVO ou SEGUNDO_PLANO."""
+    return sheets_quota.prioridade(nivel)
 
-def _canon_wpp(v) -> str:
-    d = _norm_tel_digits(v)
-    return f"whatsapp:+{d}" if d else ""
+
+def sheets_quota_stats() -> dict:
+    """Uso da cota de leitura/escrita no último minuto, esperas, 429 e retries."""
+    return _quota.relatorio()
+
+
+# -------------------------------------------------------------
+#  CLIENTE / PLANILHA / ABAS EM CACHE (um por processo)
+# -------------------------------------------------------------
+class _SheetsRegistry:
+    """
+    Guarda credenciais, client gspread, planilha e abas abertas.
+    Evita reler o JSON da service account + authorize + open_by_key a cada chamada.
+    Thread-safe (webhook + threads de follow-up usam o mesmo registry).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._creds = None
+        self._client = None
+        self._spreadsheet = None
+        self._spreadsheet_opened_at = 0.0
+        self._worksheets = {}  # titulo -> (ws, opened_at)
+        self._titles = None
+        self._titles_at = 0.0
+        self.stats = {
+            "client_hits": 0,
+            "client_misses": 0,
+            "spreadsheet_hits": 0,
+            "spreadsheet_misses": 0,
+            "worksheet_hits": 0,
+            "worksheet_misses": 0,
+            "creds_refreshes": 0,
+        }
+
+    def _creds_expiring(self) -> bool:
+        if not self._creds.valid:
+            return True
+        expiry = self._creds.expiry  # google-auth usa datetime UTC "naive"
+        if expiry is None:
+            return False
+        agora = datetime.now(timezone.utc).replace(tzinfo=None)
+        return expiry - agora < timedelta(seconds=CREDS_REFRESH_MARGIN)
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self.stats["client_misses"] += 1
+                if SHEETS_BACKEND == "memory":
+                    self._client = sheets_backend.memory_client(SHEET_NAME)
+                    self._client.spreadsheet.request_hook = _memory_hook
+                    return self._client
+                self._creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+                self._client = gspread.authorize(self._creds, client_factory=_ClientComCota)
+            else:
+                self.stats["client_hits"] += 1
+
+            if self._creds is not None and self._creds_expiring():
+                self._creds.refresh(Request())
+                self.stats["creds_refreshes"] += 1
+            return self._client
+
+    def spreadsheet(self):
+        with self._lock:
+            client = self.client()
+            fresh = time.monotonic() - self._spreadsheet_opened_at < HANDLE_TTL
+            if self._spreadsheet is not None and fresh:
+                self.stats["spreadsheet_hits"] += 1
+                return self._spreadsheet
+
+            self.stats["spreadsheet_misses"] += 1
+            self._spreadsheet = client.open_by_key(SPREADSHEET_ID)
+            self._spreadsheet_opened_at = time.monotonic()
+            self._worksheets.clear()
+            self._titles = None
+            return self._spreadsheet
+
+    def worksheet(self, titulo: str):
+        with self._lock:
+            sh = self.spreadsheet()
+            cached = self._worksheets.get(titulo)
+            if cached and time.monotonic() - cached[1] < HANDLE_TTL:
+                self.stats["worksheet_hits"] += 1
+                return cached[0]
+
+            self.stats["worksheet_misses"] += 1
+            ws = sh.worksheet(titulo)
+            self._worksheets[titulo] = (ws, time.monotonic())
+            return ws
+
+    def titles(self) -> list:
+        """Títulos de todas as abas (uma chamada de metadados, que também abre os handles)."""
+        with self._lock:
+            sh = self.spreadsheet()
+            if self._titles is not None and time.monotonic() - self._titles_at < HANDLE_TTL:
+                return list(self._titles)
+
+            agora = time.monotonic()
+            abas = sh.worksheets()
+            for ws in abas:
+                self._worksheets[ws.title] = (ws, agora)
+            self._titles = [ws.title for ws in abas]
+            self._titles_at = agora
+            return list(self._titles)
+
+    def add_worksheet(self, titulo: str, rows: int, cols: int):
+        with self._lock:
+            ws = self.spreadsheet().add_worksheet(title=titulo, rows=rows, cols=cols)
+            self._worksheets[titulo] = (ws, time.monotonic())
+            if self._titles is not None:
+                self._titles.append(titulo)
+            return ws
+
+    def del_worksheet(self, titulo: str):
+        with self._lock:
+            ws = self.worksheet(titulo)
+            self.spreadsheet().del_worksheet(ws)
+            self.invalidate(titulo)
+
+    def invalidate(self, titulo: str = None):
+        """Descarta handles (todos, ou só de uma aba) para forçar reabertura."""
+        with self._lock:
+            self._titles = None
+            if titulo is None:
+                self._spreadsheet = None
+                self._spreadsheet_opened_at = 0.0
+                self._worksheets.clear()
+            else:
+                self._worksheets.pop(titulo, None)
+
+
+_registry = _SheetsRegistry()
+
+
+def sheets_cache_stats() -> dict:
+    """Contadores de hit/miss do cache de client/planilha/abas."""
+    with _registry._lock:
+        return dict(_registry.stats)
+
+
+def invalidar_cache_planilha(nome_aba: str = None):
+    _registry.invalidate(nome_aba)
 
 
 def abrir_planilha():
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    client = gspread.authorize(creds)
-    sheet = client.open_by_key(SPREADSHEET_ID)
-    return sheet.worksheet(SHEET_NAME)
+    return _registry.worksheet(SHEET_NAME)
 
 
 def abrir_aba(nome_aba: str):
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    client = gspread.authorize(creds)
-    sh = client.open_by_key(SPREADSHEET_ID)
-    return sh.worksheet(nome_aba)
+    return _registry.worksheet(nome_aba)
+
+
+# titulo -> handle da aba de LOGS cujo cabeçalho já foi conferido (o registry troca
+# o handle quando reabre a aba, e aí confere de novo lendo só a linha 1)
+_logs_header_ok = {}
+_logs_header_lock = threading.Lock()
 
 
-def ensure_logs_worksheet():
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    client = gspread.authorize(creds)
-    sh = client.open_by_key(SPREADSHEET_ID)
+def logs_partition_name(quando: datetime = None) -> str:
+    """Aba de LOGS do mês de `quando` (padrão: agora), ex: LOGS_2026_10."""
+    if not LOGS_PARTITIONED:
+        return LOGS_SHEET_NAME
+    quando = quando or datetime.now()
+    return f"{LOGS_SHEET_NAME}_{quando.year}_{quando.month:02d}"
 
+
+def _partition_month(titulo: str):
+    """(ano, mês) da partição; (0, 0) para a aba LOGS antiga; None se não for aba de LOGS."""
+    if titulo == LOGS_SHEET_NAME:
+        return (0, 0)
+    prefixo = LOGS_SHEET_NAME + "_"
+    if not titulo.startswith(prefixo):
+        return None
     try:
-        ws = sh.worksheet(LOGS_SHEET_NAME)
-    except Exception:
-        ws = sh.add_worksheet(title=LOGS_SHEET_NAME, rows=2000, cols=10)
+        ano, mes = titulo[len(prefixo):].split("_")
+        return (int(ano), int(mes))
+    except ValueError:
+        return None
 
-    values = ws.get_all_values()
-    if not values:
-        ws.append_row(
-            ["TIMESTAMP", "TELEFONE", "DIRECTION", "STAGE", "BODY", "MESSAGE_SID", "TEMPLATE_SID"],
-            value_input_option="USER_ENTERED",
-        )
+
+def logs_partitions(desde: datetime = None, ate: datetime = None) -> list:
+    """
+    Abas de LOGS existentes que podem ter linhas entre `desde` e `ate` (mais antiga primeiro).
+    A aba LOGS antiga só entra se o período começar antes (ou no mês) da primeira partição.
+    """
+    partes = sorted(
+        (m, t) for t in _registry.titles() for m in [_partition_month(t)] if m is not None
+    )
+    mensais = [m for m, _ in partes if m != (0, 0)]
+
+    escolhidas = []
+    for m, t in partes:
+        if m == (0, 0):
+            if desde is None or not mensais or (desde.year, desde.month) <= mensais[0]:
+                escolhidas.append(t)
+            continue
+        if desde is not None and m < (desde.year, desde.month):
+            continue
+        if ate is not None and m > (ate.year, ate.month):
+            continue
+        escolhidas.append(t)
+    return escolhidas
+
+
+def ensure_logs_worksheet(titulo: str = None):
+    """Aba de LOGS (padrão: partição do mês atual), criada com cabeçalho se não existir."""
+    titulo = titulo or logs_partition_name()
+    try:
+        ws = _registry.worksheet(titulo)
+    except gspread.exceptions.WorksheetNotFound:
+        try:
+            ws = _registry.add_worksheet(titulo, rows=2000, cols=10)
+        except gspread.exceptions.APIError:
+            # outro worker criou a partição ao mesmo tempo
+            _registry.invalidate(titulo)
+            ws = _registry.worksheet(titulo)
+
+    with _logs_header_lock:
+        if _logs_header_ok.get(titulo) is ws:
+            return ws
+
+        cabecalho = ws.row_values(1)
+        if not cabecalho:
+            ws.append_row(LOGS_HEADER, value_input_option="USER_ENTERED")
+            cabecalho = LOGS_HEADER
+        _schema(ws, cabecalho)
+        _logs_header_ok[titulo] = ws
     return ws
 
 
+def _logs_valores(titulo: str) -> list:
+    """Linhas de uma aba de LOGS (sem cabeçalho) na ordem do LOGS_HEADER."""
+    valores = _registry.worksheet(titulo).get_all_values()
+    if not valores:
+        return []
+    headers_l = [h.strip().lower() for h in valores[0]]
+    if headers_l == [h.lower() for h in LOGS_HEADER]:
+        return valores[1:]
+    return [[_row_to_dict(headers_l, row).get(h.lower(), "") for h in LOGS_HEADER] for row in valores[1:]]
+
+
+def ler_logs_valores(desde: datetime = None, ate: datetime = None) -> list:
+    """[LOGS_HEADER] + linhas de todas as partições do período (uma leitura por partição)."""
+    flush_logs()
+    valores = [list(LOGS_HEADER)]
+    for titulo in logs_partitions(desde, ate):
+        valores.extend(_logs_valores(titulo))
+    return valores
+
+
+def ler_logs(desde: datetime = None, ate: datetime = None) -> list:
+    """Registros de LOGS (como get_all_records) lendo só as partições do período."""
+    flush_logs()
+    registros = []
+    for titulo in logs_partitions(desde, ate):
+        registros.extend(_registry.worksheet(titulo).get_all_records())
+    return registros
+
+
+# -------------------------------------------------------------
+#  LOGS EM LOTE (write-behind com append_rows)
+# -------------------------------------------------------------
+class _LogWriter:
+    """
+    Junta as linhas de LOG de todas as requests do processo e grava com UM append_rows.
+    Dispara por tamanho (LOGS_BATCH_SIZE) ou tempo (LOGS_MAX_DELAY); flush também no exit.
+
+    append_rows não é idempotente: se falhar de um jeito que não garante que nada
+    foi gravado (timeout, 5xx), o bloco fica "incerto" e, antes de regravar, o fim
+    da partição é lido; se o bloco já está lá, não é gravado de novo. Depois de
+    uma falha a thread espera com backoff exponencial (até LOGS_RETRY_MAX_DELAY)
+    antes do próximo flush, mesmo com o buffer cheio.
+    """
+
+    def __init__(self, batch_size: int, max_delay: float, buffer_max: int):
+        self.batch_size = max(1, batch_size)
+        self.max_delay = max_delay
+        self.buffer_max = buffer_max
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._rows = []
+        self._incertos = []  # (partição, linhas) de appends que podem ter sido aplicados
+        self._oldest_at = 0.0
+        self._falhas = 0  # flushes seguidos que falharam (backoff da thread)
+        self._thread = None
+        self.stats = {"rows": 0, "batches": 0, "errors": 0, "dropped": 0, "uncertain": 0, "already_written": 0}
+
+    def add(self, row: list):
+        self.add_many([row])
+
+    def add_many(self, rows: list):
+        if self.max_delay <= 0:
+            with self._cond:
+                self._rows.extend(rows)
+            self.flush()
+            return
+
+        with self._cond:
+            if not self._rows:
+                self._oldest_at = time.monotonic()
+            self._rows.extend(rows)
+            # thread só nasce no primeiro log (depois do fork do gunicorn)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="logs-writer", daemon=True)
+                self._thread.start()
+            if len(self._rows) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        with sheets_quota.prioridade(sheets_quota.SEGUNDO_PLANO):
+            while True:
+                with self._cond:
+                    # blocos incertos também acordam a thread (conferir sem esperar log novo)
+                    while not self._rows and not self._incertos:
+                        self._cond.wait()
+                    if self._falhas:
+                        # erro persistente da API: não fica refazendo o flush em loop
+                        ate = time.monotonic() + min(LOGS_RETRY_MAX_DELAY, 2 ** (self._falhas - 1))
+                        while True:
+                            restante = ate - time.monotonic()
+                            if restante <= 0:
+                                break
+                            self._cond.wait(restante)
+                    while len(self._rows) < self.batch_size:
+                        restante = self._oldest_at + self.max_delay - time.monotonic()
+                        if restante <= 0:
+                            break
+                        self._cond.wait(restante)
+                # cota de escrita apertada: espera ANTES de pegar o lote, assim ele junta mais linhas
+                _quota.aguardar("write")
+                self.flush()
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._cond:
+                batch, self._rows = self._rows, []
+                incertos, self._incertos = self._incertos, []
+            if not batch and not incertos:
+                return 0
+
+            # blocos incertos: só os que NÃO estão no fim da partição voltam a ser gravados
+            pendentes = []
+            for n, (titulo, linhas) in enumerate(incertos):
+                try:
+                    gravado = _bloco_ja_gravado(titulo, linhas)
+                except Exception as e:
+                    print("[ERRO AO CONFERIR LOGS INCERTOS]", e)
+                    with self._cond:
+                        self._falhas += 1
+                        self._incertos[:0] = incertos[n:]
+                        self._rows[:0] = pendentes + batch
+                    return 0
+                if gravado:
+                    with self._cond:
+                        self.stats["already_written"] += len(linhas)
+                else:
+                    pendentes.extend(linhas)
+            batch = pendentes + batch
+
+            gravadas = 0
+            por_aba = _logs_por_particao(batch)
+            for n, (titulo, linhas) in enumerate(por_aba):
+                try:
+                    append_log_rows_particao(titulo, linhas)
+                except Exception as e:
+                    print("[ERRO AO GRAVAR LOGS EM LOTE]", e)
+                    with self._cond:
+                        self._falhas += 1
+                        self.stats["errors"] += 1
+                        resto = [row for _, outras in por_aba[n + 1:] for row in outras]
+                        if sheets_quota.escrita_incerta(e):
+                            # pode ter entrado: confere antes de gravar de novo
+                            self.stats["uncertain"] += len(linhas)
+                            self._incertos.append((titulo, linhas))
+                        else:
+                            resto = linhas + resto
+                        # devolve pro início do buffer; tenta de novo no próximo disparo
+                        self._rows[:0] = resto
+                        excesso = len(self._rows) - self.buffer_max
+                        if excesso > 0:
+                            del self._rows[:excesso]
+                            self.stats["dropped"] += excesso
+                            print(f"[WARN] Buffer de LOGS cheio, {excesso} linhas descartadas")
+                        self._oldest_at = time.monotonic()
+                        self.stats["rows"] += gravadas
+                    return gravadas
+                gravadas += len(linhas)
+
+            with self._cond:
+                self._falhas = 0
+                self.stats["rows"] += gravadas
+                self.stats["batches"] += 1
+            return gravadas
+
+
+_log_writer = _LogWriter(LOGS_BATCH_SIZE, LOGS_MAX_DELAY, LOGS_BUFFER_MAX)
+atexit.register(_log_writer.flush)
+
+
+def flush_logs() -> int:
+    """Grava agora o que estiver no buffer de LOGS. Retorna quantas linhas foram gravadas."""
+    return _log_writer.flush()
+
+
+def logs_writer_stats() -> dict:
+    with _log_writer._cond:
+        return dict(_log_writer.stats, pending=len(_log_writer._rows),
+                    pending_uncertain=sum(len(linhas) for _, linhas in _log_writer._incertos))
+
+
+def make_log_row(telefone_wpp: str, direction: str, stage: str, body: str, message_sid: str = "", template_sid: str = "", timestamp: str = ""):
+    """Linha no formato do LOGS_HEADER."""
+    return [
+        timestamp or _now_str(),
+        canon_wpp(telefone_wpp) or _safe_str(telefone_wpp),
+        direction, stage, body, message_sid, template_sid,
+    ]
+
+
+def _logs_por_particao(rows) -> list:
+    """[(partição, linhas)] na ordem em que aparecem."""
+    por_aba = {}
+    for row in rows:
+        try:
+            quando = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
+        except (ValueError, TypeError):
+            quando = None
+        por_aba.setdefault(logs_partition_name(quando), []).append(row)
+    return list(por_aba.items())
+
+
+def append_log_rows_particao(titulo: str, linhas):
+    ws = ensure_logs_worksheet(titulo)
+    resp = ws.append_rows(linhas, value_input_option="USER_ENTERED")
+    _conversas.on_append(titulo, linhas, _appended_row_idx(resp, 0))
+
+
+def append_log_rows(rows):
+    """Grava linhas prontas (make_log_row) direto no LOGS, com UM append_rows por partição."""
+    for titulo, linhas in _logs_por_particao(rows):
+        append_log_rows_particao(titulo, linhas)
+
+
+def _bloco_ja_gravado(titulo: str, linhas) -> bool:
+    """
+    O append incerto de `linhas` entrou na partição? Lê só o fim dela (tamanho do
+    bloco + LOGS_VERIFY_SLACK linhas) e procura o bloco inteiro, contíguo, ali.
+    Compara sem o TIMESTAMP (o Sheets pode devolvê-lo em outro formato).
+    """
+    ws = ensure_logs_worksheet(titulo)
+    n = len(ws.col_values(1))
+    if n < 2:
+        return False
+    largura = len(LOGS_HEADER)
+    inicio = max(2, n - len(linhas) - LOGS_VERIFY_SLACK + 1)
+    ultima_col = gspread.utils.rowcol_to_a1(1, largura)[:-1]
+    fim_da_aba = ws.get(f"A{inicio}:{ultima_col}{n}")
+
+    def chave(row):
+        row = list(row) + [""] * (largura - len(row))
+        return tuple(_safe_str(v) for v in row[1:largura])
+
+    lidas = [chave(r) for r in fim_da_aba]
+    bloco = [chave(r) for r in linhas]
+    return any(lidas[i:i + len(bloco)] == bloco for i in range(len(lidas) - len(bloco) + 1))
+
+
 def append_log_row(telefone_wpp: str, direction: str, stage: str, body: str, message_sid: str = "", template_sid: str = ""):
-    ws = ensure_logs_worksheet()
-    ws.append_row(
-        [_now_str(), _canon_wpp(telefone_wpp) or _safe_str(telefone_wpp), direction, stage, body, message_sid, template_sid],
-        value_input_option="USER_ENTERED",
-    )
+    _log_writer.add(make_log_row(telefone_wpp, direction, stage, body, message_sid, template_sid))
+
+
+def enfileirar_logs(rows):
+    """Linhas prontas (make_log_row) pelo gravador em lote: com LOGS_MAX_DELAY=0, UM append_rows na hora."""
+    _log_writer.add_many(list(rows))
+
+
+# -------------------------------------------------------------
+#  ÍNDICE DE CONVERSAS (telefone -> linhas do LOGS, por partição)
+# -------------------------------------------------------------
+class _ConversasIndex:
+    """
+    Para cada partição de LOGS: nº de linhas conhecidas, coluna TELEFONE e
+    dígitos do telefone -> linhas. Montado numa passada por partição, atualizado
+    nos nossos appends/deletes e salvo em disco (CONVERSAS_INDEX_FILE).
+    Abrir uma conversa lê só as linhas daquele lead (batch_get por partição).
+
+    Na partição do mês, cada consulta lê a coluna TELEFONE e confere o nº de linhas
+    e o telefone da última linha conhecida: se outro processo apagou/arquivou
+    linhas, a partição é reindexada (em vez de pular linhas). `lock` protege só o
+    estado em memória; as leituras no Sheets rodam fora dele.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.partes = None  # titulo -> {"n": int, "header": [...], "phones": {digits: [rows]}}
+        self._dirty = False
+        self._saved_at = 0.0
+        self.stats = {"builds": 0, "tail_reads": 0, "lookups": 0, "rebuilds_stale": 0}
+
+    # ---------- persistência ----------
+    def _load(self):
+        if self.partes is not None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.partes = json.load(f).get("partes", {})
+        except Exception:
+            self.partes = {}
+
+    def save(self, force: bool = False):
+        with self.lock:
+            if not self._dirty or self.partes is None:
+                return
+            if not force and time.monotonic() - self._saved_at < CONVERSAS_INDEX_SAVE_EVERY:
+                return
+            tmp = self.path + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"partes": self.partes}, f, ensure_ascii=False, separators=(",", ":"))
+                os.replace(tmp, self.path)
+                self._dirty = False
+                self._saved_at = time.monotonic()
+            except Exception as e:
+                print("[WARN] Falha ao salvar índice de conversas:", e)
+
+    def _changed(self):
+        self._dirty = True
+        self.save()
+
+    # ---------- montagem ----------
+    @staticmethod
+    def _tel_col(parte: dict) -> int:
+        return _col([h.strip().lower() for h in parte["header"]], "telefone")
+
+    def _index_tels(self, parte: dict, tels, primeira_linha: int):
+        ultimo = None
+        for i, digits in enumerate(norm_digits_many(tels), start=primeira_linha):
+            if digits:
+                parte["phones"].setdefault(digits, []).append(i)
+            ultimo = digits
+        fim = primeira_linha + len(tels) - 1
+        if fim >= parte["n"]:
+            parte["n"] = fim
+            parte["ultimo"] = ultimo if tels else parte.get("ultimo")
+
+    def _index_rows(self, parte: dict, rows, primeira_linha: int):
+        tel_col = self._tel_col(parte)
+        self._index_tels(parte, [row[tel_col - 1] if len(row) >= tel_col else "" for row in rows], primeira_linha)
+
+    def _build(self, titulo: str):
+        """Lê a partição inteira (fora do lock) e troca o índice dela."""
+        valores = _registry.worksheet(titulo).get_all_values()
+        parte = {"n": 1, "header": valores[0] if valores else list(LOGS_HEADER), "phones": {}, "ultimo": None}
+        self._index_rows(parte, valores[1:], 2)
+        with self.lock:
+            self.partes[titulo] = parte
+            self.stats["builds"] += 1
+            self._changed()
+        return parte
+
+    def _sincronizar(self, titulo: str, parte: dict):
+        """
+        Partição do mês: confere o índice contra a coluna TELEFONE atual (uma
+        leitura, fora do lock). Mais linhas = appends de fora (indexa só as novas);
+        menos linhas, ou outro telefone na última linha conhecida = linhas
+        apagadas/arquivadas por fora (reindexa pela coluna).
+        """
+        with self.lock:
+            tel_col = self._tel_col(parte)
+        coluna = _registry.worksheet(titulo).col_values(tel_col)
+        with self.lock:
+            self.stats["tail_reads"] += 1
+            parte = self.partes.get(titulo)
+            if parte is None:
+                return
+            n = parte["n"]
+            ultimo = parte.get("ultimo")
+            mudou = len(coluna) < n or (n >= 2 and ultimo is not None and norm_digits(coluna[n - 1]) != ultimo)
+            if mudou:
+                self.stats["rebuilds_stale"] += 1
+                parte = {"n": 1, "header": parte["header"], "phones": {}, "ultimo": None}
+                self._index_tels(parte, coluna[1:], 2)
+                self.partes[titulo] = parte
+                self._changed()
+            elif len(coluna) > n:
+                self._index_tels(parte, coluna[n:], n + 1)
+                self._changed()
+
+    # ---------- atualização pelos nossos writes ----------
+    def on_append(self, titulo: str, rows, primeira_linha: int):
+        with self.lock:
+            self._load()
+            parte = self.partes.get(titulo)
+            if parte is None:
+                return
+            if primeira_linha == parte["n"] + 1:
+                self._index_rows(parte, rows, primeira_linha)
+                self._changed()
+            # senão houve append de fora no meio: a leitura do fim (_tail) pega tudo
+
+    def on_delete(self, titulo: str, rows):
+        with self.lock:
+            self._load()
+            parte = self.partes.get(titulo)
+            if parte is None or not rows:
+                return
+            apagadas = sorted(set(rows))
+            apagadas_set = set(apagadas)
+
+            def nova_linha(r):
+                # quantas apagadas estão acima de r
+                lo, hi = 0, len(apagadas)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if apagadas[mid] < r:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                return r - lo
+
+            phones = {}
+            for digits, linhas in parte["phones"].items():
+                novas = [nova_linha(r) for r in linhas if r not in apagadas_set]
+                if novas:
+                    phones[digits] = novas
+            parte["phones"] = phones
+            parte["n"] -= len(apagadas_set)
+            parte["ultimo"] = next((d for d, linhas in phones.items() if parte["n"] in linhas), None)
+            self._changed()
+
+    def drop(self, titulo: str):
+        with self.lock:
+            self._load()
+            if self.partes.pop(titulo, None) is not None:
+                self._changed()
+
+    # ---------- consulta ----------
+    def rows_for(self, telefone_any) -> list:
+        """Registros (como get_all_records) de um telefone, em ordem, de todas as partições."""
+        digits = norm_digits(telefone_any)
+        if not digits:
+            return []
+
+        flush_logs()
+        atual = logs_partition_name()
+        titulos = logs_partitions()
+        with self.lock:
+            self._load()
+            self.stats["lookups"] += 1
+            for titulo in list(self.partes):
+                if titulo not in titulos:
+                    self.partes.pop(titulo)  # aba arquivada/apagada
+        registros = []
+        for titulo in titulos:
+            with self.lock:
+                parte = self.partes.get(titulo)
+            if parte is None:
+                self._build(titulo)
+            elif titulo == atual:
+                self._sincronizar(titulo, parte)
+            registros.extend(self._fetch(titulo, digits))
+        self.save()
+        return registros
+
+    def _fetch(self, titulo: str, digits: str, retry: bool = True) -> list:
+        with self.lock:
+            parte = self.partes.get(titulo)
+            if parte is None:
+                return []
+            linhas = list(parte["phones"].get(digits, []))
+            header = list(parte["header"])
+        if not linhas:
+            return []
+
+        ultima_col = gspread.utils.rowcol_to_a1(1, max(len(header), 1))[:-1]
+        ranges = [f"A{inicio}:{ultima_col}{fim}" for inicio, fim in reversed(_row_ranges(linhas))]
+        blocos = _registry.worksheet(titulo).batch_get(ranges)
+
+        headers_l = [h.strip().lower() for h in header]
+        tel_col = _col(headers_l, "telefone")
+        registros = []
+        for (inicio, fim), bloco in zip(reversed(_row_ranges(linhas)), blocos):
+            bloco = list(bloco) + [[]] * (fim - inicio + 1 - len(bloco))
+            for row in bloco:
+                tel = row[tel_col - 1] if len(row) >= tel_col else ""
+                if norm_digits(tel) != digits:
+                    # linhas mudaram de lugar por fora: remonta a partição e tenta de novo
+                    if not retry:
+                        return []
+                    with self.lock:
+                        self.stats["rebuilds_stale"] += 1
+                    self._build(titulo)
+                    return self._fetch(titulo, digits, retry=False)
+                registros.append({h: _safe_str(row[i]) if i < len(row) else "" for i, h in enumerate(header)})
+        return registros
+
+
+_conversas = _ConversasIndex(CONVERSAS_INDEX_FILE)
+atexit.register(_conversas.save, True)
+
+
+def ler_conversa(telefone_any) -> list:
+    """Logs de UM telefone (todas as partições) sem baixar o LOGS inteiro."""
+    return _conversas.rows_for(telefone_any)
+
+
+def conversas_index_stats() -> dict:
+    with _conversas.lock:
+        return dict(_conversas.stats, partitions=len(_conversas.partes or {}))
+
+
+# -------------------------------------------------------------
+#  CABEÇALHO EM CACHE (nome da coluna -> número, com apelidos)
+# -------------------------------------------------------------
+# nomes alternativos aceitos no cabeçalho (comparação sem maiúsculas/espaços)
+COLUMN_ALIASES = {
+    "telefone": ("telefone", "phone", "celular", "whatsapp"),
+    "nome": ("nome", "name"),
+    "email": ("email", "e-mail"),
+}
+
+
+class _HeaderSchema:
+    """
+    Linha 1 de uma aba, lida com ws.get("1:1") (não a aba inteira), com o
+    dict nome->coluna pronto. `version` sobe a cada mudança de cabeçalho.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.lock = threading.Lock()
+        self.headers = []
+        self.headers_l = []
+        self.col_map = {}
+        self.version = 0
+        self.read_at = 0.0
+        self.col_count = None
+        self._miss_reload_at = 0.0
+        self.stats = {"reads": 0, "hits": 0, "changes": 0}
+
+    def load(self, header_row):
+        """Atualiza a partir de uma linha 1 já lida (sem chamada de API)."""
+        headers = [_safe_str(h) for h in header_row]
+        while headers and not headers[-1]:
+            headers.pop()
+        with self.lock:
+            if headers != self.headers:
+                self.headers = headers
+                self.headers_l = [h.lower() for h in headers]
+                col_map = {}
+                for i, h in enumerate(self.headers_l, start=1):
+                    col_map.setdefault(h, i)
+                for nome, apelidos in COLUMN_ALIASES.items():
+                    for apelido in apelidos:
+                        if apelido in col_map:
+                            col_map.setdefault(nome, col_map[apelido])
+                            break
+                self.col_map = col_map
+                self.version += 1
+                self.stats["changes"] += 1
+            self.read_at = time.monotonic()
+            self.col_count = getattr(self.ws, "col_count", None)
+        return self
+
+    def reload(self):
+        self.stats["reads"] += 1
+        linhas = self.ws.get("1:1")
+        return self.load(linhas[0] if linhas else [])
+
+    def ensure(self):
+        expirado = not self.read_at or time.monotonic() - self.read_at > HEADERS_TTL
+        if expirado or getattr(self.ws, "col_count", None) != self.col_count:
+            self.reload()
+        else:
+            self.stats["hits"] += 1
+        if not self.headers:
+            raise Exception("Planilha sem cabeçalho.")
+        return self
+
+    def get(self, nome: str):
+        """Coluna (1-based) de `nome` ou de um apelido; None se não existir."""
+        return self.col_map.get(_safe_str(nome).lower())
+
+    def col(self, nome: str) -> int:
+        """Como get(), mas relê o cabeçalho uma vez se não achar (coluna nova) e falha se continuar faltando."""
+        col = self.get(nome)
+        if col is None and time.monotonic() - self._miss_reload_at > HEADERS_MISS_RELOAD:
+            self._miss_reload_at = time.monotonic()
+            col = self.reload().get(nome)
+        if col is None:
+            raise ValueError(f"Coluna {nome.upper()} não encontrada no cabeçalho de {self.ws.title}.")
+        return col
+
+
+_header_schemas = {}
+_header_schemas_lock = threading.Lock()
+
+
+def _schema(ws, header_row=None) -> _HeaderSchema:
+    """Cabeçalho em cache da aba (recarregado se preciso). Passe header_row se já leu a linha 1."""
+    with _header_schemas_lock:
+        schema = _header_schemas.get(ws.id)
+        if schema is None or schema.ws is not ws:
+            schema = _HeaderSchema(ws)
+            _header_schemas[ws.id] = schema
+    if header_row is not None:
+        return schema.load(header_row)
+    return schema.ensure()
+
+
+def header_cache_stats() -> dict:
+    with _header_schemas_lock:
+        return {s.ws.title: dict(s.stats, version=s.version, cols=len(s.headers)) for s in _header_schemas.values()}
 
 
 def _headers(ws):
+    """Aba inteira (quando o chamador precisa de todas as linhas); aproveita p/ atualizar o cabeçalho em cache."""
     valores = ws.get_all_values()
     if not valores:
         raise Exception("Planilha sem cabeçalho.")
-    headers = [h.strip() for h in valores[0]]
-    headers_l = [h.strip().lower() for h in headers]
-    return valores, headers, headers_l
+    schema = _schema(ws, valores[0])
+    return valores, schema.headers, schema.headers_l
 
 
 def _col(headers_l, nome):
-    return headers_l.index(nome.lower()) + 1
+    try:
+        return headers_l.index(nome.lower()) + 1
+    except ValueError:
+        for apelido in COLUMN_ALIASES.get(nome.lower(), ()):
+            if apelido in headers_l:
+                return headers_l.index(apelido) + 1
+        raise
 
 
 def _row_to_dict(headers_l, row_values):
@@ -140,26 +985,204 @@ def _score_row(data: dict) -> int:
     return score
 
 
-def dedupe_rows_by_phone(ws, telefone_any: str):
+# -------------------------------------------------------------
+#  ÍNDICE RESIDENTE TELEFONE -> LINHA (Página1)
+# -------------------------------------------------------------
+class _LeadIndex:
+    """
+    Snapshot da Página1 em memória + dict dígitos do telefone -> linhas.
+    Montado uma vez, atualizado no lugar nos nossos append/update/delete e
+    revalidado barato (só a coluna TELEFONE) quando passa do TTL.
+
+    `lock` protege só o estado em memória: as leituras no Sheets do ensure_fresh
+    rodam fora dele (chame ensure_fresh SEM segurar o lock). Como outro processo
+    pode ter apagado linhas dentro do TTL, update_leads_fields confere o telefone
+    de cada linha antes de gravar (_conferir_linhas).
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.lock = threading.RLock()
+        self.valores = []
+        self.headers = []
+        self.headers_l = []
+        self.tel_col = 0
+        self.schema_version = 0
+        self.by_phone = {}
+        self.built_at = 0.0
+        self.checked_at = 0.0
+        self.geracao = 0  # muda a cada alteração em memória (para saber se uma leitura ficou velha)
+        self.stats = {"hits": 0, "builds": 0, "revalidations": 0, "row_mismatches": 0}
+
+    def build(self):
+        """Relê a aba inteira (fora do lock) e troca o snapshot."""
+        for _ in range(3):
+            with self.lock:
+                geracao = self.geracao
+            valores, headers, headers_l = _headers(self.ws)
+            schema = _schema(self.ws)
+            with self.lock:
+                if self.geracao != geracao:
+                    # um append/update nosso entrou durante a leitura: ela pode não ter visto
+                    continue
+                self._aplicar_build(valores, headers, headers_l, schema)
+                return
+        with self.lock:
+            self._aplicar_build(valores, headers, headers_l, schema)
+            self.checked_at = 0.0  # não deu para confirmar: revalida no próximo uso
+
+    def _aplicar_build(self, valores, headers, headers_l, schema):
+        self.valores = valores
+        self.headers = headers
+        self.headers_l = headers_l
+        self.tel_col = schema.col("telefone")
+        self.schema_version = schema.version
+        self._reindex()
+        self.built_at = self.checked_at = time.monotonic()
+        self.geracao += 1
+        self.stats["builds"] += 1
+
+    def _tel_cell(self, row) -> str:
+        return _safe_str(row[self.tel_col - 1]) if len(row) >= self.tel_col else ""
+
+    def _reindex(self):
+        self.by_phone = {}
+        tels = [self._tel_cell(row) for row in self.valores[1:]]
+        for i, digits in enumerate(norm_digits_many(tels), start=2):
+            if digits:
+                self.by_phone.setdefault(digits, []).append(i)
+
+    def invalidate(self):
+        with self.lock:
+            self.built_at = self.checked_at = 0.0
+            self.geracao += 1
+
+    def ensure_fresh(self, force_check: bool = False):
+        """Garante o índice montado; revalida se passou do TTL (ou se force_check)."""
+        agora = time.monotonic()
+        schema_version = _schema(self.ws).version
+        with self.lock:
+            if not self.built_at or agora - self.built_at > LEADS_INDEX_MAX_AGE:
+                montar = True
+            elif schema_version != self.schema_version:
+                # colunas mudaram (cabeçalho relido): o snapshot está com as posições velhas
+                montar = True
+            elif not force_check and agora - self.checked_at < LEADS_INDEX_TTL:
+                self.stats["hits"] += 1
+                return
+            else:
+                montar = False
+                self.stats["revalidations"] += 1
+                tel_col = self.tel_col
+        if montar:
+            self.build()
+            return
+
+        # revalidação barata: compara só a coluna TELEFONE (pega append/delete de fora)
+        coluna = [_safe_str(v) for v in self.ws.col_values(tel_col)]
+        with self.lock:
+            atual = [self._tel_cell(row) for row in self.valores]
+            while atual and not atual[-1]:
+                atual.pop()
+            if coluna == atual:
+                self.checked_at = agora
+                return
+        self.build()
+
+    def rows_for(self, telefone_any) -> list:
+        return list(self.by_phone.get(norm_digits(telefone_any), []))
+
+    def row_data(self, row_idx: int) -> dict:
+        return _row_to_dict(self.headers_l, self.valores[row_idx - 1])
+
+    def on_append(self, row: list, row_idx: int):
+        if row_idx != len(self.valores) + 1:
+            # alguém (outro worker / a planilha) mexeu na aba: remonta na próxima
+            self.invalidate()
+            return
+        self.valores.append(list(row))
+        self.geracao += 1
+        digits = norm_digits(self._tel_cell(row))
+        if digits:
+            self.by_phone.setdefault(digits, []).append(row_idx)
+
+    def on_update(self, row_idx: int, col: int, value: str):
+        if row_idx > len(self.valores):
+            return
+        row = self.valores[row_idx - 1]
+        while len(row) < col:
+            row.append("")
+        row[col - 1] = value
+        self.geracao += 1
+        if col == self.tel_col:
+            self._reindex()
+
+    def on_delete(self, rows):
+        # de baixo pra cima: as linhas abaixo sobem, então remonta os números no fim
+        for r in sorted(set(rows), reverse=True):
+            if 2 <= r <= len(self.valores):
+                del self.valores[r - 1]
+        self.geracao += 1
+        self._reindex()
+
+
+_lead_indexes = {}
+_lead_indexes_lock = threading.Lock()
+
+
+def _lead_index(ws) -> _LeadIndex:
+    with _lead_indexes_lock:
+        idx = _lead_indexes.get(ws.id)
+        if idx is None or idx.ws is not ws:
+            idx = _LeadIndex(ws)
+            _lead_indexes[ws.id] = idx
+    return idx
+
+
+def _known_lead_index(ws):
+    """Índice da aba, se já existir (não cria nem lê nada)."""
+    idx = _lead_indexes.get(getattr(ws, "id", None))
+    return idx if idx is not None and idx.ws is ws and idx.built_at else None
+
+
+def lead_index_stats() -> dict:
+    with _lead_indexes_lock:
+        return {ws_id: dict(idx.stats, rows=len(idx.valores)) for ws_id, idx in _lead_indexes.items()}
+
+
+def _appended_row_idx(resp, fallback: int) -> int:
+    """Linha real do append (a resposta da API traz o range gravado, ex: 'Página1'!A57:H57)."""
+    try:
+        updated = resp["updates"]["updatedRange"]
+        return gspread.utils.a1_to_rowcol(updated.split("!")[-1].split(":")[0])[0]
+    except Exception:
+        return fallback
+
+
+def dedupe_rows_by_phone(ws, telefone_any: str, canonizar: bool = True):
     """
     Se existirem múltiplas linhas com o mesmo telefone (comparando por dígitos),
     mantém a melhor e apaga o resto. Retorna (kept_row_idx, headers_l, kept_data).
+    canonizar=False: não grava o telefone canônico aqui (quem chama manda junto
+    no seu batch_update).
     """
-    valores, headers, headers_l = _headers(ws)
-    tel_col = _col(headers_l, "telefone")
+    if not norm_digits(telefone_any):
+        return None
+    index = _lead_index(ws)
+    index.ensure_fresh()
+    with index.lock:
+        return _dedupe_locked(ws, index, telefone_any, canonizar)
 
-    target = _norm_tel_digits(telefone_any)
+
+def _dedupe_locked(ws, index: _LeadIndex, telefone_any: str, canonizar: bool):
+    """dedupe_rows_by_phone com o índice já revalidado e index.lock seguro."""
+    target = norm_digits(telefone_any)
     if not target:
         return None
+    headers_l = index.headers_l
+    tel_col = index.tel_col
 
-    matches = []
-    for i in range(2, len(valores) + 1):
-        row = ws.row_values(i)
-        tel_cell = _safe_str(row[tel_col - 1]) if len(row) >= tel_col else ""
-        if _norm_tel_digits(tel_cell) == target:
-            data = _row_to_dict(headers_l, row)
-            matches.append((i, data))
-
+    matches = [(i, index.row_data(i)) for i in index.rows_for(target)]
     if not matches:
         return None
 
@@ -167,98 +1190,330 @@ def dedupe_rows_by_phone(ws, telefone_any: str):
     matches_sorted = sorted(matches, key=lambda x: _score_row(x[1]), reverse=True)
     keep_idx, keep_data = matches_sorted[0]
 
-    # normaliza telefone na linha mantida
-    canonical = _canon_wpp(telefone_any) or _canon_wpp(keep_data.get("telefone")) or keep_data.get("telefone") or ""
-    if canonical:
+    # normaliza telefone na linha mantida (só escreve se ainda não estiver canônico)
+    canonical = canon_wpp(telefone_any) or canon_wpp(keep_data.get("telefone")) or keep_data.get("telefone") or ""
+    if canonizar and canonical and keep_data.get("telefone") != canonical:
         try:
             ws.update_cell(keep_idx, tel_col, canonical)
             keep_data["telefone"] = canonical
+            index.on_update(keep_idx, tel_col, canonical)
         except Exception:
             pass
 
-    # apaga duplicadas (de baixo pra cima)
+    # apaga duplicadas (um batch só)
     to_delete = [idx for idx, _ in matches_sorted[1:]]
-    for r in sorted(to_delete, reverse=True):
+    deleted = []
+    if to_delete:
         try:
-            ws.delete_rows(r)
+            delete_rows_bulk(ws, to_delete)
+            deleted = to_delete
+            index.on_delete(deleted)
         except Exception:
             pass
 
+    # linhas acima da mantida que foram apagadas deslocam o índice dela
+    keep_idx -= sum(1 for r in deleted if r < keep_idx)
+
     return keep_idx, headers_l, keep_data
 
 
-def get_or_create_lead_row(ws, telefone_wpp: str, nome_padrao="profissional"):
+def get_or_create_lead_row(ws, telefone_wpp: str, nome_padrao="profissional", canonizar: bool = True):
     """
     Procura pelo telefone por dígitos normalizados; se houver duplicados, deduplica.
     Se não existir, cria.
     """
+    index = _lead_index(ws)
     # 1) se já existe (ou duplicado), deduplica e retorna
-    deduped = dedupe_rows_by_phone(ws, telefone_wpp)
+    deduped = dedupe_rows_by_phone(ws, telefone_wpp, canonizar)
     if deduped:
         return deduped
 
-    # 2) não existe -> cria
-    valores, headers, headers_l = _headers(ws)
-    tel_col = _col(headers_l, "telefone")
+    # não achou no índice: confere a coluna TELEFONE antes de criar
+    # (o lead pode ter entrado na planilha por fora desde a última leitura)
+    index.ensure_fresh(force_check=True)
+    with index.lock:
+        # outra thread pode ter criado o lead enquanto a coluna era lida
+        deduped = _dedupe_locked(ws, index, telefone_wpp, canonizar)
+        if deduped:
+            return deduped
+
+        # 2) não existe -> cria
+        headers, headers_l = index.headers, index.headers_l
+        tel_col = index.tel_col
+        schema = _schema(ws)
+
+        def set_if_exists(row, colname, value):
+            col = schema.get(colname)
+            if col is not None and col <= len(row):
+                row[col - 1] = value
+
+        canonical = canon_wpp(telefone_wpp) or _safe_str(telefone_wpp)
+        new_row = [""] * len(headers)
+        set_if_exists(new_row, "nome", nome_padrao)
+        new_row[tel_col - 1] = canonical
+        set_if_exists(new_row, "data", _now_str())
+        set_if_exists(new_row, "stage", "start")
+        set_if_exists(new_row, "updated_at", _now_str())
+
+        resp = ws.append_row(new_row, value_input_option="USER_ENTERED")
+
+        row_idx = _appended_row_idx(resp, len(index.valores) + 1)
+        index.on_append(new_row, row_idx)
+
+        data = {h: "" for h in headers_l}
+        data["telefone"] = canonical
+        data["stage"] = "start"
+        return row_idx, headers_l, data
+
+
+def _lead_cells(row_idx: int, schema: _HeaderSchema, fields: dict) -> list:
+    """Converte {campo: valor} em ranges A1 da linha (colunas vizinhas viram um range só)."""
+    if schema.get("updated_at") is not None and "updated_at" not in [k.lower() for k in fields.keys()]:
+        fields = dict(fields, updated_at=_now_str())
+
+    por_coluna = {}
+    for k, v in fields.items():
+        col = schema.get(k)
+        if col is None:
+            continue
+        por_coluna[col] = str(v)
+
+    data = []
+    cols = sorted(por_coluna)
+    i = 0
+    while i < len(cols):
+        j = i
+        while j + 1 < len(cols) and cols[j + 1] == cols[j] + 1:
+            j += 1
+        inicio = gspread.utils.rowcol_to_a1(row_idx, cols[i])
+        fim = gspread.utils.rowcol_to_a1(row_idx, cols[j])
+        data.append({
+            "range": inicio if i == j else f"{inicio}:{fim}",
+            "values": [[por_coluna[c] for c in cols[i:j + 1]]],
+        })
+        i = j + 1
+    return data
+
+
+def _conferir_linhas(ws, index: _LeadIndex, rows, telefones: dict = None) -> dict:
+    """
+    Antes de gravar por número de linha: confere, numa leitura só, se o telefone
+    de cada linha ainda é o esperado (o de `telefones`, ou o que o índice tem ali;
+    outro processo pode ter apagado linhas acima dentro do LEADS_INDEX_TTL).
+    Retorna {linha: linha atual}; None se o lead não está mais na aba.
+    """
+    rows = sorted(set(rows))
+    mapa = {r: r for r in rows}
+    if not rows:
+        return mapa
+    telefones = telefones or {}
+    with index.lock:
+        tel_col = index.tel_col
+        esperados = {
+            r: norm_digits(telefones[r]) if r in telefones
+            else norm_digits(index._tel_cell(index.valores[r - 1])) if r <= len(index.valores) else ""
+            for r in rows
+        }
+    lidos = ws.batch_get([gspread.utils.rowcol_to_a1(r, tel_col) for r in rows])
+    divergentes = [
+        r for r, v in zip(rows, lidos)
+        if norm_digits(_safe_str(v[0][0]) if v and v[0] else "") != esperados[r]
+    ]
+    if not divergentes:
+        return mapa
+
+    print(f"[SHEETS] {len(divergentes)} linhas da Página1 mudaram de lugar (alteradas por fora); relendo o índice")
+    index.invalidate()
+    index.ensure_fresh()
+    with index.lock:
+        index.stats["row_mismatches"] += len(divergentes)
+        for r in divergentes:
+            atuais = index.rows_for(esperados[r]) if esperados[r] else []
+            mapa[r] = atuais[0] if atuais else None
+    return mapa
+
+
+def update_leads_fields(ws, updates):
+    """
+    Atualiza várias linhas com UM batch_update.
+    updates: lista de (row_idx, headers_l, {campo: valor}). As colunas saem do
+    cabeçalho em cache da aba (headers_l fica na tupla por compatibilidade).
+    Com o índice residente montado, a linha de cada update é conferida antes
+    (_conferir_linhas); lead que sumiu da aba é pulado.
+    """
+    index = _known_lead_index(ws)
+    if index is not None and updates:
+        mapa = _conferir_linhas(ws, index, [row_idx for row_idx, _, _ in updates])
+        for row_idx, _, fields in updates:
+            if mapa[row_idx] is None:
+                print(f"[WARN] Lead da linha {row_idx} não está mais na Página1; campos não gravados:", list(fields))
+        updates = [(mapa[r], h, f) for r, h, f in updates if mapa[r] is not None]
+
+    schema = _schema(ws)
+    data = []
+    for row_idx, _headers_l, fields in updates:
+        data.extend(_lead_cells(row_idx, schema, fields))
+    if not data:
+        return
+    ws.batch_update(data, value_input_option="USER_ENTERED")
 
-    def set_if_exists(row, colname, value):
-        if colname in headers_l:
-            row[_col(headers_l, colname) - 1] = value
+    if index is not None:
+        with index.lock:
+            for item in data:
+                inicio = item["range"].split(":")[0]
+                row_idx, col = gspread.utils.a1_to_rowcol(inicio)
+                for offset, value in enumerate(item["values"][0]):
+                    index.on_update(row_idx, col + offset, value)
 
-    canonical = _canon_wpp(telefone_wpp) or _safe_str(telefone_wpp)
-    new_row = [""] * len(headers)
-    set_if_exists(new_row, "nome", nome_padrao)
-    new_row[tel_col - 1] = canonical
-    set_if_exists(new_row, "data", _now_str())
-    set_if_exists(new_row, "stage", "start")
-    set_if_exists(new_row, "updated_at", _now_str())
 
-    ws.append_row(new_row, value_input_option="USER_ENTERED")
+def update_lead_fields(ws, row_idx: int, headers_l: list, **fields):
+    update_leads_fields(ws, [(row_idx, headers_l, fields)])
 
-    row_idx = len(valores) + 1
-    data = {h: "" for h in headers_l}
-    data["telefone"] = canonical
-    data["stage"] = "start"
-    return row_idx, headers_l, data
 
+def find_rows_by_phone(ws, telefone_any: str, telefone_col_names=("telefone", "phone", "celular")):
+    target = norm_digits(telefone_any)
+    if not target:
+        return []
+
+    # Página1: responde pelo índice residente (sem baixar a aba)
+    if ws.title == SHEET_NAME:
+        index = _lead_index(ws)
+        index.ensure_fresh()
+        with index.lock:
+            return index.rows_for(target)
+
+    # outras abas: cabeçalho em cache + só a coluna do telefone
+    schema = _schema(ws)
+    tel_col = None
+    for nome in telefone_col_names:
+        tel_col = schema.get(nome)
+        if tel_col is not None:
+            break
+    if tel_col is None:
+        tel_col = schema.col(telefone_col_names[0])
+    coluna = ws.col_values(tel_col)
+    return [i for i, d in enumerate(norm_digits_many(coluna[1:]), start=2) if d == target]
+
+
+def _row_ranges(rows) -> list:
+    """[2, 3, 4, 9, 10] -> [(9, 10), (2, 4)]  (intervalos contíguos, de baixo pra cima)."""
+    ranges = []
+    for r in sorted(set(rows)):
+        if ranges and r == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], r)
+        else:
+            ranges.append((r, r))
+    return list(reversed(ranges))
+
+
+def delete_rows_bulk(ws, rows) -> int:
+    """
+    Apaga várias linhas com UM batch_update (deleteDimension por intervalo contíguo).
+    Os pedidos vão de baixo pra cima, então os índices de cada um continuam válidos.
+    """
+    ranges = _row_ranges(rows)
+    if not ranges:
+        return 0
+
+    requests = [
+        {
+            "deleteDimension": {
+                "range": {
+                    "sheetId": ws.id,
+                    "dimension": "ROWS",
+                    "startIndex": inicio - 1,
+                    "endIndex": fim,
+                }
+            }
+        }
+        for inicio, fim in ranges
+    ]
+    ws.spreadsheet.batch_update({"requests": requests})
+    return sum(fim - inicio + 1 for inicio, fim in ranges)
+
+
+def delete_leads_and_logs(telefones) -> bool:
+    """Apaga as linhas da Página1 e do LOGS de um ou mais telefones (um batch por aba)."""
+    targets = {norm_digits(t) for t in telefones}
+    targets.discard("")
+    if not targets:
+        return True
+
+    # garante que logs ainda no buffer também sejam apagados
+    flush_logs()
 
-def update_lead_fields(ws, row_idx: int, headers_l: list, **fields):
-    def col(nome):
-        return headers_l.index(nome.lower()) + 1
+    ws_leads = abrir_aba(SHEET_NAME)
+    index = _lead_index(ws_leads)
+    index.ensure_fresh()
+    with index.lock:
+        lead_rows = []
+        for t in targets:
+            lead_rows.extend(index.rows_for(t))
+        try:
+            delete_rows_bulk(ws_leads, lead_rows)
+        except Exception:
+            # não dá pra saber o que sobrou: remonta na próxima
+            index.invalidate()
+            raise
+        index.on_delete(lead_rows)
+
+    for titulo in logs_partitions():
+        ws_logs = _registry.worksheet(titulo)
+        # só a coluna TELEFONE (o cabeçalho vem do cache)
+        coluna = ws_logs.col_values(_schema(ws_logs).col("telefone"))
+        log_rows = [i for i, d in enumerate(norm_digits_many(coluna[1:]), start=2) if d in targets]
+        delete_rows_bulk(ws_logs, log_rows)
+        _conversas.on_delete(titulo, log_rows)
+    return True
 
-    if "updated_at" in headers_l and "updated_at" not in [k.lower() for k in fields.keys()]:
-        fields["updated_at"] = _now_str()
 
-    for k, v in fields.items():
-        key = k.lower()
-        if key not in headers_l:
-            continue
-        ws.update_cell(row_idx, col(key), str(v))
+def delete_lead_and_logs(telefone_wpp: str):
+    return delete_leads_and_logs([telefone_wpp])
 
 
-def find_rows_by_phone(ws, telefone_any: str, telefone_col_names=("telefone", "phone", "celular")):
-    valores, headers, headers_l = _headers(ws)
-    tel_col = _col(headers_l, "telefone")
-    target = _norm_tel_digits(telefone_any)
-    matched = []
-    for i, row in enumerate(valores[1:], start=2):
-        tel = row[tel_col - 1].strip() if len(row) >= tel_col else ""
-        if _norm_tel_digits(tel) == target and target:
-            matched.append(i)
-    return matched
+def arquivar_logs(meses_quentes: int = None, archive_id: str = None) -> list:
+    """
+    Move as partições de LOGS com mais de `meses_quentes` meses para a planilha de arquivo
+    (LOGS_ARCHIVE_SPREADSHEET_ID). Cada partição é copiada com um append_rows, conferida
+    e só então apagada da planilha principal. Retorna os títulos arquivados.
+    """
+    meses_quentes = LOGS_HOT_MONTHS if meses_quentes is None else meses_quentes
+    archive_id = archive_id or LOGS_ARCHIVE_SPREADSHEET_ID
+    if not archive_id:
+        raise Exception("Defina LOGS_ARCHIVE_SPREADSHEET_ID para arquivar os LOGS.")
+
+    flush_logs()
+    agora = datetime.now()
+    total = agora.year * 12 + agora.month - 1 - meses_quentes
+    limite = (total // 12, total % 12 + 1)
+
+    antigas = [t for t in logs_partitions() if _partition_month(t) not in (None, (0, 0)) and _partition_month(t) < limite]
+    if not antigas:
+        return []
+
+    arquivo = _registry.client().open_by_key(archive_id)
+    arquivadas = []
+    for titulo in antigas:
+        valores = _registry.worksheet(titulo).get_all_values()
+
+        # se sobrou cópia parcial de uma execução anterior, refaz do zero
+        try:
+            arquivo.del_worksheet(arquivo.worksheet(titulo))
+        except gspread.exceptions.WorksheetNotFound:
+            pass
+        destino = arquivo.add_worksheet(title=titulo, rows=max(len(valores), 1), cols=len(LOGS_HEADER))
+        if valores:
+            destino.append_rows(valores, value_input_option="USER_ENTERED")
 
+        if len(destino.col_values(1)) != len(valores):
+            print(f"[ARQUIVO] Cópia de {titulo} não confere, mantendo na planilha principal")
+            continue
 
-def delete_lead_and_logs(telefone_wpp: str):
-    ws_leads = abrir_aba(SHEET_NAME)
-    lead_rows = find_rows_by_phone(ws_leads, telefone_wpp)
-    for r in sorted(lead_rows, reverse=True):
-        ws_leads.delete_rows(r)
-
-    ws_logs = ensure_logs_worksheet()
-    log_rows = find_rows_by_phone(ws_logs, telefone_wpp, telefone_col_names=("telefone",))
-    for r in sorted(log_rows, reverse=True):
-        ws_logs.delete_rows(r)
-    return True
+        _registry.del_worksheet(titulo)
+        _conversas.drop(titulo)
+        arquivadas.append(titulo)
+        print(f"[ARQUIVO] {titulo}: {max(len(valores) - 1, 0)} linhas arquivadas")
+    return arquivadas
 
 
 def ler_linhas():
@@ -275,50 +1530,233 @@ def carregar_progresso():
 
 
 def salvar_progresso(data):
-    with open(PROGRESS_FILE, "w", encoding="utf-8") as f:
+    # grava num temporário e troca de uma vez: um crash no meio não corrompe o cursor
+    tmp = PROGRESS_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, PROGRESS_FILE)
+
 
+def monitorar_novos_leads(callback, workers: int = None, checkpoint=None):
+    """
+    Processa só as linhas novas desde o cursor salvo em PROGRESS_FILE.
+    Cabeçalho + linhas novas vêm numa leitura só; os carimbos ENVIADO vão num batch no fim.
 
-def monitorar_novos_leads(callback):
+    workers > 1 (padrão CAMPANHA_WORKERS): modo campanha, ver _despachar_campanha.
+    checkpoint: chamado antes de cada gravação de ENVIADO/cursor (ex: descarregar
+    as escritas acumuladas do lead_store).
+    """
+    workers = CAMPANHA_WORKERS if workers is None else workers
     ws = abrir_planilha()
-    valores = ws.get_all_values()
-    if not valores or len(valores) < 2:
+    progresso = carregar_progresso()
+    last_row = max(1, int(progresso.get("last_row", 1) or 1))
+    last_tel = norm_digits(progresso.get("last_tel", ""))
+
+    # relê a própria linha do cursor para conferir que ela não mudou de lugar
+    inicio = max(2, last_row)
+    cabecalho, valores = ws.batch_get(["1:1", f"A{inicio}:ZZZ"])
+    if not cabecalho or not cabecalho[0]:
         print("Planilha vazia (ou só cabeçalho).")
         return
 
-    headers = [h.strip().lower() for h in valores[0]]
-
-    def col_idx(nome):
-        return headers.index(nome) + 1
+    schema = _schema(ws, cabecalho[0])
+    nome_col = schema.col("nome")
+    tel_col = schema.col("telefone")
+    email_col = schema.col("email")
 
-    nome_col = col_idx("nome")
-    tel_col = col_idx("telefone")
-    email_col = col_idx("email")
-
-    if "enviado" not in headers:
+    enviado_col = schema.get("enviado")
+    if enviado_col is None:
         raise Exception("Crie uma coluna chamada ENVIADO no Google Sheets (no cabeçalho).")
-    enviado_col = col_idx("enviado")
-
-    enviados_agora = 0
 
-    for row_idx in range(2, len(valores) + 1):
-        row = ws.row_values(row_idx)
+    def cell(row, col):
+        return _safe_str(row[col - 1]) if len(row) >= col else ""
+
+    if last_row >= 2:
+        na_linha = norm_digits(cell(valores[0], tel_col)) if valores else ""
+        if na_linha != last_tel:
+            # linhas foram apagadas/movidas desde a última execução: varre tudo de novo
+            # (quem já tem ENVIADO é pulado, então não reenvia)
+            print(f"[SCHEDULER] Cursor inválido (linha {last_row}), relendo a partir da linha 2")
+            inicio = 2
+            valores = ws.get(f"A{inicio}:ZZZ")
+        else:
+            # a linha do cursor já foi processada
+            inicio = last_row + 1
+            valores = valores[1:]
 
-        nome = _safe_str(row[nome_col - 1]) if len(row) >= nome_col else ""
-        telefone = _safe_str(row[tel_col - 1]) if len(row) >= tel_col else ""
-        email = _safe_str(row[email_col - 1]) if len(row) >= email_col else ""
+    if not valores:
+        print("OK — nenhuma linha nova desde a última execução.")
+        return
 
-        enviado = _safe_str(row[enviado_col - 1]) if len(row) >= enviado_col else ""
-        if enviado:
-            continue
-        if not telefone:
+    ultima = inicio + len(valores) - 1
+    pendentes = []  # (linha, nome, telefone, email)
+    reservados = []  # reservados por uma execução que caiu no meio do envio
+    for row_idx, row in enumerate(valores, start=inicio):
+        telefone = cell(row, tel_col)
+        enviado = cell(row, enviado_col)
+        if enviado.startswith(RESERVA_ENVIO):
+            reservados.append(telefone)
+        if enviado or not telefone:
             continue
+        pendentes.append((row_idx, cell(row, nome_col), telefone, cell(row, email_col)))
+    if reservados:
+        print(f"[CAMPANHA] {len(reservados)} leads com ENVIADO = {RESERVA_ENVIO} (execução anterior caiu durante "
+              f"o envio; podem não ter recebido o template, confira): {', '.join(reservados[:20])}")
+
+    if workers > 1 and len(pendentes) > 1:
+        enviados_agora = _despachar_campanha(
+            ws, pendentes, callback, workers, enviado_col, checkpoint,
+            cursor_final=(ultima, cell(valores[-1], tel_col)),
+            cursor_de=lambda r: (r, cell(valores[r - inicio], tel_col)),
+        )
+        print(f"OK — novos processados nesta execução: {enviados_agora}")
+        return
 
-        print(f"[PROCESSANDO NOVO LEAD] {nome} | {telefone}")
-        callback(nome, telefone, email)
-
-        stamp = _now_str()
-        ws.update_cell(row_idx, enviado_col, f"ENVIADO {stamp}")
-        enviados_agora += 1
+    enviados_agora = 0
+    carimbos = []  # (linha lida, telefone)
+    try:
+        for row_idx, nome, telefone, email in pendentes:
+            print(f"[PROCESSANDO NOVO LEAD] {nome} | {telefone}")
+            callback(nome, telefone, email)
+            carimbos.append((row_idx, telefone))
+            enviados_agora += 1
+    finally:
+        if checkpoint is not None:
+            checkpoint()
+        _gravar_carimbos_enviado(ws, carimbos, enviado_col)
+
+    # cursor só avança depois dos carimbos gravados
+    salvar_progresso({"last_row": ultima, "last_tel": cell(valores[-1], tel_col)})
 
     print(f"OK — novos processados nesta execução: {enviados_agora}")
+
+
+def _despachar_campanha(ws, pendentes, callback, workers: int, enviado_col: int, checkpoint,
+                        cursor_final, cursor_de) -> int:
+    """
+    Modo campanha: roda o callback dos leads pendentes em `workers` threads.
+
+    Antes de entrar no pool, cada bloco de CAMPANHA_CHECKPOINT_EVERY leads é
+    reservado NA PLANILHA (ENVIADO = "ENVIANDO <data>", um batch_update por bloco).
+    A cada CAMPANHA_CHECKPOINT_EVERY leads concluídos (ou CAMPANHA_CHECKPOINT_SECS):
+    checkpoint() (descarrega as escritas acumuladas), ENVIADO dos concluídos num
+    batch_update e cursor avançado até a última linha com TUDO antes dela concluído.
+
+    Se o processo cair, a próxima execução pula quem tem ENVIADO preenchido, inclusive
+    as reservas: o estado fica na planilha, não no disco do dyno (efêmero, assim
+    como a chave de idempotência do twilio_sender). Um lead reservado que não chegou
+    a ser enviado fica sem o template (no máximo um envio, nunca dois) e aparece no
+    aviso de reservas pendentes do monitorar_novos_leads para conferência manual.
+    """
+    total = len(pendentes)
+    ordem = [row_idx for row_idx, _, _, _ in pendentes]
+    concluidas = set()
+    carimbos = []  # concluídos desde o último checkpoint
+    stats = {"ok": 0, "falhas": 0}
+    inicio = time.monotonic()
+    ultimo_ckpt = inicio
+    posicao = 0  # quantos de `ordem` (em sequência) já estão concluídos
+
+    def rodar(nome, telefone, email):
+        with sheets_quota.prioridade(sheets_quota.SEGUNDO_PLANO):
+            return callback(nome, telefone, email)
+
+    def salvar_checkpoint():
+        nonlocal carimbos, posicao, ultimo_ckpt
+        if checkpoint is not None:
+            checkpoint()
+        _gravar_carimbos_enviado(ws, carimbos, enviado_col)
+        carimbos = []
+        while posicao < total and ordem[posicao] in concluidas:
+            posicao += 1
+        if posicao == total:
+            salvar_progresso(dict(zip(("last_row", "last_tel"), cursor_final)))
+        elif posicao:
+            salvar_progresso(dict(zip(("last_row", "last_tel"), cursor_de(ordem[posicao - 1]))))
+        ultimo_ckpt = time.monotonic()
+
+        feitos = len(concluidas)
+        decorrido = max(1e-6, ultimo_ckpt - inicio)
+        taxa = feitos / decorrido
+        restante = (total - feitos) / taxa if taxa else 0
+        print(f"[CAMPANHA] {feitos}/{total} ({100 * feitos // total}%) — {taxa:.1f} leads/s, "
+              f"falhas {stats['falhas']}, faltam ~{restante:.0f}s")
+
+    blocos = (pendentes[i:i + CAMPANHA_CHECKPOINT_EVERY] for i in range(0, total, CAMPANHA_CHECKPOINT_EVERY))
+    futuros = {}  # em andamento -> (linha, telefone)
+
+    def reservar_proximo_bloco(pool) -> bool:
+        bloco = next(blocos, None)
+        if bloco is None:
+            return False
+        # a reserva é gravada ANTES de qualquer envio do bloco
+        _gravar_carimbos_enviado(ws, [(r, tel) for r, _, tel, _ in bloco], enviado_col,
+                                 stamp=f"{RESERVA_ENVIO} {_now_str()}")
+        for row_idx, nome, telefone, email in bloco:
+            futuros[pool.submit(rodar, nome, telefone, email)] = (row_idx, telefone)
+        return True
+
+    print(f"[CAMPANHA] {total} leads novos, {workers} em paralelo")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="campanha") as pool:
+        try:
+            while True:
+                # reserva o próximo bloco antes do pool esvaziar (ou quando esvaziou de
+                # uma vez num wait); só sai com os blocos acabados e nada em andamento
+                if not futuros or len(futuros) <= workers:
+                    if not reservar_proximo_bloco(pool) and not futuros:
+                        break
+                feitos, _ = wait(futuros, return_when=FIRST_COMPLETED)
+                for fut in feitos:
+                    row_idx, telefone = futuros.pop(fut)
+                    try:
+                        ok = fut.result()
+                    except Exception as e:
+                        ok = False
+                        print(f"[CAMPANHA] Falha no lead {telefone}:", e)
+                    stats["ok" if ok is not False else "falhas"] += 1
+                    # carimba mesmo com falha, como no modo sequencial (não fica reenviando)
+                    concluidas.add(row_idx)
+                    carimbos.append((row_idx, telefone))
+                if len(carimbos) >= CAMPANHA_CHECKPOINT_EVERY or time.monotonic() - ultimo_ckpt >= CAMPANHA_CHECKPOINT_SECS:
+                    salvar_checkpoint()
+        finally:
+            # erro no meio (ou Ctrl+C): não dispara o resto, grava o que já terminou e
+            # devolve a reserva de quem nem chegou a rodar (o que estava rodando
+            # fica reservado: pode ter saído)
+            canceladas = [futuros[fut] for fut in futuros if fut.cancel()]
+            salvar_checkpoint()
+            if canceladas:
+                _gravar_carimbos_enviado(ws, canceladas, enviado_col, stamp="")
+    return len(concluidas)
+
+
+def _gravar_carimbos_enviado(ws, carimbos, enviado_col: int, stamp: str = None):
+    """Escreve todos os ENVIADO da execução num batch_update só (stamp: outro valor, ex: reserva)."""
+    if not carimbos:
+        return
+
+    # o callback pode ter deduplicado (apagado) linhas no meio da execução:
+    # se o índice residente estiver montado, usa a linha ATUAL de cada telefone
+    index = _known_lead_index(ws)
+    if stamp is None:
+        stamp = f"ENVIADO {_now_str()}"
+    if index is None:
+        linhas = [row_idx for row_idx, _ in carimbos]
+    else:
+        telefones = {}
+        with index.lock:
+            for row_idx, telefone in carimbos:
+                for r in index.rows_for(telefone) or [row_idx]:
+                    telefones[r] = telefone
+        mapa = _conferir_linhas(ws, index, telefones, telefones)
+        linhas = [mapa[r] for r in telefones if mapa[r] is not None]
+
+    data = [{"range": gspread.utils.rowcol_to_a1(r, enviado_col), "values": [[stamp]]} for r in linhas]
+    ws.batch_update(data, value_input_option="USER_ENTERED")
+
+    if index is not None:
+        with index.lock:
+            for r in linhas:
+                index.on_update(r, enviado_col, stamp)
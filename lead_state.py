@@ -0,0 +1,157 @@
+"""
+Estado da conversa de cada lead (stage, nome, respondeu?, lembrete enviado?).
+
+Substitui o dict `lead_status` que existia em cada worker do gunicorn: o estado
+fica num SQLite (WAL) em LEAD_STATE_PATH, visto por todos os workers e pelo
+sheet_checker.py rodando na mesma máquina, e sobrevive a restart.
+
+Atenção: no Heroku web e worker são dynos diferentes (discos separados e
+efêmeros). Quando o estado não existe aqui (restart, outro dyno, expirou), o
+webhook continua do STAGE da Página1 que o garantir_lead devolve (ver
+_processar_estagio no app.py); só se a planilha não tiver STAGE é que começa
+em "start".
+
+Limite: leads em stage final (LEAD_STATE_DONE_STAGES) saem depois de
+LEAD_STATE_DONE_TTL; qualquer lead parado há LEAD_STATE_TTL sai; acima de
+LEAD_STATE_MAX_ROWS saem os menos recentes (LRU por updated_at).
+"""
+import os
+import sqlite3
+import threading
+import time
+
+LEAD_STATE_PATH = os.getenv("LEAD_STATE_PATH", "lead_state.db")
+LEAD_STATE_DONE_STAGES = tuple(
+    s.strip() for s in os.getenv("LEAD_STATE_DONE_STAGES", "end,comprou").split(",") if s.strip()
+)
+LEAD_STATE_DONE_TTL = float(os.getenv("LEAD_STATE_DONE_TTL", str(7 * 86400)))
+LEAD_STATE_TTL = float(os.getenv("LEAD_STATE_TTL", str(60 * 86400)))
+LEAD_STATE_MAX_ROWS = int(os.getenv("LEAD_STATE_MAX_ROWS", "200000"))
+# faxina a cada N gravações
+LEAD_STATE_EVICT_EVERY = int(os.getenv("LEAD_STATE_EVICT_EVERY", "500"))
+
+
+class LeadState:
+    """Registro compacto (sem __dict__) do estado de um lead."""
+
+    __slots__ = ("telefone", "stage", "nome", "answered", "reminder_sent", "timestamp", "updated_at")
+
+    def __init__(self, telefone: str, stage: str = "start", nome: str = "", answered: bool = False,
+                 reminder_sent: bool = False, timestamp: float = 0.0, updated_at: float = 0.0):
+        self.telefone = telefone
+        self.stage = stage
+        self.nome = nome
+        self.answered = bool(answered)
+        self.reminder_sent = bool(reminder_sent)
+        self.timestamp = timestamp or time.time()
+        self.updated_at = updated_at
+
+    def __repr__(self):
+        return f"LeadState({self.telefone!r}, stage={self.stage!r}, answered={self.answered}, reminder_sent={self.reminder_sent})"
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lead_state (
+    telefone TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    nome TEXT NOT NULL DEFAULT '',
+    answered INTEGER NOT NULL DEFAULT 0,
+    reminder_sent INTEGER NOT NULL DEFAULT 0,
+    timestamp REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lead_state_updated ON lead_state (updated_at);
+"""
+
+_COLUNAS = LeadState.__slots__
+
+
+class LeadStateStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+        self._escritas = 0
+        self.stats = {"gets": 0, "misses": 0, "puts": 0, "evicted": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    conn.executescript(_SCHEMA)
+                    self._ready = True
+        return conn
+
+    def get(self, telefone: str):
+        """LeadState do telefone ou None."""
+        self.stats["gets"] += 1
+        row = self._conn().execute(
+            f"SELECT {', '.join(_COLUNAS)} FROM lead_state WHERE telefone = ?", (telefone,)
+        ).fetchone()
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        return LeadState(*row)
+
+    def put(self, state: LeadState):
+        state.updated_at = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO lead_state ({', '.join(_COLUNAS)}) VALUES ({', '.join('?' * len(_COLUNAS))})",
+                tuple(getattr(state, c) for c in _COLUNAS),
+            )
+        self.stats["puts"] += 1
+        self._escritas += 1
+        if self._escritas % LEAD_STATE_EVICT_EVERY == 0:
+            self.evict()
+
+    def update(self, telefone: str, **fields):
+        """Altera só os campos dados (cria o registro se não existir)."""
+        state = self.get(telefone) or LeadState(telefone)
+        for k, v in fields.items():
+            setattr(state, k, v)
+        self.put(state)
+        return state
+
+    def delete(self, telefone: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM lead_state WHERE telefone = ?", (telefone,))
+
+    def evict(self) -> int:
+        """Remove finalizados velhos, parados há muito tempo e o excesso (LRU)."""
+        agora = time.time()
+        conn = self._conn()
+        with conn:
+            apagados = 0
+            if LEAD_STATE_DONE_STAGES:
+                apagados += conn.execute(
+                    f"DELETE FROM lead_state WHERE stage IN ({', '.join('?' * len(LEAD_STATE_DONE_STAGES))}) AND updated_at < ?",
+                    (*LEAD_STATE_DONE_STAGES, agora - LEAD_STATE_DONE_TTL),
+                ).rowcount
+            apagados += conn.execute(
+                "DELETE FROM lead_state WHERE updated_at < ?", (agora - LEAD_STATE_TTL,)
+            ).rowcount
+            excesso = conn.execute("SELECT COUNT(*) FROM lead_state").fetchone()[0] - LEAD_STATE_MAX_ROWS
+            if excesso > 0:
+                apagados += conn.execute(
+                    "DELETE FROM lead_state WHERE telefone IN "
+                    "(SELECT telefone FROM lead_state ORDER BY updated_at LIMIT ?)", (excesso,)
+                ).rowcount
+        self.stats["evicted"] += apagados
+        return apagados
+
+    def relatorio(self) -> dict:
+        total = self._conn().execute("SELECT COUNT(*) FROM lead_state").fetchone()[0]
+        return dict(self.stats, rows=total)
+
+
+lead_states = LeadStateStore(LEAD_STATE_PATH)
@@ -0,0 +1,991 @@
+"""
+Camada de dados dos leads usada pelo app.py.
+
+STORE_BACKEND=sheets (padrão): lê/grava direto no Google Sheets (Página1 + LOGS).
+STORE_BACKEND=sqlite: SQLite local (WAL) é o banco principal; um replicador em
+background espelha as mudanças na Página1/LOGS em lote, então a request não
+espera o Google. Na primeira execução o SQLite é populado a partir do Sheets
+(até essa cópia dar certo o store recusa leitura e escrita).
+
+Atenção: no Heroku o disco do dyno é efêmero. Use sqlite só com STORE_SQLITE_PATH
+num disco persistente (ou aceitando que o Sheets continua sendo a cópia durável).
+"""
+import atexit
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import google_sheets as gs
+import sheets_quota
+from dashboard_agg import DashboardAgregados, contribuicao
+from phone_canon import canon_wpp
+from read_cache import SnapshotCache
+from sheets_schema import LEADS_HEADER, LOGS_HEADER
+
+STORE_BACKEND = os.getenv("STORE_BACKEND", "sheets").strip().lower()
+STORE_SQLITE_PATH = os.getenv("STORE_SQLITE_PATH", "leads.db")
+# de quanto em quanto tempo o replicador espelha no Sheets, e quantos eventos por lote
+STORE_MIRROR_INTERVAL = float(os.getenv("STORE_MIRROR_INTERVAL", "5"))
+STORE_MIRROR_BATCH = int(os.getenv("STORE_MIRROR_BATCH", "500"))
+STORE_MIRROR_LEASE = float(os.getenv("STORE_MIRROR_LEASE", "60"))
+# enquanto o SQLite não foi populado a partir do Sheets, de quanto em quanto tempo tenta de novo
+STORE_HYDRATE_RETRY = float(os.getenv("STORE_HYDRATE_RETRY", "30"))
+
+LEAD_FIELDS = [h.lower() for h in LEADS_HEADER]
+LOG_FIELDS = [h.lower() for h in LOGS_HEADER]
+
+
+def _canon(telefone) -> str:
+    return canon_wpp(telefone) or gs._safe_str(telefone)
+
+
+@contextlib.contextmanager
+def _imediata(conn: sqlite3.Connection):
+    """Transação com BEGIN IMMEDIATE: pega o lock de escrita antes das leituras."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def _coluna(campo: str) -> str:
+    """Identificador SQL para um campo vindo do cabeçalho da planilha."""
+    return '"' + campo.replace('"', '""') + '"'
+
+
+# -------------------------------------------------------------
+#  BACKEND SHEETS (comportamento original)
+# -------------------------------------------------------------
+class _Tabela:
+    """
+    Snapshot de uma aba: linhas como get_all_records (dict por cabeçalho) +
+    posição das linhas de cada telefone, para aplicar as nossas escritas.
+    agregar=True (Página1): mantém também os contadores do /dashboard, ajustados
+    a cada escrita (ver dashboard_agg.py).
+    """
+
+    def __init__(self, headers: list, linhas: list, agregar: bool = False):
+        self.headers = list(headers)
+        self.por_campo = {h.strip().lower(): h for h in self.headers}
+        vazia = [""] * len(self.headers)
+        self.rows = [dict(zip(self.headers, linha + vazia[len(linha):])) for linha in linhas]
+        self._indexar()
+        self.agregar = agregar
+        self._lock = threading.Lock()  # escritas x leitura/conferência dos contadores
+        if agregar:
+            self._recontar()
+
+    def _indexar(self):
+        self.pos = {}
+        tel_h = self.por_campo.get("telefone")
+        if tel_h is None:
+            return
+        for i, r in enumerate(self.rows):
+            tel = canon_wpp(r.get(tel_h))
+            if tel:
+                self.pos.setdefault(tel, []).append(i)
+
+    # ---------- contadores do dashboard ----------
+    def _recontar(self):
+        self.contrib = [contribuicao(r) for r in self.rows]  # paralela a rows
+        self.agg = DashboardAgregados.de_contribuicoes(self.contrib)
+
+    def _somar_linhas(self, inicio: int):
+        for r in self.rows[inicio:]:
+            c = contribuicao(r)
+            self.contrib.append(c)
+            self.agg.somar(c)
+
+    def metricas(self, agora=None) -> dict:
+        with self._lock:
+            return self.agg.metricas(agora)
+
+    def conferir(self) -> bool:
+        """
+        Recontagem completa a partir das linhas do snapshot. Se os contadores
+        incrementais divergirem (drift), passam a valer os recontados. True se batiam.
+        """
+        with self._lock:
+            rows, agg = list(self.rows), self.agg.copia()
+        # a recontagem roda fora do lock: as escritas no snapshot não esperam
+        if DashboardAgregados.de_contribuicoes(map(contribuicao, rows)) == agg:
+            return True
+        with self._lock:
+            self._recontar()
+        return False
+
+    # ---------- write-through ----------
+    def atualizar(self, tel: str, nome_padrao: str, fields: dict):
+        """Mesma escrita que foi feita na Página1 (cria a linha se o lead for novo)."""
+        with self._lock:
+            if tel not in self.pos:
+                agora = gs._now_str()
+                novo = dict.fromkeys(self.headers, "")
+                for campo, valor in (("nome", nome_padrao), ("telefone", tel), ("data", agora),
+                                     ("stage", "start"), ("updated_at", agora)):
+                    if campo in self.por_campo:
+                        novo[self.por_campo[campo]] = valor
+                # lista nova: quem está iterando a antiga não é afetado
+                self.rows = self.rows + [novo]
+                self.pos[tel] = [len(self.rows) - 1]
+                if self.agregar:
+                    self._somar_linhas(len(self.rows) - 1)
+            if not fields:
+                return
+            mudancas = {self.por_campo[k.lower()]: str(v) for k, v in fields.items() if k.lower() in self.por_campo}
+            if "updated_at" in self.por_campo and "updated_at" not in [k.lower() for k in fields]:
+                mudancas[self.por_campo["updated_at"]] = gs._now_str()
+            for i in self.pos[tel]:
+                self.rows[i] = dict(self.rows[i], **mudancas)
+                if self.agregar:
+                    # mudança de stage / UPDATED_AT: tira a contribuição antiga e soma a nova
+                    nova = contribuicao(self.rows[i])
+                    self.agg.trocar(self.contrib[i], nova)
+                    self.contrib[i] = nova
+
+    def acrescentar(self, linhas: list):
+        vazia = [""] * len(self.headers)
+        with self._lock:
+            inicio = len(self.rows)
+            self.rows = self.rows + [dict(zip(self.headers, linha + vazia[len(linha):])) for linha in linhas]
+            if self.agregar:
+                self._somar_linhas(inicio)
+            tel_h = self.por_campo.get("telefone")
+            if tel_h is None:
+                return
+            for i in range(inicio, len(self.rows)):
+                tel = canon_wpp(self.rows[i].get(tel_h))
+                if tel:
+                    self.pos.setdefault(tel, []).append(i)
+
+    def remover(self, tel: str):
+        with self._lock:
+            if tel not in self.pos:
+                return
+            apagar = set(self.pos[tel])
+            self.rows = [r for i, r in enumerate(self.rows) if i not in apagar]
+            if self.agregar:
+                for i in apagar:
+                    self.agg.somar(self.contrib[i], -1)
+                self.contrib = [c for i, c in enumerate(self.contrib) if i not in apagar]
+            self._indexar()
+
+
+class UnidadeDeTrabalho:
+    """
+    Escritas acumuladas de uma request/job (ou de um lote de campanha): campos por
+    lead + linhas de LOGS, gravados juntos no fim (ver SheetsStore.unidade).
+    """
+
+    def __init__(self):
+        self.leads = {}  # telefone canônico -> {"nome_padrao", "fields"}
+        self.dados = {}  # telefone canônico -> linha lida no garantir_lead
+        self.logs = []
+        self.chamadas = {"read": 0, "write": 0}  # chamadas à API feitas dentro da unidade
+
+    def campos(self, tel: str, nome_padrao: str) -> dict:
+        return self.leads.setdefault(tel, {"nome_padrao": nome_padrao, "fields": {}})["fields"]
+
+
+class SheetsStore:
+    def __init__(self):
+        self._local = threading.local()  # unidade da request/job desta thread
+        self._lote_lock = threading.Lock()
+        self._lote = None  # UnidadeDeTrabalho compartilhada enquanto lote() está aberto
+        self._lote_niveis = 0
+        self._stats_lock = threading.Lock()
+        self.stats = {"units": 0, "unit_reads": 0, "unit_writes": 0, "max_unit_calls": 0}
+        self.stats_dashboard = {"checks": 0, "drift": 0, "recounts": 0}
+        # snapshots de leitura compartilhados pelas páginas (ver read_cache.py)
+        self._leads_cache = SnapshotCache("leads", self._ler_leads)
+        self._logs_caches = {}  # desde ("" = tudo) -> SnapshotCache
+        self._logs_caches_lock = threading.Lock()
+
+    # ---------- cache de leitura ----------
+    def _ler_leads(self) -> _Tabela:
+        ws = gs.abrir_planilha()
+        valores = ws.get_all_values()
+        # o snapshot novo já nasce recontado; antes de trocar, confere se os
+        # contadores incrementais do anterior batiam com as linhas dele
+        anterior = self._leads_cache.atual()
+        if anterior is not None:
+            self._conferir_dashboard(anterior)
+        if not valores:
+            return _Tabela(LEADS_HEADER, [], agregar=True)
+        return _Tabela(gs._schema(ws, valores[0]).headers, valores[1:], agregar=True)
+
+    def _conferir_dashboard(self, tabela: _Tabela) -> bool:
+        ok = tabela.conferir()
+        with self._stats_lock:
+            self.stats_dashboard["checks"] += 1
+            if not ok:
+                self.stats_dashboard["drift"] += 1
+        if not ok:
+            print("[DASHBOARD] Contadores incrementais divergiam das linhas do snapshot; recontados.")
+        return ok
+
+    def _logs_cache(self, desde) -> SnapshotCache:
+        chave = desde.strftime("%Y-%m-%d %H:%M:%S") if desde else ""
+        with self._logs_caches_lock:
+            cache = self._logs_caches.get(chave)
+            if cache is None:
+                valores = lambda: gs.ler_logs_valores(desde=desde)
+                cache = self._logs_caches[chave] = SnapshotCache(
+                    f"logs:{chave or 'tudo'}", lambda: _Tabela(LOGS_HEADER, valores()[1:])
+                )
+            return cache
+
+    def _cache_lead(self, telefone_wpp: str, nome_padrao: str, fields: dict):
+        tel = _canon(telefone_wpp)
+        self._leads_cache.aplicar(lambda t: t.atualizar(tel, nome_padrao, fields))
+
+    def _cache_logs(self, linhas: list):
+        with self._logs_caches_lock:
+            caches = list(self._logs_caches.items())
+        for desde, cache in caches:
+            # partições mais velhas que o período do snapshot não entram nele
+            novas = [l for l in linhas if not desde or str(l[0]) >= desde]
+            if novas:
+                cache.aplicar(lambda t, novas=novas: t.acrescentar(novas), idempotente=False)
+
+    def snapshot_leads(self):
+        """(linhas da Página1 como get_all_records, idade do snapshot em segundos)."""
+        tabela, idade = self._leads_cache.get()
+        return tabela.rows, idade
+
+    def snapshot_logs(self, desde=None):
+        tabela, idade = self._logs_cache(desde).get()
+        return tabela.rows, idade
+
+    def read_cache_stats(self) -> dict:
+        with self._logs_caches_lock:
+            caches = [self._leads_cache, *self._logs_caches.values()]
+        return {c.nome: c.relatorio() for c in caches}
+
+    def dashboard_metricas(self, recalcular: bool = False):
+        """
+        (métricas do /dashboard, idade do snapshot): lidas dos contadores mantidos
+        no snapshot da Página1, sem varrer as linhas. recalcular=True confere
+        (recontagem completa) antes.
+        """
+        tabela, idade = self._leads_cache.get()
+        if recalcular:
+            with self._stats_lock:
+                self.stats_dashboard["recounts"] += 1
+            self._conferir_dashboard(tabela)
+        return tabela.metricas(), idade
+
+    def dashboard_stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self.stats_dashboard)
+
+    # ---------- unidade de trabalho ----------
+    @contextlib.contextmanager
+    def unidade(self):
+        """
+        Unidade de trabalho da thread (uma mensagem do webhook, um job): dentro dela
+        garantir_lead lê a linha do lead uma vez, atualizar_lead só junta campos e
+        registrar_log só junta linhas. No fim: no máximo UM batch_update na Página1
+        e UM append no LOGS (mais o append_row se o lead for novo). Aninhada = a de fora.
+        Os LOGS são enfileirados antes da Página1; erro na Página1 é impresso e não
+        propaga, como no salvar_log.
+        """
+        atual = getattr(self._local, "uow", None)
+        if atual is not None:
+            yield atual
+            return
+
+        uow = UnidadeDeTrabalho()
+        self._local.uow = uow
+        with sheets_quota.contar_chamadas() as chamadas:
+            uow.chamadas = chamadas
+            try:
+                yield uow
+            finally:
+                self._local.uow = None
+                try:
+                    self._gravar(uow)
+                except Exception as e:
+                    # como o salvar_log fazia: falha no Sheets não derruba o webhook/follow-up
+                    print("[ERRO AO SALVAR LOG NO SHEETS]", e)
+                finally:
+                    with self._stats_lock:
+                        self.stats["units"] += 1
+                        self.stats["unit_reads"] += chamadas["read"]
+                        self.stats["unit_writes"] += chamadas["write"]
+                        self.stats["max_unit_calls"] = max(self.stats["max_unit_calls"], chamadas["read"] + chamadas["write"])
+
+    @contextlib.contextmanager
+    def lote(self):
+        """
+        Enquanto aberto, atualizar_lead/registrar_log (de qualquer thread fora de
+        uma unidade) só acumulam; descarregar() grava tudo num batch_update (o
+        sheet_checker em modo campanha descarrega a cada checkpoint).
+        """
+        with self._lote_lock:
+            self._lote_niveis += 1
+            if self._lote is None:
+                self._lote = UnidadeDeTrabalho()
+        restante = None
+        try:
+            yield
+        finally:
+            with self._lote_lock:
+                self._lote_niveis -= 1
+                if not self._lote_niveis:
+                    restante, self._lote = self._lote, None
+            if restante is not None:
+                self._gravar(restante)
+            gs.flush_logs()
+
+    def descarregar(self):
+        with self._lote_lock:
+            if self._lote is None:
+                return
+            pendentes, self._lote = self._lote, UnidadeDeTrabalho()
+        self._gravar(pendentes)
+        gs.flush_logs()
+
+    def _acumular(self, escrita) -> bool:
+        """
+        escrita(unidade) na unidade desta thread ou no lote aberto; False se não há
+        nenhuma (a escrita vai direto). O lote é escolhido e alterado sob o mesmo
+        _lote_lock: um descarregar() concorrente não pode trocá-lo no meio.
+        """
+        uow = getattr(self._local, "uow", None)
+        if uow is not None:
+            escrita(uow)
+            return True
+        with self._lote_lock:
+            if self._lote is None:
+                return False
+            escrita(self._lote)
+            return True
+
+    def _gravar(self, uow: UnidadeDeTrabalho):
+        # LOGS primeiro: uma falha na Página1 não pode levar junto o histórico da conversa
+        if uow.logs:
+            gs.enfileirar_logs(uow.logs)
+            self._cache_logs(uow.logs)
+        if uow.leads:
+            ws = gs.abrir_planilha()
+            updates = []
+            for tel, entry in uow.leads.items():
+                row_idx, headers_l, data = gs.get_or_create_lead_row(ws, tel, nome_padrao=entry["nome_padrao"], canonizar=False)
+                fields = entry["fields"]
+                if data.get("telefone") != tel:
+                    # telefone canônico vai no mesmo batch_update
+                    fields = dict(fields, telefone=tel)
+                if fields:
+                    updates.append((row_idx, headers_l, fields))
+            gs.update_leads_fields(ws, updates)
+            for tel, entry in uow.leads.items():
+                self._cache_lead(tel, entry["nome_padrao"], entry["fields"])
+
+    # ---------- API ----------
+    def garantir_lead(self, telefone_wpp: str, nome_padrao: str = "profissional") -> dict:
+        uow = getattr(self._local, "uow", None)
+        if uow is None:
+            ws = gs.abrir_planilha()
+            _, _, data = gs.get_or_create_lead_row(ws, telefone_wpp, nome_padrao=nome_padrao)
+            self._cache_lead(telefone_wpp, nome_padrao, {})
+            return data
+
+        tel = _canon(telefone_wpp)
+        if tel not in uow.dados:
+            _, _, data = gs.get_or_create_lead_row(gs.abrir_planilha(), tel, nome_padrao=nome_padrao, canonizar=False)
+            uow.dados[tel] = data
+            uow.campos(tel, nome_padrao)  # telefone canônico sai no flush, se preciso
+        # o que já foi alterado nesta unidade vale sobre o que foi lido
+        pendentes = uow.leads.get(tel, {}).get("fields", {})
+        return dict(uow.dados[tel], **{k.lower(): v for k, v in pendentes.items()})
+
+    def atualizar_lead(self, telefone_wpp: str, nome_padrao: str = "profissional", **fields):
+        tel = _canon(telefone_wpp)
+        if self._acumular(lambda uow: uow.campos(tel, nome_padrao).update(fields)):
+            return
+        ws = gs.abrir_planilha()
+        row_idx, headers_l, _ = gs.get_or_create_lead_row(ws, telefone_wpp, nome_padrao=nome_padrao)
+        gs.update_lead_fields(ws, row_idx, headers_l, **fields)
+        self._cache_lead(telefone_wpp, nome_padrao, fields)
+
+    def registrar_log(self, telefone_wpp: str, direction: str, stage: str, body: str, message_sid: str = "", template_sid: str = ""):
+        row = gs.make_log_row(telefone_wpp, direction, stage, body, message_sid, template_sid)
+        if self._acumular(lambda uow: uow.logs.append(row)):
+            return
+        gs.enfileirar_logs([row])
+        self._cache_logs([row])
+
+    def unidade_stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def listar_leads(self) -> list:
+        return gs.abrir_planilha().get_all_records()
+
+    def listar_logs(self, desde=None) -> list:
+        # lê só as partições mensais do período (e já inclui o que está no buffer)
+        return gs.ler_logs(desde=desde)
+
+    def listar_conversa(self, telefone_wpp: str) -> list:
+        # só as linhas daquele telefone, via índice de conversas
+        return gs.ler_conversa(telefone_wpp)
+
+    def excluir_lead(self, telefone_wpp: str):
+        gs.delete_lead_and_logs(telefone_wpp)
+        tel = _canon(telefone_wpp)
+        self._leads_cache.aplicar(lambda t: t.remover(tel))
+        with self._logs_caches_lock:
+            caches = list(self._logs_caches.values())
+        for cache in caches:
+            cache.aplicar(lambda t: t.remover(tel))
+
+
+# -------------------------------------------------------------
+#  BACKEND SQLITE (principal) + ESPELHO NO SHEETS
+# -------------------------------------------------------------
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS leads (
+    {", ".join(f"{c} TEXT NOT NULL DEFAULT ''" for c in LEAD_FIELDS if c != "telefone")},
+    telefone TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    {", ".join(f"{c} TEXT NOT NULL DEFAULT ''" for c in LOG_FIELDS)}
+);
+CREATE INDEX IF NOT EXISTS logs_telefone ON logs (telefone, id);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    telefone TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT,
+    until REAL
+);
+CREATE TABLE IF NOT EXISTS dashboard (
+    tipo TEXT NOT NULL,
+    chave TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (tipo, chave)
+);
+CREATE TABLE IF NOT EXISTS dashboard_leads (
+    telefone TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    dia TEXT
+);
+"""
+
+
+class SqliteStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+        self._replicator = None
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._falha_hidratacao = None  # monotonic da última cópia do Sheets que falhou
+        # colunas da tabela leads: as do LEADS_HEADER + as que a Página1 tiver a mais
+        self._colunas_lock = threading.Lock()
+        self._cabecalho = list(LEADS_HEADER)
+        self._campos = list(LEAD_FIELDS)
+        self.stats = {"mirrored_events": 0, "mirror_batches": 0, "mirror_errors": 0,
+                      "mirror_uncertain": 0, "mirror_already_written": 0}
+
+    # ---------- conexão ----------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._ready:
+            self._init(conn)
+        return conn
+
+    def _init(self, conn):
+        with self._init_lock:
+            if self._ready:
+                return
+            conn.executescript(_SCHEMA)
+            self._carregar_colunas(conn)
+            # só fica pronto depois da cópia do Sheets: até lá _conn() levanta erro
+            self._hidratar(conn)
+            if not conn.execute("SELECT 1 FROM meta WHERE key = 'dashboard_recontado'").fetchone():
+                # banco de antes dos contadores do /dashboard: conta uma vez
+                with _imediata(conn):
+                    self._recontar_dashboard(conn)
+            self._ready = True
+
+    def _carregar_colunas(self, conn):
+        """Lê as colunas da tabela leads (outro processo pode ter acrescentado alguma)."""
+        campos = [r["name"] for r in conn.execute("PRAGMA table_info(leads)")]
+        row = conn.execute("SELECT value FROM meta WHERE key = 'leads_header'").fetchone()
+        nomes = {h.lower(): h for h in (json.loads(row["value"]) if row else [])}
+        nomes.update({h.lower(): h for h in LEADS_HEADER})
+        ordem = LEAD_FIELDS + [c for c in campos if c not in LEAD_FIELDS]
+        with self._colunas_lock:
+            self._campos = ordem
+            self._cabecalho = [nomes.get(c, c.upper()) for c in ordem]
+
+    def _garantir_colunas(self, conn, cabecalho):
+        """Acrescenta na tabela leads as colunas do cabeçalho que ela ainda não tem."""
+        with self._colunas_lock:
+            novos = [h.strip() for h in cabecalho if h.strip() and h.strip().lower() not in self._campos]
+        if not novos:
+            return
+        with conn:
+            for h in dict.fromkeys(novos):
+                try:
+                    conn.execute(f"ALTER TABLE leads ADD COLUMN {_coluna(h.lower())} TEXT NOT NULL DEFAULT ''")
+                except sqlite3.OperationalError as e:
+                    if "duplicate column" not in str(e):
+                        raise
+            row = conn.execute("SELECT value FROM meta WHERE key = 'leads_header'").fetchone()
+            extras = json.loads(row["value"]) if row else []
+            extras += [h for h in dict.fromkeys(novos) if h.lower() not in {e.lower() for e in extras}]
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('leads_header', ?)",
+                (json.dumps(extras, ensure_ascii=False),),
+            )
+        print(f"[STORE] Colunas novas na tabela leads: {', '.join(novos)}")
+        self._carregar_colunas(conn)
+
+    def _hidratar(self, conn):
+        """
+        Primeira execução: copia Página1 + LOGS para o SQLite. Até a cópia entrar
+        (meta 'hydration_pending' presente, 'hydrated' ausente) o store recusa
+        leitura e escrita: um lead criado antes dela sairia como 'profissional'/
+        'start' e o espelho sobrescreveria o STAGE real da planilha. Falhou: tenta
+        de novo no próximo uso, no máximo a cada STORE_HYDRATE_RETRY segundos.
+        """
+        with conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'hydrated'").fetchone():
+                return
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('hydration_pending', ?)", (gs._now_str(),))
+
+        agora = time.monotonic()
+        if self._falha_hidratacao is not None and agora - self._falha_hidratacao < STORE_HYDRATE_RETRY:
+            raise RuntimeError("SQLite ainda não populado a partir do Sheets")
+        try:
+            leads = gs.abrir_planilha().get_all_values()
+            logs = gs.ler_logs_valores()
+        except Exception as e:
+            self._falha_hidratacao = agora
+            print(f"[STORE] Falha ao popular SQLite a partir do Sheets (tenta de novo em {STORE_HYDRATE_RETRY:.0f}s):", e)
+            raise RuntimeError("SQLite ainda não populado a partir do Sheets") from e
+        self._falha_hidratacao = None
+        self._importar(conn, leads, logs)
+
+    def _importar(self, conn, leads, logs):
+        def registros(valores, campos):
+            if not valores:
+                return
+            headers_l = [h.strip().lower() for h in valores[0]]
+            for row in valores[1:]:
+                d = gs._row_to_dict(headers_l, row)
+                yield [d.get(c, "") for c in campos]
+
+        # colunas que a Página1 tiver além do LEADS_HEADER também vão para o SQLite
+        if leads:
+            self._garantir_colunas(conn, leads[0])
+        campos = self._campos
+        i_tel = campos.index("telefone")
+        # BEGIN IMMEDIATE: dois processos subindo juntos não importam os dois
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'hydrated'").fetchone():
+                conn.rollback()
+                return
+            for valores in registros(leads, campos):
+                tel = _canon(valores[i_tel])
+                if not tel:
+                    continue
+                valores[i_tel] = tel
+                conn.execute(
+                    f"INSERT OR IGNORE INTO leads ({', '.join(map(_coluna, campos))}) VALUES ({', '.join('?' * len(campos))})",
+                    valores,
+                )
+            conn.executemany(
+                f"INSERT INTO logs ({', '.join(LOG_FIELDS)}) VALUES ({', '.join('?' * len(LOG_FIELDS))})",
+                list(registros(logs, LOG_FIELDS)),
+            )
+            self._recontar_dashboard(conn)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('hydrated', ?)", (gs._now_str(),))
+            conn.execute("DELETE FROM meta WHERE key = 'hydration_pending'")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        print("[STORE] SQLite populado a partir do Sheets")
+
+    # ---------- contadores do /dashboard ----------
+    def _linha_planilha(self, row) -> dict:
+        with self._colunas_lock:
+            cabecalho = list(zip(self._cabecalho, self._campos))
+        return {h: row[c] for h, c in cabecalho}
+
+    def _contar_dashboard(self, conn, tel: str):
+        """
+        Ajusta os contadores do /dashboard à linha atual do lead, na transação da
+        escrita (outros processos veem o mesmo número). dashboard_leads guarda com
+        que (stage, dia) cada lead está contado, para tirar antes de somar o novo.
+        """
+        row = conn.execute("SELECT * FROM leads WHERE telefone = ?", (tel,)).fetchone()
+        nova = contribuicao(self._linha_planilha(row)) if row is not None else None
+        anterior = conn.execute("SELECT stage, dia FROM dashboard_leads WHERE telefone = ?", (tel,)).fetchone()
+        antiga = (anterior["stage"], anterior["dia"]) if anterior is not None else None
+        if antiga == nova:
+            return
+        deltas = []
+        for c, sinal in ((antiga, -1), (nova, 1)):
+            if c is None:
+                continue
+            stage, dia = c
+            deltas += [("total", "", sinal), ("etapa", stage, sinal)]
+            if dia:
+                deltas += [("dia", dia, sinal), ("mes", dia[:7], sinal)]
+        conn.executemany(
+            "INSERT INTO dashboard (tipo, chave, n) VALUES (?, ?, ?) "
+            "ON CONFLICT(tipo, chave) DO UPDATE SET n = n + excluded.n",
+            deltas,
+        )
+        conn.executemany("DELETE FROM dashboard WHERE tipo = ? AND chave = ? AND n <= 0", [d[:2] for d in deltas])
+        if nova is None:
+            conn.execute("DELETE FROM dashboard_leads WHERE telefone = ?", (tel,))
+        else:
+            conn.execute("INSERT OR REPLACE INTO dashboard_leads (telefone, stage, dia) VALUES (?, ?, ?)", (tel, *nova))
+
+    def _recontar_dashboard(self, conn):
+        """Recontagem completa (hidratação, ?recalcular=1); roda dentro da transação de quem chama."""
+        conn.execute("DELETE FROM dashboard")
+        conn.execute("DELETE FROM dashboard_leads")
+        agg = DashboardAgregados()
+        for row in conn.execute("SELECT * FROM leads").fetchall():
+            c = contribuicao(self._linha_planilha(row))
+            if c is not None:
+                agg.somar(c)
+                conn.execute("INSERT INTO dashboard_leads (telefone, stage, dia) VALUES (?, ?, ?)", (row["telefone"], *c))
+        conn.executemany(
+            "INSERT INTO dashboard (tipo, chave, n) VALUES (?, ?, ?)",
+            [("total", "", agg.total)]
+            + [("etapa", k, n) for k, n in agg.etapas.items()]
+            + [("dia", k, n) for k, n in agg.por_dia.items()]
+            + [("mes", k, n) for k, n in agg.por_mes.items()],
+        )
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dashboard_recontado', ?)", (gs._now_str(),))
+
+    def _outbox(self, conn, kind: str, telefone: str, payload: dict):
+        conn.execute(
+            "INSERT INTO outbox (kind, telefone, payload) VALUES (?, ?, ?)",
+            (kind, telefone, json.dumps(payload, ensure_ascii=False)),
+        )
+
+    # ---------- API ----------
+    def garantir_lead(self, telefone_wpp: str, nome_padrao: str = "profissional") -> dict:
+        tel = _canon(telefone_wpp)
+        conn = self._conn()
+        with conn:
+            # INSERT OR IGNORE: duas threads (ou webhook e follow-up) criando o mesmo
+            # telefone não esbarram no PRIMARY KEY; só quem inseriu gera o evento
+            agora = gs._now_str()
+            novo = conn.execute(
+                "INSERT OR IGNORE INTO leads (telefone, nome, data, stage, updated_at) VALUES (?, ?, ?, 'start', ?)",
+                (tel, nome_padrao, agora, agora),
+            ).rowcount
+            if novo:
+                self._outbox(conn, "lead", tel, {"nome_padrao": nome_padrao, "fields": {}})
+                self._contar_dashboard(conn, tel)
+            row = conn.execute("SELECT * FROM leads WHERE telefone = ?", (tel,)).fetchone()
+        self._kick()
+        return dict(row)
+
+    def atualizar_lead(self, telefone_wpp: str, nome_padrao: str = "profissional", **fields):
+        tel = _canon(telefone_wpp)
+        self.garantir_lead(tel, nome_padrao)
+        conn = self._conn()
+        # campo fora da tabela (coluna nova na Página1) vira coluna, em vez de ser descartado
+        self._garantir_colunas(conn, [k for k in fields if k.strip()])
+        fields = {k.strip().lower(): str(v) for k, v in fields.items() if k.strip() and k.strip().lower() != "telefone"}
+        fields.setdefault("updated_at", gs._now_str())
+
+        with conn:
+            conn.execute(
+                f"UPDATE leads SET {', '.join(f'{_coluna(k)} = ?' for k in fields)} WHERE telefone = ?",
+                [*fields.values(), tel],
+            )
+            self._contar_dashboard(conn, tel)
+            self._outbox(conn, "lead", tel, {"nome_padrao": nome_padrao, "fields": fields})
+        self._kick()
+
+    def registrar_log(self, telefone_wpp: str, direction: str, stage: str, body: str, message_sid: str = "", template_sid: str = ""):
+        row = gs.make_log_row(telefone_wpp, direction, stage, body, message_sid, template_sid)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                f"INSERT INTO logs ({', '.join(LOG_FIELDS)}) VALUES ({', '.join('?' * len(LOG_FIELDS))})",
+                row,
+            )
+            self._outbox(conn, "log", row[1], {"row": row})
+        self._kick()
+
+    def listar_leads(self) -> list:
+        rows = self._conn().execute("SELECT * FROM leads ORDER BY rowid").fetchall()
+        return [self._linha_planilha(r) for r in rows]
+
+    def listar_logs(self, desde=None) -> list:
+        if desde is None:
+            rows = self._conn().execute("SELECT * FROM logs ORDER BY id").fetchall()
+        else:
+            rows = self._conn().execute(
+                "SELECT * FROM logs WHERE timestamp >= ? ORDER BY id", (desde.strftime("%Y-%m-%d %H:%M:%S"),)
+            ).fetchall()
+        return [{h: r[h.lower()] for h in LOGS_HEADER} for r in rows]
+
+    def listar_conversa(self, telefone_wpp: str) -> list:
+        rows = self._conn().execute(
+            "SELECT * FROM logs WHERE telefone = ? ORDER BY id", (_canon(telefone_wpp),)
+        ).fetchall()
+        return [{h: r[h.lower()] for h in LOGS_HEADER} for r in rows]
+
+    def unidade(self):
+        # as escritas já são locais e o espelho no Sheets já vai em lote
+        return contextlib.nullcontext()
+
+    def lote(self):
+        return contextlib.nullcontext()
+
+    def descarregar(self):
+        pass
+
+    def excluir_lead(self, telefone_wpp: str):
+        tel = _canon(telefone_wpp)
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM leads WHERE telefone = ?", (tel,))
+            conn.execute("DELETE FROM logs WHERE telefone = ?", (tel,))
+            self._contar_dashboard(conn, tel)
+            self._outbox(conn, "delete", tel, {})
+        self._kick()
+
+    # ---------- replicação para o Sheets ----------
+    def _kick(self):
+        # thread só nasce no primeiro uso (depois do fork do gunicorn)
+        if self._replicator is None or not self._replicator.is_alive():
+            self._replicator = threading.Thread(target=self._run, name="sheets-mirror", daemon=True)
+            self._replicator.start()
+
+    def _run(self):
+        with gs.prioridade_sheets(sheets_quota.SEGUNDO_PLANO):
+            while True:
+                time.sleep(STORE_MIRROR_INTERVAL)
+                try:
+                    while self.espelhar() >= STORE_MIRROR_BATCH:
+                        pass
+                except Exception as e:
+                    self.stats["mirror_errors"] += 1
+                    print("[STORE] Falha ao espelhar no Sheets (tenta de novo):", e)
+
+    def _lease(self, conn) -> bool:
+        """Só um processo (worker do gunicorn) espelha por vez."""
+        agora = time.time()
+        with conn:
+            conn.execute(
+                "INSERT INTO meta (key, value, until) VALUES ('mirror_lease', ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, until = excluded.until "
+                "WHERE meta.until < ? OR meta.value = excluded.value",
+                (self._owner, agora + STORE_MIRROR_LEASE, agora),
+            )
+            row = conn.execute("SELECT value FROM meta WHERE key = 'mirror_lease'").fetchone()
+        return row is not None and row["value"] == self._owner
+
+    def espelhar(self) -> int:
+        """
+        Espelha um lote do outbox no Sheets. Retorna quantos eventos foram espelhados.
+
+        LOGS vão com um append por partição e o outbox de cada partição só é apagado
+        depois dela confirmada. Append que falhou podendo ter entrado (timeout, 5xx)
+        fica marcado em meta 'mirror_incertos'; antes de regravar, o fim da partição
+        é conferido (gs._bloco_ja_gravado) e o que já está lá não vai de novo.
+        """
+        conn = self._conn()
+        if not self._lease(conn):
+            return 0
+
+        eventos = conn.execute(
+            "SELECT id, kind, telefone, payload FROM outbox ORDER BY id LIMIT ?", (STORE_MIRROR_BATCH,)
+        ).fetchall()
+        if not eventos:
+            return 0
+
+        # junta tudo do lote: último estado por lead, logs em ordem, deletes primeiro
+        leads = {}
+        logs = []  # (id do evento, linha)
+        deletes = set()
+        for ev in eventos:
+            payload = json.loads(ev["payload"])
+            tel = ev["telefone"]
+            if ev["kind"] == "delete":
+                deletes.add(tel)
+                leads.pop(tel, None)
+                logs = [(i, r) for i, r in logs if r[1] != tel]
+            elif ev["kind"] == "lead":
+                entry = leads.setdefault(tel, {"nome_padrao": payload.get("nome_padrao") or "profissional", "fields": {}})
+                entry["fields"].update(payload.get("fields") or {})
+            elif ev["kind"] == "log":
+                logs.append((ev["id"], payload["row"]))
+
+        if deletes:
+            gs.delete_leads_and_logs(deletes)
+
+        if leads:
+            ws = gs.abrir_planilha()
+            updates = []
+            for tel, entry in leads.items():
+                row_idx, headers_l, data = gs.get_or_create_lead_row(ws, tel, nome_padrao=entry["nome_padrao"])
+                updates.append((row_idx, headers_l, entry["fields"]))
+                self._reconciliar(conn, tel, data)
+            gs.update_leads_fields(ws, updates)
+
+        row = conn.execute("SELECT value FROM meta WHERE key = 'mirror_incertos'").fetchone()
+        incertos = set(json.loads(row["value"])) if row else set()
+        ficam, erro = self._espelhar_logs(logs, incertos)
+
+        with conn:
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(ev["id"],) for ev in eventos if ev["id"] not in ficam])
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('mirror_incertos', ?)",
+                (json.dumps(sorted(incertos & ficam)),),
+            )
+        self.stats["mirrored_events"] += len(eventos) - len(ficam)
+        self.stats["mirror_batches"] += 1
+        if erro is not None:
+            raise erro
+        return len(eventos) - len(ficam)
+
+    def _espelhar_logs(self, logs, incertos: set):
+        """Grava os logs por partição. Retorna (ids que ficam no outbox, primeiro erro)."""
+        por_aba = {}
+        for ev_id, row in logs:
+            titulo = gs._logs_por_particao([row])[0][0]
+            por_aba.setdefault(titulo, []).append((ev_id, row))
+
+        ficam = set()
+        erro = None
+        for titulo, itens in por_aba.items():
+            duvida = [row for ev_id, row in itens if ev_id in incertos]
+            try:
+                if duvida and gs._bloco_ja_gravado(titulo, duvida):
+                    self.stats["mirror_already_written"] += len(duvida)
+                    itens = [(ev_id, row) for ev_id, row in itens if ev_id not in incertos]
+                if itens:
+                    gs.append_log_rows_particao(titulo, [row for _, row in itens])
+            except Exception as e:
+                ids = {ev_id for ev_id, _ in itens}
+                ficam |= ids
+                if sheets_quota.escrita_incerta(e):
+                    self.stats["mirror_uncertain"] += len(ids)
+                    incertos |= ids
+                erro = erro or e
+        return ficam, erro
+
+    def _reconciliar(self, conn, tel: str, data: dict):
+        """Lead criado aqui com nome padrão, mas que já existia na planilha: traz nome/email de lá."""
+        nome = gs._safe_str((data or {}).get("nome"))
+        email = gs._safe_str((data or {}).get("email"))
+        with conn:
+            if nome and nome != "profissional":
+                conn.execute(
+                    "UPDATE leads SET nome = ? WHERE telefone = ? AND nome IN ('', 'profissional')", (nome, tel)
+                )
+            if email:
+                conn.execute("UPDATE leads SET email = ? WHERE telefone = ? AND email = ''", (email, tel))
+
+    def drenar(self):
+        """Espelha tudo que estiver pendente (chamado no exit)."""
+        try:
+            while self.espelhar():
+                pass
+        except Exception as e:
+            print("[STORE] Falha ao espelhar pendências no exit:", e)
+
+    def unidade_stats(self) -> dict:
+        return {}
+
+    def snapshot_leads(self):
+        # banco local: lê direto, sem cache
+        return self.listar_leads(), 0.0
+
+    def snapshot_logs(self, desde=None):
+        return self.listar_logs(desde), 0.0
+
+    def read_cache_stats(self) -> dict:
+        return {}
+
+    def dashboard_metricas(self, recalcular: bool = False):
+        # contadores mantidos nas escritas (_contar_dashboard): lê só as chaves usadas
+        conn = self._conn()
+        if recalcular:
+            with _imediata(conn):
+                self._recontar_dashboard(conn)
+        agora = datetime.now()
+        agg = DashboardAgregados()
+        contadores = {"etapa": agg.etapas, "dia": agg.por_dia, "mes": agg.por_mes}
+        for r in conn.execute(
+            "SELECT tipo, chave, n FROM dashboard WHERE tipo IN ('total', 'etapa') "
+            "OR (tipo = 'dia' AND chave = ?) OR (tipo = 'mes' AND chave = ?) ORDER BY rowid",
+            (agora.strftime("%Y-%m-%d"), agora.strftime("%Y-%m")),
+        ):
+            if r["tipo"] == "total":
+                agg.total = r["n"]
+            else:
+                contadores[r["tipo"]][r["chave"]] = r["n"]
+        return agg.metricas(agora), 0.0
+
+    def dashboard_stats(self) -> dict:
+        return {}
+
+    def mirror_stats(self) -> dict:
+        pendentes = self._conn().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        return dict(self.stats, pending=pendentes)
+
+
+def _criar_store():
+    if STORE_BACKEND == "sqlite":
+        store = SqliteStore(STORE_SQLITE_PATH)
+        atexit.register(store.drenar)
+        return store
+    return SheetsStore()
+
+
+store = _criar_store()
+
+garantir_lead = store.garantir_lead
+atualizar_lead = store.atualizar_lead
+registrar_log = store.registrar_log
+listar_leads = store.listar_leads
+listar_logs = store.listar_logs
+listar_conversa = store.listar_conversa
+excluir_lead = store.excluir_lead
+lote_escritas = store.lote
+unidade_de_trabalho = store.unidade
+unidade_stats = store.unidade_stats
+snapshot_leads = store.snapshot_leads
+snapshot_logs = store.snapshot_logs
+read_cache_stats = store.read_cache_stats
+dashboard_metricas = store.dashboard_metricas
+dashboard_stats = store.dashboard_stats
+descarregar_escritas = store.descarregar
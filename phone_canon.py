@@ -0,0 +1,95 @@
+"""
+Normalização de telefone (única para app.py, google_sheets.py e lead_store.py).
+
+Regra Brasil: só dígitos; 55 + DDD + 8 dígitos ganha o "9" depois do DDD;
+DDD + número (10/11 dígitos) ganha o 55 na frente; 12/13 dígitos ficam como estão.
+
+- norm_digits:        dígitos canônicos; tamanho desconhecido volta os dígitos crus
+                      (usado para casar linhas da planilha)
+- norm_digits_strict: idem, mas "" quando não é um número BR válido (rotas/Twilio)
+- canon_wpp:          'whatsapp:+<dígitos>' (ou "")
+- normalize_to_wpp:   como canon_wpp, mas estrito; 'whatsapp:...' inválido volta como veio
+- norm_digits_many:   a coluna inteira numa passada (varreduras da planilha)
+
+Os resultados ficam num LRU limitado (PHONE_CACHE_SIZE): a mesma célula/número
+aparece em toda varredura e em toda request.
+"""
+import functools
+import os
+import re
+
+PHONE_CACHE_SIZE = int(os.getenv("PHONE_CACHE_SIZE", "65536"))
+
+_NAO_DIGITOS = re.compile(r"[^0-9]+")
+
+
+def _str(v) -> str:
+    if v is None:
+        return ""
+    return str(v).strip()
+
+
+@functools.lru_cache(maxsize=PHONE_CACHE_SIZE)
+def _canon(s: str):
+    """(dígitos canônicos, válido?) de uma string já sem espaços nas pontas."""
+    digits = _NAO_DIGITOS.sub("", s)
+
+    # BR: se veio sem o 9 (55 + DDD + 8 dígitos = 12), insere "9" após o DDD
+    if len(digits) == 12 and digits.startswith("55"):
+        digits = digits[:4] + "9" + digits[4:]
+
+    # DDD + número (10/11) -> prefixa 55
+    if len(digits) in (10, 11):
+        return "55" + digits, True
+
+    # Já veio com 55 (12/13); outros tamanhos voltam crus, mas não são número BR
+    return digits, len(digits) in (12, 13)
+
+
+def norm_digits(v) -> str:
+    """
+    Normaliza qualquer telefone para SOMENTE DÍGITOS com país 55 quando possível.
+    Aceita 6298..., +556298..., whatsapp:+556298... (e int/float vindos do Sheets).
+    """
+    return _canon(_str(v))[0]
+
+
+def norm_digits_strict(v) -> str:
+    """Como norm_digits, mas retorna "" se não tiver 10 a 13 dígitos."""
+    digits, valido = _canon(_str(v))
+    return digits if valido else ""
+
+
+def canon_wpp(v) -> str:
+    d = norm_digits(v)
+    return f"whatsapp:+{d}" if d else ""
+
+
+def normalize_to_wpp(phone_any) -> str:
+    """Converte '6298...' ou '+5562...' ou 'whatsapp:+55...' em 'whatsapp:+55...'."""
+    s = _str(phone_any)
+    if not s:
+        return ""
+    digits = norm_digits_strict(s)
+    if digits:
+        return f"whatsapp:+{digits}"
+    # whatsapp:... que não é número BR fica como veio
+    return s if s.startswith("whatsapp:") else ""
+
+
+def norm_digits_many(values) -> list:
+    """norm_digits de uma coluna inteira (células do Sheets), numa passada; repetidos saem do dict local."""
+    vistos = {}
+    saida = []
+    append = saida.append
+    for v in values:
+        d = vistos.get(v)
+        if d is None:
+            d = vistos[v] = _canon(_str(v))[0]
+        append(d)
+    return saida
+
+
+def cache_stats() -> dict:
+    info = _canon.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
@@ -0,0 +1,151 @@
+"""
+Cache de leitura (snapshot) das abas inteiras usadas pelas páginas.
+
+/leads, /conversas e /dashboard liam a Página1 inteira (get_all_records) a cada
+carregamento; /logs lia as partições do LOGS. Agora todas as rotas do processo
+compartilham UM snapshot por aba:
+
+- até READ_CACHE_TTL segundos o snapshot é servido direto;
+- depois disso (até READ_CACHE_STALE_MAX) ainda é servido, e UMA thread em
+  segundo plano relê a aba (stale-while-revalidate), então a página não espera
+  o Google;
+- mais velho que isso (ou vazio) a leitura espera a recarga; várias requests ao
+  mesmo tempo esperam a MESMA recarga (single-flight);
+- as nossas escritas passam pelo snapshot (write-through, ver lead_store.py):
+  quem marca "comprou" ou apaga um lead vê a mudança na hora. Escritas de outros
+  processos (outro worker, sheet_checker) aparecem no próximo refresh.
+"""
+import os
+import threading
+import time
+
+import sheets_quota
+
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "15"))
+READ_CACHE_STALE_MAX = float(os.getenv("READ_CACHE_STALE_MAX", "300"))
+# depois de uma recarga que falhou, espera isso antes de tentar de novo em segundo plano
+READ_CACHE_RETRY = float(os.getenv("READ_CACHE_RETRY", "10"))
+
+
+class SnapshotCache:
+    def __init__(self, nome: str, loader, ttl: float = READ_CACHE_TTL, stale_max: float = READ_CACHE_STALE_MAX):
+        self.nome = nome
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_max = max(stale_max, ttl)
+        self._cond = threading.Condition()
+        self._valor = None
+        self._lido_em = 0.0  # monotonic da última leitura completa
+        self._carregando = False
+        self._falhou_em = 0.0
+        self._durante_carga = []  # escritas feitas enquanto a recarga lia a aba
+        self.stats = {"hits": 0, "stale_hits": 0, "loads": 0, "background_loads": 0, "errors": 0,
+                      "waits": 0, "writes": 0, "invalidations": 0}
+
+    def _idade(self, agora: float) -> float:
+        return agora - self._lido_em if self._valor is not None else float("inf")
+
+    def _carregar(self):
+        """Roda o loader (fora do lock) e publica o resultado."""
+        try:
+            valor = self.loader()
+        except Exception:
+            with self._cond:
+                self._carregando = False
+                self._durante_carga = []
+                self._falhou_em = time.monotonic()
+                self.stats["errors"] += 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            # a leitura pode ter começado antes dessas escritas: reaplica no snapshot novo
+            for fn in self._durante_carga:
+                try:
+                    fn(valor)
+                except Exception:
+                    pass
+            self._durante_carga = []
+            self._valor = valor
+            self._lido_em = time.monotonic()
+            self._carregando = False
+            self._cond.notify_all()
+
+    def _em_segundo_plano(self):
+        try:
+            with sheets_quota.prioridade(sheets_quota.SEGUNDO_PLANO):
+                self._carregar()
+        except Exception as e:
+            print(f"[CACHE] Falha ao recarregar {self.nome} (servindo o snapshot anterior):", e)
+
+    def get(self):
+        """(snapshot, idade em segundos)."""
+        with self._cond:
+            agora = time.monotonic()
+            idade = self._idade(agora)
+            if idade < self.ttl:
+                self.stats["hits"] += 1
+                return self._valor, idade
+
+            if idade < self.stale_max:
+                # velho mas aceitável: serve agora e revalida em segundo plano
+                self.stats["stale_hits"] += 1
+                if not self._carregando and agora - self._falhou_em >= READ_CACHE_RETRY:
+                    self._carregando = True
+                    self.stats["background_loads"] += 1
+                    threading.Thread(target=self._em_segundo_plano, name=f"cache-{self.nome}", daemon=True).start()
+                return self._valor, idade
+
+            if self._carregando:
+                # alguém já está lendo: espera essa leitura em vez de fazer outra
+                self.stats["waits"] += 1
+                while self._carregando:
+                    self._cond.wait()
+                if self._valor is not None:
+                    return self._valor, self._idade(time.monotonic())
+            self._carregando = True
+            self.stats["loads"] += 1
+
+        self._carregar()
+        with self._cond:
+            return self._valor, self._idade(time.monotonic())
+
+    def atual(self):
+        """Snapshot publicado agora (ou None), sem contar hit nem disparar recarga."""
+        with self._cond:
+            return self._valor
+
+    def aplicar(self, fn, idempotente: bool = True):
+        """
+        Write-through: fn(snapshot) aplica uma escrita nossa no snapshot (se houver um).
+        idempotente=True: se uma recarga estiver em andamento, fn é reaplicada no
+        resultado dela (um append não é: poderia duplicar a linha).
+        Se fn falhar, o snapshot é invalidado.
+        """
+        with self._cond:
+            if self._carregando and idempotente:
+                self._durante_carga.append(fn)
+            if self._valor is None:
+                return
+            try:
+                fn(self._valor)
+            except Exception as e:
+                print(f"[CACHE] Escrita não aplicada em {self.nome}, invalidando:", e)
+                self._invalidar()
+                return
+            self.stats["writes"] += 1
+
+    def invalidar(self):
+        """Próxima leitura trata o snapshot como vencido (serve e revalida)."""
+        with self._cond:
+            self._invalidar()
+
+    def _invalidar(self):
+        if self._valor is not None:
+            self._lido_em = min(self._lido_em, time.monotonic() - self.ttl)
+        self.stats["invalidations"] += 1
+
+    def relatorio(self) -> dict:
+        with self._cond:
+            idade = self._idade(time.monotonic())
+            return dict(self.stats, age_s=round(idade, 1) if idade != float("inf") else None,
+                        loading=self._carregando)
@@ -2,12 +2,23 @@
 # Roda no Heroku Scheduler
 
 import os
-from google_sheets import monitorar_novos_leads
-from app import processar_novo_lead_sheet
+from google_sheets import monitorar_novos_leads, prioridade_sheets, sheets_quota_stats
+from app import processar_novo_lead_sheet, followups
+from lead_store import descarregar_escritas, lote_escritas
+from followups import FOLLOWUP_DELAY
+from sheets_quota import SEGUNDO_PLANO
 
 print("=== INICIANDO LEITURA DA PLANILHA ===")
 
-# monitorar_novos_leads agora RECEBE um callback
-monitorar_novos_leads(processar_novo_lead_sheet)
+# monitorar_novos_leads agora RECEBE um callback; leads novos vão em paralelo
+# (CAMPANHA_WORKERS) e as escritas na Página1 saem em lote a cada checkpoint
+with prioridade_sheets(SEGUNDO_PLANO), lote_escritas():
+    monitorar_novos_leads(processar_novo_lead_sheet, checkpoint=descarregar_escritas)
 
+# os follow-ups agendados rodam neste processo: espera vencerem antes de sair
+# (o dyno do scheduler tem disco próprio, ninguém mais pegaria esses jobs)
+if not followups.drenar(FOLLOWUP_DELAY + 30):
+    print("[WARN] Follow-ups ainda pendentes ao sair:", followups.relatorio())
+
+print("Cota Sheets:", sheets_quota_stats())
 print("=== FINALIZADO ===")
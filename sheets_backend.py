@@ -0,0 +1,371 @@
+"""
+Backend de planilha plugável.
+
+WorksheetBackend descreve o subconjunto da API do gspread que o projeto usa.
+InMemoryWorksheet/InMemorySpreadsheet implementam esse subconjunto em memória,
+com latência e erros 429 injetáveis, para testar carga do webhook/scheduler
+sem o Google (e sem gastar quota).
+
+Para usar no app:  SHEETS_BACKEND=memory
+  SHEETS_FAKE_LATENCY_MS    latência por chamada (ex: 150)
+  SHEETS_FAKE_JITTER_MS     variação aleatória somada à latência
+  SHEETS_FAKE_429_RATE      fração das chamadas que falham com 429 (ex: 0.02)
+  SHEETS_FAKE_QUOTA_PER_MIN limite de leituras/escritas por minuto (0 = sem limite)
+  SHEETS_FAKE_SEED          JSON {"Página1": [[...], ...], "LOGS": [...]} para popular as abas
+"""
+import abc
+import collections
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range, numericise_all
+
+from sheets_schema import LEADS_HEADER
+
+
+class WorksheetBackend(abc.ABC):
+    """Subconjunto de gspread.Worksheet usado por google_sheets.py."""
+
+    id = None
+    title = None
+    spreadsheet = None
+
+    @abc.abstractmethod
+    def get_all_values(self, **kwargs): ...
+
+    @abc.abstractmethod
+    def get_all_records(self, **kwargs): ...
+
+    @abc.abstractmethod
+    def row_values(self, row, **kwargs): ...
+
+    @abc.abstractmethod
+    def col_values(self, col, **kwargs): ...
+
+    @abc.abstractmethod
+    def get(self, range_name=None, **kwargs): ...
+
+    @abc.abstractmethod
+    def batch_get(self, ranges, **kwargs): ...
+
+    @abc.abstractmethod
+    def append_row(self, values, **kwargs): ...
+
+    @abc.abstractmethod
+    def append_rows(self, values, **kwargs): ...
+
+    @abc.abstractmethod
+    def update_cell(self, row, col, value): ...
+
+    @abc.abstractmethod
+    def batch_update(self, data, **kwargs): ...
+
+    @abc.abstractmethod
+    def delete_rows(self, start_index, end_index=None): ...
+
+
+def _api_error(code: int, status: str, message: str) -> APIError:
+    """APIError igual ao do gspread (com .response.status_code e .response.json())."""
+    resp = requests.Response()
+    resp.status_code = code
+    resp._content = json.dumps({"error": {"code": code, "status": status, "message": message}}).encode()
+    return APIError(resp)
+
+
+class FaultInjector:
+    """Latência + 429 aleatório + quota por minuto (leitura e escrita separadas, como no Sheets)."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, quota_per_min=0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.quota_per_min = quota_per_min
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._janela = {"read": collections.deque(), "write": collections.deque()}
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            latency_ms=float(os.getenv("SHEETS_FAKE_LATENCY_MS", "0")),
+            jitter_ms=float(os.getenv("SHEETS_FAKE_JITTER_MS", "0")),
+            error_rate=float(os.getenv("SHEETS_FAKE_429_RATE", "0")),
+            quota_per_min=int(os.getenv("SHEETS_FAKE_QUOTA_PER_MIN", "0")),
+        )
+
+    def __call__(self, kind: str, method: str):
+        with self._lock:
+            self.calls[method] += 1
+            agora = time.monotonic()
+            janela = self._janela[kind]
+            while janela and agora - janela[0] > 60:
+                janela.popleft()
+
+            if self.quota_per_min and len(janela) >= self.quota_per_min:
+                self.errors[method] += 1
+                raise _api_error(429, "RESOURCE_EXHAUSTED", f"Quota exceeded for {kind} requests per minute (simulado)")
+            janela.append(agora)
+
+            falha = self.error_rate and self._random.random() < self.error_rate
+            atraso = (self.latency_ms + self._random.random() * self.jitter_ms) / 1000.0
+
+        if atraso > 0:
+            time.sleep(atraso)
+        if falha:
+            with self._lock:
+                self.errors[method] += 1
+            raise _api_error(429, "RESOURCE_EXHAUSTED", "Too many requests (simulado)")
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+            for janela in self._janela.values():
+                janela.clear()
+
+    @property
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(self.calls.values())
+
+
+def _trim(row):
+    row = list(row)
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+class InMemoryWorksheet(WorksheetBackend):
+    """Aba em memória: células são strings, linhas/colunas 1-based como no Sheets."""
+
+    def __init__(self, spreadsheet, sheet_id: int, title: str, rows=None):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self._rows = [[str(v) for v in r] for r in (rows or [])]
+        self._lock = threading.RLock()
+
+    def _hit(self, kind, method):
+        self.spreadsheet._api(kind, method)
+
+    # ---------- leitura ----------
+    def _values(self):
+        rows = [_trim(r) for r in self._rows]
+        while rows and not rows[-1]:
+            rows.pop()
+        width = max((len(r) for r in rows), default=0)
+        return [r + [""] * (width - len(r)) for r in rows]
+
+    def get_all_values(self, **kwargs):
+        self._hit("read", "get_all_values")
+        with self._lock:
+            return self._values()
+
+    def get_all_records(self, **kwargs):
+        self._hit("read", "get_all_records")
+        with self._lock:
+            values = self._values()
+        if not values:
+            return []
+        keys = values[0]
+        return [dict(zip(keys, numericise_all(row, default_blank=""))) for row in values[1:]]
+
+    def row_values(self, row, **kwargs):
+        self._hit("read", "row_values")
+        with self._lock:
+            return _trim(self._rows[row - 1]) if row <= len(self._rows) else []
+
+    def col_values(self, col, **kwargs):
+        self._hit("read", "col_values")
+        with self._lock:
+            return _trim([r[col - 1] if len(r) >= col else "" for r in self._rows])
+
+    def _range(self, range_name):
+        grid = a1_range_to_grid_range(range_name)
+        r0 = grid.get("startRowIndex", 0)
+        r1 = grid.get("endRowIndex", len(self._rows))
+        c0 = grid.get("startColumnIndex", 0)
+        c1 = grid.get("endColumnIndex")
+        rows = [_trim(r[c0:c1]) for r in self._rows[r0:r1]]
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def get(self, range_name=None, **kwargs):
+        self._hit("read", "get")
+        with self._lock:
+            return self._range(range_name) if range_name else self._values()
+
+    def batch_get(self, ranges, **kwargs):
+        self._hit("read", "batch_get")
+        with self._lock:
+            return [self._range(r) for r in ranges]
+
+    # ---------- escrita ----------
+    def _set(self, row, col, value):
+        while len(self._rows) < row:
+            self._rows.append([])
+        linha = self._rows[row - 1]
+        while len(linha) < col:
+            linha.append("")
+        linha[col - 1] = "" if value is None else str(value)
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], _method="append_row", **kwargs)
+
+    def append_rows(self, values, _method="append_rows", **kwargs):
+        self._hit("write", _method)
+        with self._lock:
+            ultima = len(self._values())
+            del self._rows[ultima:]
+            for row in values:
+                self._rows.append(["" if v is None else str(v) for v in row])
+            inicio, fim = ultima + 1, len(self._rows)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{inicio}:A{fim}", "updatedRows": len(values)}}
+
+    def update_cell(self, row, col, value):
+        self._hit("write", "update_cell")
+        with self._lock:
+            self._set(row, col, value)
+
+    def batch_update(self, data, **kwargs):
+        self._hit("write", "batch_update")
+        with self._lock:
+            for item in data:
+                grid = a1_range_to_grid_range(item["range"])
+                for dr, valores in enumerate(item["values"]):
+                    for dc, value in enumerate(valores):
+                        self._set(grid["startRowIndex"] + dr + 1, grid["startColumnIndex"] + dc + 1, value)
+
+    def delete_rows(self, start_index, end_index=None):
+        self._hit("write", "delete_rows")
+        with self._lock:
+            del self._rows[start_index - 1:(end_index or start_index)]
+
+    def _delete_dimension(self, start_index, end_index):
+        with self._lock:
+            del self._rows[start_index:end_index]
+
+
+class InMemorySpreadsheet:
+    """Planilha em memória (abas por título) compartilhada pelo processo."""
+
+    def __init__(self, faults: FaultInjector = None, request_hook=None):
+        self.faults = faults or FaultInjector()
+        # request_hook(kind, method, fn): por onde passa cada "chamada de API"
+        # (o google_sheets.py pluga aqui o agendador de cota, como faz no gspread.Client)
+        self.request_hook = request_hook
+        self._lock = threading.Lock()
+        self._sheets = {}
+        self._next_id = 0
+
+    def _api(self, kind: str, method: str):
+        if self.request_hook is None:
+            self.faults(kind, method)
+        else:
+            self.request_hook(kind, method, lambda: self.faults(kind, method))
+
+    def load_rows(self, title: str, rows) -> InMemoryWorksheet:
+        """Cria/substitui a aba com as linhas dadas (não conta como chamada de API)."""
+        with self._lock:
+            ws = InMemoryWorksheet(self, self._next_id, title, rows)
+            self._next_id += 1
+            self._sheets[title] = ws
+            return ws
+
+    def worksheet(self, title: str):
+        self._api("read", "worksheet")
+        with self._lock:
+            if title not in self._sheets:
+                raise WorksheetNotFound(title)
+            return self._sheets[title]
+
+    def worksheets(self):
+        self._api("read", "worksheets")
+        return self._all()
+
+    def _all(self):
+        with self._lock:
+            return list(self._sheets.values())
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26):
+        self._api("write", "add_worksheet")
+        with self._lock:
+            if title in self._sheets:
+                raise _api_error(400, "INVALID_ARGUMENT", f'A sheet with the name "{title}" already exists.')
+        return self.load_rows(title, [])
+
+    def del_worksheet(self, worksheet):
+        self._api("write", "del_worksheet")
+        with self._lock:
+            self._sheets.pop(worksheet.title, None)
+
+    def batch_update(self, body):
+        self._api("write", "spreadsheet_batch_update")
+        por_id = {ws.id: ws for ws in self._all()}
+        # como a API real: o lote é validado inteiro antes de aplicar (tudo ou nada);
+        # pedido que o backend em memória não implementa vira o mesmo 400 de um pedido inválido
+        for n, req in enumerate(body.get("requests", [])):
+            dim = req.get("deleteDimension")
+            if not dim:
+                raise _api_error(400, "INVALID_ARGUMENT", f"Invalid requests[{n}]: não suportado em memória: {list(req)}")
+            if dim["range"].get("sheetId") not in por_id:
+                raise _api_error(400, "INVALID_ARGUMENT", f"Invalid requests[{n}].deleteDimension: No grid with id: {dim['range'].get('sheetId')}")
+        for req in body.get("requests", []):
+            rng = req["deleteDimension"]["range"]
+            por_id[rng["sheetId"]]._delete_dimension(rng["startIndex"], rng["endIndex"])
+        return {"replies": [{} for _ in body.get("requests", [])]}
+
+
+class InMemoryClient:
+    """
+    Substitui o gspread.Client. A primeira chave aberta recebe a planilha principal
+    (a populada); outras chaves (ex: planilha de arquivo) ganham planilhas vazias.
+    """
+
+    def __init__(self, spreadsheet: InMemorySpreadsheet):
+        self.spreadsheet = spreadsheet
+        self._por_chave = {}
+        self._lock = threading.Lock()
+
+    def open_by_key(self, key):
+        self.spreadsheet._api("read", "open_by_key")
+        with self._lock:
+            if key not in self._por_chave:
+                novo = self.spreadsheet if not self._por_chave else InMemorySpreadsheet(self.spreadsheet.faults, self.spreadsheet.request_hook)
+                self._por_chave[key] = novo
+            return self._por_chave[key]
+
+
+def new_spreadsheet(leads_sheet="Página1", seed_file=None, faults=None) -> InMemorySpreadsheet:
+    sh = InMemorySpreadsheet(faults)
+    seed = {}
+    if seed_file:
+        with open(seed_file, "r", encoding="utf-8") as f:
+            seed = json.load(f)
+    sh.load_rows(leads_sheet, seed.pop(leads_sheet, [LEADS_HEADER]))
+    for title, rows in seed.items():
+        sh.load_rows(title, rows)
+    return sh
+
+
+_memory_client = None
+_memory_client_lock = threading.Lock()
+
+
+def memory_client(leads_sheet="Página1") -> InMemoryClient:
+    """Client em memória do processo (configurado pelas variáveis SHEETS_FAKE_*)."""
+    global _memory_client
+    with _memory_client_lock:
+        if _memory_client is None:
+            sh = new_spreadsheet(leads_sheet, os.getenv("SHEETS_FAKE_SEED"), FaultInjector.from_env())
+            _memory_client = InMemoryClient(sh)
+        return _memory_client
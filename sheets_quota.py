@@ -0,0 +1,244 @@
+"""
+Agendador das chamadas à API do Google Sheets (lado do cliente).
+
+- Dois baldes de tokens por minuto (leitura e escrita), como a cota do Sheets.
+- Sem token disponível a chamada ESPERA (fila) em vez de levar 429.
+- Rotas interativas (webhook, páginas) têm prioridade: jobs em segundo plano
+  (gravador de LOGS, espelho do SQLite, sheet_checker, arquivamento) não usam a
+  última fatia do balde (SHEETS_BACKGROUND_RESERVE) e cedem a vez a quem é interativo.
+- 429 e 5xx são repetidos com backoff exponencial com jitter. 5xx só é repetido
+  em chamada idempotente (um append repetido poderia duplicar linhas).
+
+Os baldes são por processo: com vários workers/dynos, divida a cota do projeto
+entre eles em SHEETS_READS_PER_MIN / SHEETS_WRITES_PER_MIN.
+"""
+import collections
+import contextlib
+import os
+import random
+import threading
+import time
+
+from gspread.exceptions import APIError
+from requests.exceptions import ConnectionError as RequestsConnectionError, ConnectTimeout, Timeout
+
+SHEETS_READS_PER_MIN = int(os.getenv("SHEETS_READS_PER_MIN", "60"))
+SHEETS_WRITES_PER_MIN = int(os.getenv("SHEETS_WRITES_PER_MIN", "60"))
+# fração do balde que só as chamadas interativas podem usar
+SHEETS_BACKGROUND_RESERVE = float(os.getenv("SHEETS_BACKGROUND_RESERVE", "0.2"))
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+SHEETS_BACKOFF_BASE = float(os.getenv("SHEETS_BACKOFF_BASE", "1.0"))
+SHEETS_BACKOFF_MAX = float(os.getenv("SHEETS_BACKOFF_MAX", "32"))
+
+INTERATIVO = "interactive"
+SEGUNDO_PLANO = "background"
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def prioridade(nivel: str):
+    """Marca as chamadas ao Sheets feitas nesta thread (INTERATIVO ou SEGUNDO_PLANO)."""
+    anterior = getattr(_local, "nivel", INTERATIVO)
+    _local.nivel = nivel
+    try:
+        yield
+    finally:
+        _local.nivel = anterior
+
+
+def prioridade_atual() -> str:
+    return getattr(_local, "nivel", INTERATIVO)
+
+
+@contextlib.contextmanager
+def contar_chamadas():
+    """Conta as chamadas à API feitas por esta thread dentro do bloco: {"read": n, "write": n}."""
+    anterior = getattr(_local, "contagem", None)
+    contagem = {"read": 0, "write": 0}
+    _local.contagem = contagem
+    try:
+        yield contagem
+    finally:
+        _local.contagem = anterior
+        if anterior is not None:
+            for kind, n in contagem.items():
+                anterior[kind] += n
+
+
+def status_http(e) -> int:
+    resp = getattr(e, "response", None)
+    try:
+        return int(getattr(resp, "status_code", 0) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def escrita_incerta(e) -> bool:
+    """
+    True se a escrita que falhou com `e` pode ter sido aplicada mesmo assim (5xx,
+    timeout de leitura, conexão caída no meio). 4xx e falha ao conectar: não foi.
+    """
+    if isinstance(e, APIError):
+        codigo = status_http(e)
+        return codigo >= 500 or codigo == 0
+    return isinstance(e, (RequestsConnectionError, Timeout)) and not isinstance(e, ConnectTimeout)
+
+
+class _Balde:
+    def __init__(self, por_minuto: int):
+        self.capacidade = max(1, por_minuto)
+        self.taxa = self.capacidade / 60.0  # tokens por segundo
+        self.tokens = float(self.capacidade)
+        self.atualizado = time.monotonic()
+        self.pausa_ate = 0.0  # depois de um 429 ninguém chama antes disso
+
+    def encher(self, agora: float):
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+
+
+class QuotaScheduler:
+    def __init__(self, reads_per_min: int, writes_per_min: int, reserva: float = 0.2,
+                 max_retries: int = 5, backoff_base: float = 1.0, backoff_max: float = 32.0):
+        self.reserva = min(max(reserva, 0.0), 0.9)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cond = threading.Condition()
+        self._baldes = {"read": _Balde(reads_per_min), "write": _Balde(writes_per_min)}
+        self._interativos_esperando = {"read": 0, "write": 0}
+        self._janela = {"read": collections.deque(), "write": collections.deque()}
+        self._random = random.Random()
+        self.stats = {
+            kind: {"calls": 0, "waits": 0, "wait_s": 0.0, "throttled_429": 0, "server_errors": 0,
+                   "retries": 0, "failed": 0, "background_calls": 0}
+            for kind in ("read", "write")
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(SHEETS_READS_PER_MIN, SHEETS_WRITES_PER_MIN, SHEETS_BACKGROUND_RESERVE,
+                   SHEETS_MAX_RETRIES, SHEETS_BACKOFF_BASE, SHEETS_BACKOFF_MAX)
+
+    # ---------- tokens ----------
+    def _minimo(self, kind: str, nivel: str) -> float:
+        if nivel == INTERATIVO:
+            return 1.0
+        return 1.0 + self.reserva * self._baldes[kind].capacidade
+
+    def _pode(self, kind: str, nivel: str, agora: float) -> float:
+        """0 se pode chamar agora; senão quantos segundos esperar."""
+        balde = self._baldes[kind]
+        balde.encher(agora)
+        if balde.pausa_ate > agora:
+            return balde.pausa_ate - agora
+        if nivel != INTERATIVO and self._interativos_esperando[kind]:
+            return 1.0 / balde.taxa
+        falta = self._minimo(kind, nivel) - balde.tokens
+        return 0.0 if falta <= 0 else falta / balde.taxa
+
+    def aguardar(self, kind: str, nivel: str = None, consumir: bool = False):
+        """Bloqueia até haver token para esse nível (consumindo um, se consumir=True)."""
+        nivel = nivel or prioridade_atual()
+        with self._cond:
+            espera = self._pode(kind, nivel, time.monotonic())
+            if espera > 0:
+                self.stats[kind]["waits"] += 1
+                inicio = time.monotonic()
+                if nivel == INTERATIVO:
+                    self._interativos_esperando[kind] += 1
+                try:
+                    while espera > 0:
+                        self._cond.wait(espera)
+                        espera = self._pode(kind, nivel, time.monotonic())
+                finally:
+                    if nivel == INTERATIVO:
+                        self._interativos_esperando[kind] -= 1
+                        self._cond.notify_all()
+                self.stats[kind]["wait_s"] += time.monotonic() - inicio
+            if consumir:
+                agora = time.monotonic()
+                self._baldes[kind].tokens -= 1
+                self._janela[kind].append(agora)
+                self._aparar(kind, agora)
+                self.stats[kind]["calls"] += 1
+                if nivel != INTERATIVO:
+                    self.stats[kind]["background_calls"] += 1
+
+    def _aparar(self, kind: str, agora: float):
+        """Tira da janela as chamadas com mais de 60 s (chamar com _cond)."""
+        janela = self._janela[kind]
+        while janela and agora - janela[0] > 60:
+            janela.popleft()
+
+    def _contar(self, kind: str, campo: str):
+        with self._cond:
+            self.stats[kind][campo] += 1
+
+    def apertado(self, kind: str) -> bool:
+        """True se um job em segundo plano teria que esperar agora."""
+        with self._cond:
+            return self._pode(kind, SEGUNDO_PLANO, time.monotonic()) > 0
+
+    def _pausar(self, kind: str, segundos: float):
+        with self._cond:
+            balde = self._baldes[kind]
+            balde.tokens = min(balde.tokens, 0.0)
+            balde.pausa_ate = max(balde.pausa_ate, time.monotonic() + segundos)
+
+    def _backoff(self, tentativa: int) -> float:
+        teto = min(self.backoff_max, self.backoff_base * (2 ** tentativa))
+        return teto / 2 + self._random.uniform(0, teto / 2)
+
+    # ---------- chamada ----------
+    def chamar(self, kind: str, fn, idempotente: bool = True):
+        """Executa fn() respeitando a cota de `kind` ("read"/"write"), com retry de 429/5xx."""
+        tentativa = 0
+        while True:
+            self.aguardar(kind, consumir=True)
+            contagem = getattr(_local, "contagem", None)
+            if contagem is not None:
+                contagem[kind] += 1
+            try:
+                return fn()
+            except (APIError, RequestsConnectionError, Timeout) as e:
+                codigo = status_http(e) if isinstance(e, APIError) else 0
+                if codigo == 429:
+                    self._contar(kind, "throttled_429")
+                elif codigo >= 500 or codigo == 0:
+                    self._contar(kind, "server_errors")
+
+                repetir = codigo == 429 or ((codigo >= 500 or codigo == 0) and idempotente)
+                if not repetir or tentativa >= self.max_retries:
+                    self._contar(kind, "failed")
+                    raise
+
+                atraso = self._backoff(tentativa)
+                if codigo == 429:
+                    # a cota acabou pra todo mundo: segura as outras threads também
+                    self._pausar(kind, atraso)
+                self._contar(kind, "retries")
+                tentativa += 1
+                time.sleep(atraso)
+
+    # ---------- relatório ----------
+    def relatorio(self) -> dict:
+        """Uso da cota no último minuto + contadores, por tipo."""
+        agora = time.monotonic()
+        with self._cond:
+            saida = {}
+            for kind, balde in self._baldes.items():
+                self._aparar(kind, agora)
+                janela = self._janela[kind]
+                balde.encher(agora)
+                saida[kind] = dict(
+                    self.stats[kind],
+                    limit_per_min=balde.capacidade,
+                    used_last_min=len(janela),
+                    used_pct=round(100.0 * len(janela) / balde.capacidade, 1),
+                    tokens=round(balde.tokens, 2),
+                    paused_s=round(max(0.0, balde.pausa_ate - agora), 2),
+                    wait_s=round(self.stats[kind]["wait_s"], 3),
+                )
+            return saida
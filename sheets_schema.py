@@ -0,0 +1,17 @@
+"""
+Cabeçalhos das abas da planilha de produção (Página1 e LOGS).
+
+Fonte única do esquema: google_sheets.py cria/confere as abas com eles,
+lead_store.py monta as tabelas do SQLite a partir deles e sheets_backend.py
+usa os mesmos para popular a planilha em memória. Colunas que existirem a mais
+na Página1 real não precisam estar aqui: o SQLite as acrescenta ao ler o
+cabeçalho da planilha.
+"""
+
+LEADS_HEADER = [
+    "NOME", "TELEFONE", "EMAIL", "DATA", "STAGE", "UPDATED_AT", "ENVIADO",
+    "LAST_INBOUND", "LAST_INBOUND_AT", "LAST_OUTBOUND", "LAST_OUTBOUND_AT",
+    "LAST_TEMPLATE_SID", "LAST_MESSAGE_SID",
+]
+
+LOGS_HEADER = ["TIMESTAMP", "TELEFONE", "DIRECTION", "STAGE", "BODY", "MESSAGE_SID", "TEMPLATE_SID"]
@@ -0,0 +1,151 @@
+"""
+Anti-duplicidade de MessageSid (Twilio reenvia o webhook quando demoramos).
+
+Janela em ordem de chegada (OrderedDict, as SIDS_WINDOW mais recentes) +
+diário append-only em disco: cada SID nova é UMA linha acrescentada ao
+arquivo, em vez de reescrever o JSON inteiro a cada mensagem. Quando o diário
+passa de 2x a janela ele é compactado (reescrito só com a janela, via
+arquivo temporário + os.replace).
+
+Vários workers do gunicorn: a checagem + append acontece sob flock num
+arquivo .lock; antes de checar, cada processo lê o que os outros acrescentaram
+desde a última vez (e recarrega se o diário foi compactado por outro).
+"""
+import collections
+import contextlib
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows (dev): só o lock entre threads
+    fcntl = None
+
+SIDS_WINDOW = int(os.getenv("SIDS_WINDOW", "50000"))
+
+
+class SidDedup:
+    def __init__(self, path: str, window: int = SIDS_WINDOW, legado: str = None):
+        self.path = path
+        self.window = max(1, window)
+        self.legado = legado
+        self._lock = threading.Lock()
+        self._ordem = collections.OrderedDict()
+        self._fd = None
+        self._ino = None
+        self._offset = 0
+        self._linhas = 0
+        self._resto = b""
+        self.stats = {"checks": 0, "duplicates": 0, "appends": 0, "compactions": 0, "reloads": 0}
+
+    # ---------- arquivo ----------
+    @contextlib.contextmanager
+    def _flock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _importar_legado(self):
+        """Primeira execução: aproveita o processed_sids.json antigo (sem ordem definida)."""
+        if os.path.exists(self.path) or not self.legado or not os.path.exists(self.legado):
+            return
+        try:
+            with open(self.legado, "r", encoding="utf-8") as f:
+                sids = [str(s) for s in json.load(f)][-self.window:]
+        except Exception:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(f"{s}\n" for s in sids))
+        os.replace(tmp, self.path)
+
+    def _abrir(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._importar_legado()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._ino = os.fstat(self._fd).st_ino
+        self._ordem.clear()
+        self._offset = 0
+        self._linhas = 0
+        self._resto = b""
+        self.stats["reloads"] += 1
+        self._ler_novos()
+
+    def _trocado(self) -> bool:
+        try:
+            return os.stat(self.path).st_ino != self._ino
+        except FileNotFoundError:
+            return True
+
+    def _ler_novos(self):
+        """Lê o que foi acrescentado ao diário (por qualquer processo) desde a última leitura."""
+        tamanho = os.fstat(self._fd).st_size
+        if tamanho <= self._offset:
+            return
+        dados = self._resto + os.pread(self._fd, tamanho - self._offset, self._offset)
+        self._offset = tamanho
+        *linhas, self._resto = dados.split(b"\n")
+        for linha in linhas:
+            if linha:
+                self._guardar(linha.decode("utf-8", "replace"))
+                self._linhas += 1
+
+    def _guardar(self, sid: str):
+        if sid in self._ordem:
+            return
+        self._ordem[sid] = None
+        while len(self._ordem) > self.window:
+            self._ordem.popitem(last=False)  # a mais antiga
+
+    def _compactar(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(f"{s}\n" for s in self._ordem))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.stats["compactions"] += 1
+        self._abrir()
+
+    # ---------- API ----------
+    def visto(self, sid: str) -> bool:
+        """True se a SID já foi processada; senão registra e retorna False."""
+        if not sid:
+            return False
+        with self._lock:
+            self.stats["checks"] += 1
+            if sid in self._ordem:
+                self.stats["duplicates"] += 1
+                return True
+
+            with self._flock():
+                if self._fd is None or self._trocado():
+                    self._abrir()
+                else:
+                    self._ler_novos()
+                if sid in self._ordem:
+                    self.stats["duplicates"] += 1
+                    return True
+
+                linha = f"{sid}\n".encode("utf-8")
+                os.write(self._fd, linha)
+                self._offset += len(linha)
+                self._linhas += 1
+                self._guardar(sid)
+                self.stats["appends"] += 1
+
+                if self._linhas > 2 * self.window:
+                    self._compactar()
+            return False
+
+    def relatorio(self) -> dict:
+        with self._lock:
+            return dict(self.stats, window=len(self._ordem), journal_lines=self._linhas)
@@ -0,0 +1,489 @@
+"""
+Serviço de envio do Twilio.
+
+- Cliente Twilio com UMA sessão HTTP (requests) por processo, keep-alive e pool
+  de conexões dimensionado (TWILIO_POOL_MAXSIZE), em vez do padrão do SDK;
+  envios em sequência reaproveitam a conexão TLS com a API.
+- Envios passam por uma fila com prioridade atendida por TWILIO_SEND_WORKERS
+  threads: `enviar()` devolve um Future; quem precisa do sid espera com
+  `.result()`. Respostas de conversa (CONVERSA) passam na frente de campanha e
+  lembretes (CAMPANHA).
+- Balde de tokens por remetente (from_): no máximo TWILIO_SENDER_MPS mensagens
+  por segundo por número, o limite de throughput do sender no WhatsApp.
+- 429 pausa o remetente e repete com backoff exponencial + jitter. Erro que não
+  garante que a mensagem NÃO saiu (5xx, timeout de leitura, conexão caída no
+  meio) só é repetido depois de conferir no Twilio que a MESMA mensagem (mesmo
+  corpo; não uma anterior nossa para o lead) não foi criada desde a tentativa.
+- Chave de idempotência (opcional, `chave=`): gravada no SQLite em
+  TWILIO_IDEMPOTENCY_DB; a mesma chave nunca gera um segundo envio enquanto esse
+  arquivo existir (retry, webhook reentregue). No Heroku o disco do dyno é
+  efêmero: entre execuções do sheet_checker quem segura o reenvio é a reserva
+  gravada na própria planilha (google_sheets._despachar_campanha).
+- Latência por content_sid (contagem, erros, média, p50/p95, máx) para o /status.
+"""
+import collections
+import heapq
+import itertools
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, ConnectTimeout, Timeout
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+TWILIO_SEND_WORKERS = int(os.getenv("TWILIO_SEND_WORKERS", "8"))
+TWILIO_POOL_MAXSIZE = int(os.getenv("TWILIO_POOL_MAXSIZE", str(TWILIO_SEND_WORKERS)))
+TWILIO_TIMEOUT = float(os.getenv("TWILIO_TIMEOUT", "15"))
+# amostras guardadas por content_sid para os percentis
+TWILIO_LATENCY_SAMPLES = int(os.getenv("TWILIO_LATENCY_SAMPLES", "500"))
+# mensagens por segundo por remetente (número do WhatsApp); por processo
+TWILIO_SENDER_MPS = float(os.getenv("TWILIO_SENDER_MPS", "20"))
+TWILIO_MAX_RETRIES = int(os.getenv("TWILIO_MAX_RETRIES", "4"))
+TWILIO_BACKOFF_BASE = float(os.getenv("TWILIO_BACKOFF_BASE", "1.0"))
+TWILIO_BACKOFF_MAX = float(os.getenv("TWILIO_BACKOFF_MAX", "30"))
+TWILIO_IDEMPOTENCY_DB = os.getenv("TWILIO_IDEMPOTENCY_DB", os.getenv("LEAD_STATE_PATH", "lead_state.db"))
+# chaves de idempotência guardadas por esse tempo
+TWILIO_IDEMPOTENCY_TTL = float(os.getenv("TWILIO_IDEMPOTENCY_TTL", str(30 * 86400)))
+# chave em 'sending' mais nova que isso = outro processo ainda está enviando
+TWILIO_INFLIGHT_S = float(os.getenv("TWILIO_INFLIGHT_S", "120"))
+# folga de relógio (dyno x Twilio) na busca da mensagem depois de um erro incerto
+TWILIO_CLOCK_SKEW_S = float(os.getenv("TWILIO_CLOCK_SKEW_S", "5"))
+# quantos SIDs enviados / corpos de template este processo lembra para essa busca
+TWILIO_CONFERENCIA_MEMORIA = int(os.getenv("TWILIO_CONFERENCIA_MEMORIA", "5000"))
+
+CONVERSA = 0  # resposta a quem acabou de escrever / envio manual
+CAMPANHA = 1  # sheet_checker, follow-up
+
+
+def criar_cliente(account_sid: str, auth_token: str) -> Client:
+    """Client do Twilio com sessão keep-alive e pool de conexões limitado."""
+    http = TwilioHttpClient(pool_connections=True, timeout=TWILIO_TIMEOUT)
+    # pool_block: acima de TWILIO_POOL_MAXSIZE conexões a thread espera uma livre
+    # (em vez de abrir e descartar conexões extras)
+    http.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=TWILIO_POOL_MAXSIZE, pool_block=True))
+    return Client(account_sid, auth_token, http_client=http)
+
+
+def _classificar(e) -> str:
+    """
+    "throttled": 429, a mensagem não foi criada -> repetir.
+    "nao_enviada": falhou antes de chegar ao Twilio -> repetir.
+    "incerta": pode ter sido criada (5xx, timeout de leitura, conexão caída) -> conferir antes.
+    "definitiva": 4xx (número inválido, template, etc) -> não repetir.
+    """
+    if isinstance(e, TwilioRestException):
+        if e.status == 429:
+            return "throttled"
+        return "incerta" if e.status >= 500 else "definitiva"
+    if isinstance(e, ConnectTimeout):
+        return "nao_enviada"
+    if isinstance(e, (RequestsConnectionError, Timeout)):
+        return "incerta"
+    return "definitiva"
+
+
+class _Enviada:
+    """Resultado de um envio que já tinha acontecido (mesma chave / achado na conferência)."""
+
+    __slots__ = ("sid", "reaproveitada")
+
+    def __init__(self, sid: str):
+        self.sid = sid
+        self.reaproveitada = True
+
+
+class _Latencias:
+    __slots__ = ("count", "errors", "total", "max", "amostras")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.amostras = collections.deque(maxlen=TWILIO_LATENCY_SAMPLES)
+
+    def registrar(self, segundos: float, ok: bool):
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self.total += segundos
+        self.max = max(self.max, segundos)
+        self.amostras.append(segundos)
+
+    def relatorio(self) -> dict:
+        ordenadas = sorted(self.amostras)
+
+        def pct(p):
+            return round(ordenadas[min(len(ordenadas) - 1, int(p * len(ordenadas)))] * 1000, 1) if ordenadas else 0.0
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.count * 1000, 1) if self.count else 0.0,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "max_ms": round(self.max * 1000, 1),
+        }
+
+
+class _BaldeRemetente:
+    def __init__(self, mps: float):
+        self.taxa = max(0.1, mps)
+        self.capacidade = max(1.0, self.taxa)
+        self.tokens = self.capacidade
+        self.atualizado = time.monotonic()
+        self.pausa_ate = 0.0
+
+    def espera(self, agora: float) -> float:
+        """0 se pode enviar agora (consome o token); senão quantos segundos esperar."""
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+        if self.pausa_ate > agora:
+            return self.pausa_ate - agora
+        if self.tokens < 1.0:
+            return (1.0 - self.tokens) / self.taxa
+        self.tokens -= 1.0
+        return 0.0
+
+    def pausar(self, segundos: float):
+        self.tokens = min(self.tokens, 0.0)
+        self.pausa_ate = max(self.pausa_ate, time.monotonic() + segundos)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbound_sends (
+    chave TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    sid TEXT NOT NULL DEFAULT '',
+    destino TEXT NOT NULL DEFAULT '',
+    content_sid TEXT NOT NULL DEFAULT '',
+    inicio REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbound_sends_updated ON outbound_sends (updated_at);
+"""
+
+
+class _Idempotencia:
+    """chave -> envio ('sending' / 'sent' / 'failed'), compartilhado entre processos."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+        self._escritas = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    conn.executescript(_SCHEMA)
+                    self._ready = True
+        return conn
+
+    def reservar(self, chave: str, destino: str, content_sid: str):
+        """
+        Marca a chave como 'sending'. Retorna None se a chave é nova (ou falhou antes:
+        pode enviar), ou (status, sid, inicio) do registro existente.
+        """
+        agora = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT status, sid, inicio FROM outbound_sends WHERE chave = ?", (chave,)).fetchone()
+            if row is None or row[0] == "failed":
+                conn.execute(
+                    "INSERT OR REPLACE INTO outbound_sends (chave, status, destino, content_sid, inicio, updated_at) "
+                    "VALUES (?, 'sending', ?, ?, ?, ?)", (chave, destino, content_sid or "", agora, agora),
+                )
+                row = None
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._escritas += 1
+        if self._escritas % 500 == 0:
+            self.evict()
+        return row
+
+    def concluir(self, chave: str, status: str, sid: str = ""):
+        self._conn().execute(
+            "UPDATE outbound_sends SET status = ?, sid = ?, updated_at = ? WHERE chave = ?",
+            (status, sid or "", time.time(), chave),
+        )
+
+    def sids_de(self, destino: str) -> set:
+        """SIDs já atribuídos a outras chaves para esse destino (não são a mensagem procurada)."""
+        rows = self._conn().execute(
+            "SELECT sid FROM outbound_sends WHERE destino = ? AND sid != ''", (destino,)
+        ).fetchall()
+        return {sid for (sid,) in rows}
+
+    def evict(self):
+        self._conn().execute("DELETE FROM outbound_sends WHERE updated_at < ?", (time.time() - TWILIO_IDEMPOTENCY_TTL,))
+
+
+def _guardar(memoria: collections.OrderedDict, chave, valor):
+    """LRU de até TWILIO_CONFERENCIA_MEMORIA itens."""
+    memoria[chave] = valor
+    memoria.move_to_end(chave)
+    while len(memoria) > TWILIO_CONFERENCIA_MEMORIA:
+        memoria.popitem(last=False)
+
+
+class _Job:
+    __slots__ = ("kwargs", "chave", "prioridade", "future", "tentativa", "pronto_em", "enfileirado", "desde")
+
+    def __init__(self, kwargs: dict, chave, prioridade: int):
+        self.kwargs = kwargs
+        self.chave = chave
+        self.prioridade = prioridade
+        self.future = Future()
+        self.tentativa = 0
+        self.pronto_em = 0.0
+        self.enfileirado = time.monotonic()
+        self.desde = None  # início (epoch) da primeira tentativa que pode ter criado a mensagem
+
+
+class SendService:
+    def __init__(self, client, workers: int = TWILIO_SEND_WORKERS, sender_mps: float = TWILIO_SENDER_MPS,
+                 idempotencia_path: str = TWILIO_IDEMPOTENCY_DB, max_retries: int = TWILIO_MAX_RETRIES,
+                 backoff_base: float = TWILIO_BACKOFF_BASE, backoff_max: float = TWILIO_BACKOFF_MAX):
+        self.client = client
+        self.workers = max(1, workers)
+        self.sender_mps = sender_mps
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._idem = _Idempotencia(idempotencia_path)
+        self._cond = threading.Condition()
+        self._fila = []  # (prioridade, seq, job) prontos
+        self._adiados = []  # (pronto_em, seq, job) esperando backoff
+        self._seq = itertools.count()
+        self._threads = []
+        self._baldes = {}
+        self._latencias = collections.defaultdict(_Latencias)
+        # para o _conferir: SIDs que já sabemos de quais envios são, e o corpo
+        # renderizado de cada (content_sid, content_variables)
+        self._sids_enviados = collections.OrderedDict()
+        self._corpos = collections.OrderedDict()
+        self._random = random.Random()
+        self._pendentes = 0
+        self.stats = {"sent": 0, "failed": 0, "retries": 0, "throttled_429": 0, "uncertain": 0,
+                      "deduplicated": 0, "waits": 0, "wait_s": 0.0}
+
+    # ---------- fila ----------
+    def _iniciar(self):
+        # workers só nascem no primeiro uso (depois do fork do gunicorn)
+        if len(self._threads) >= self.workers:
+            return
+        for i in range(len(self._threads), self.workers):
+            t = threading.Thread(target=self._run, name=f"twilio-send-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def enviar(self, prioridade: int = CONVERSA, chave: str = None, **kwargs) -> Future:
+        """
+        Agenda client.messages.create(**kwargs); devolve o Future (resultado = mensagem).
+        `chave`: idempotência (mesma chave = no máximo um envio).
+        """
+        job = _Job(kwargs, chave, prioridade)
+        with self._cond:
+            self._iniciar()
+            self._pendentes += 1
+            heapq.heappush(self._fila, (prioridade, next(self._seq), job))
+            self._cond.notify()
+        return job.future
+
+    def _adiar(self, job: _Job, atraso: float):
+        job.pronto_em = time.monotonic() + atraso
+        with self._cond:
+            heapq.heappush(self._adiados, (job.pronto_em, next(self._seq), job))
+            self._cond.notify()
+
+    def _proximo(self) -> _Job:
+        with self._cond:
+            while True:
+                agora = time.monotonic()
+                while self._adiados and self._adiados[0][0] <= agora:
+                    _, seq, job = heapq.heappop(self._adiados)
+                    heapq.heappush(self._fila, (job.prioridade, seq, job))
+                if self._fila:
+                    return heapq.heappop(self._fila)[2]
+                self._cond.wait(self._adiados[0][0] - agora if self._adiados else None)
+
+    def _aguardar_remetente(self, remetente: str):
+        with self._cond:
+            balde = self._baldes.get(remetente)
+            if balde is None:
+                balde = self._baldes[remetente] = _BaldeRemetente(self.sender_mps)
+            espera = balde.espera(time.monotonic())
+            if espera <= 0:
+                return
+            self.stats["waits"] += 1
+            inicio = time.monotonic()
+            while espera > 0:
+                self._cond.wait(espera)
+                espera = balde.espera(time.monotonic())
+            self.stats["wait_s"] += time.monotonic() - inicio
+
+    def _backoff(self, tentativa: int) -> float:
+        teto = min(self.backoff_max, self.backoff_base * (2 ** tentativa))
+        return teto / 2 + self._random.uniform(0, teto / 2)
+
+    # ---------- envio ----------
+    def _run(self):
+        while True:
+            job = self._proximo()
+            try:
+                self._processar(job)
+            except Exception as e:  # não deixa o worker morrer
+                self._finalizar(job, erro=e)
+
+    def _finalizar(self, job: _Job, msg=None, erro=None):
+        with self._cond:
+            self._pendentes -= 1
+            if erro is None:
+                self.stats["sent"] += 1
+            else:
+                self.stats["failed"] += 1
+        if job.future.done():
+            return
+        if erro is None:
+            job.future.set_result(msg)
+        else:
+            job.future.set_exception(erro)
+
+    def _lembrar(self, job: _Job, msg):
+        """Guarda o SID (e o corpo renderizado do template) de um envio que deu certo."""
+        sid = getattr(msg, "sid", "")
+        content_sid = job.kwargs.get("content_sid")
+        corpo = getattr(msg, "body", None)
+        with self._cond:
+            if sid:
+                _guardar(self._sids_enviados, sid, True)
+            if content_sid and corpo:
+                _guardar(self._corpos, (content_sid, job.kwargs.get("content_variables")), corpo)
+
+    def _conferir(self, job: _Job):
+        """
+        Depois de um erro incerto: ESTA mensagem foi criada? Procura no Twilio, desde a
+        1ª tentativa (menos a folga de relógio), uma mensagem para o destino que não
+        seja um envio nosso já conhecido e com o mesmo corpo (texto, ou o corpo
+        renderizado do template, se este processo já o viu). None se nada bate.
+        """
+        kwargs = job.kwargs
+        desde = datetime.fromtimestamp(job.desde - TWILIO_CLOCK_SKEW_S, tz=timezone.utc)
+        with self._cond:
+            conhecidas = set(self._sids_enviados)
+            esperado = kwargs.get("body")
+            if esperado is None and kwargs.get("content_sid"):
+                esperado = self._corpos.get((kwargs.get("content_sid"), kwargs.get("content_variables")))
+        conhecidas |= self._idem.sids_de(kwargs.get("to", ""))
+        # a lista vem da mais nova para a mais antiga
+        recentes = self.client.messages.list(to=kwargs.get("to"), from_=kwargs.get("from_"), limit=20)
+        for m in recentes:
+            criada = getattr(m, "date_created", None)
+            if criada is None or criada < desde:
+                break
+            if getattr(m, "sid", "") in conhecidas:
+                continue
+            if esperado is not None and (getattr(m, "body", None) or "") != esperado:
+                continue
+            return m
+        return None
+
+    def _processar(self, job: _Job):
+        kwargs = job.kwargs
+        if job.chave and job.tentativa == 0:
+            existente = self._idem.reservar(job.chave, kwargs.get("to", ""), kwargs.get("content_sid", ""))
+            if existente is not None:
+                status, sid, inicio = existente
+                if status == "sent":
+                    self.stats["deduplicated"] += 1
+                    return self._finalizar(job, _Enviada(sid))
+                if time.time() - inicio < TWILIO_INFLIGHT_S:
+                    # outro worker/processo está com esse envio agora (ex: webhook reentregue)
+                    self.stats["deduplicated"] += 1
+                    return self._finalizar(job, _Enviada(sid))
+                # 'sending' de uma execução que caiu no meio: só reenvia se não achar no Twilio
+                job.desde = inicio
+                try:
+                    achada = self._conferir(job)
+                except Exception as e:
+                    return self._finalizar(job, erro=e)
+                if achada is not None:
+                    self.stats["deduplicated"] += 1
+                    self._idem.concluir(job.chave, "sent", achada.sid)
+                    return self._finalizar(job, _Enviada(achada.sid))
+
+        if job.desde is not None and job.tentativa > 0:
+            # tentativa anterior foi incerta
+            achada = self._conferir(job)
+            if achada is not None:
+                self.stats["deduplicated"] += 1
+                if job.chave:
+                    self._idem.concluir(job.chave, "sent", achada.sid)
+                return self._finalizar(job, _Enviada(achada.sid))
+
+        remetente = kwargs.get("from_") or ""
+        self._aguardar_remetente(remetente)
+        inicio = time.perf_counter()
+        tentativa_em = time.time()
+        try:
+            msg = self.client.messages.create(**kwargs)
+        except Exception as e:
+            with self._cond:
+                self._latencias[kwargs.get("content_sid") or "(texto)"].registrar(time.perf_counter() - inicio, False)
+            tipo = _classificar(e)
+            if tipo == "incerta":
+                self.stats["uncertain"] += 1
+                if job.desde is None:
+                    job.desde = tentativa_em
+            if tipo == "definitiva" or job.tentativa >= self.max_retries:
+                if job.chave:
+                    # incerta: fica 'sending' (o próximo com a mesma chave confere antes de enviar)
+                    self._idem.concluir(job.chave, "sending" if job.desde is not None else "failed")
+                return self._finalizar(job, erro=e)
+            atraso = self._backoff(job.tentativa)
+            if tipo == "throttled":
+                self.stats["throttled_429"] += 1
+                with self._cond:
+                    self._baldes[remetente].pausar(atraso)
+            self.stats["retries"] += 1
+            job.tentativa += 1
+            return self._adiar(job, atraso)
+
+        with self._cond:
+            self._latencias[kwargs.get("content_sid") or "(texto)"].registrar(time.perf_counter() - inicio, True)
+        self._lembrar(job, msg)
+        if job.chave:
+            self._idem.concluir(job.chave, "sent", getattr(msg, "sid", ""))
+        self._finalizar(job, msg)
+
+    def relatorio(self) -> dict:
+        with self._cond:
+            return dict(
+                self.stats,
+                wait_s=round(self.stats["wait_s"], 3),
+                workers=self.workers,
+                sender_mps=self.sender_mps,
+                pending=self._pendentes,
+                queued=len(self._fila),
+                backing_off=len(self._adiados),
+                by_content_sid={sid: lat.relatorio() for sid, lat in self._latencias.items()},
+            )
@@ -0,0 +1,152 @@
+"""
+Fila do webhook do WhatsApp: a request só valida e enfileira; um pool de
+workers roda a máquina de estágios (Sheets + Twilio) fora da request.
+
+- Um worker por "shard": o telefone escolhe o shard, então as mensagens de um
+  mesmo lead são processadas em ordem, uma de cada vez.
+- Fila limitada (WEBHOOK_QUEUE_MAX no total). Cheia, a request espera até
+  WEBHOOK_ENQUEUE_TIMEOUT segundos por espaço (abaixo dos 15s do Twilio) e, se
+  continuar cheia, processa a mensagem na própria request, com o lock do shard
+  (backpressure: nada é descartado e o lead nunca roda em duas threads).
+- WEBHOOK_WORKERS=0 processa tudo na request (comportamento antigo).
+- No exit (deploy/restart do dyno) espera a fila esvaziar por até
+  WEBHOOK_DRAIN_TIMEOUT segundos.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+import zlib
+
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_MAX = int(os.getenv("WEBHOOK_QUEUE_MAX", "1000"))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", "10"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "20"))
+
+
+class WebhookQueue:
+    _MAXIMOS = ("max_depth", "wait_ms_max", "run_ms_max")
+
+    def __init__(self, handler, workers: int, maxsize: int, enqueue_timeout: float):
+        self.handler = handler
+        self.workers = max(0, workers)
+        self.enqueue_timeout = enqueue_timeout
+        por_shard = max(1, maxsize // max(1, self.workers))
+        self._filas = [queue.Queue(maxsize=por_shard) for _ in range(self.workers)]
+        self._locks = [threading.Lock() for _ in range(self.workers)]
+        self._threads = [None] * self.workers
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "enqueued": 0, "processed": 0, "errors": 0, "inline": 0,
+            "max_depth": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+            "run_ms_total": 0.0, "run_ms_max": 0.0,
+        }
+
+    def _shard(self, chave: str) -> int:
+        return zlib.crc32(chave.encode("utf-8")) % self.workers
+
+    def _garantir_worker(self, i: int):
+        # threads só nascem no primeiro uso (depois do fork do gunicorn)
+        t = self._threads[i]
+        if t is not None and t.is_alive():
+            return
+        with self._start_lock:
+            t = self._threads[i]
+            if t is None or not t.is_alive():
+                t = threading.Thread(target=self._run, args=(i,), name=f"webhook-worker-{i}", daemon=True)
+                t.start()
+                self._threads[i] = t
+
+    def _conta(self, **kw):
+        with self._stats_lock:
+            for k, v in kw.items():
+                if k in self._MAXIMOS:
+                    self.stats[k] = max(self.stats[k], v)
+                else:
+                    self.stats[k] += v
+
+    def _executar(self, payload: dict, enfileirado_em: float):
+        inicio = time.monotonic()
+        espera_ms = (inicio - enfileirado_em) * 1000
+        try:
+            self.handler(**payload)
+            erro = 0
+        except Exception as e:
+            erro = 1
+            print("[ERRO WEBHOOK WORKER]", e)
+        run_ms = (time.monotonic() - inicio) * 1000
+        self._conta(processed=1, errors=erro, wait_ms_total=espera_ms, wait_ms_max=espera_ms,
+                    run_ms_total=run_ms, run_ms_max=run_ms)
+
+    def _run(self, i: int):
+        fila = self._filas[i]
+        while True:
+            payload, enfileirado_em = fila.get()
+            try:
+                with self._locks[i]:
+                    self._executar(payload, enfileirado_em)
+            finally:
+                fila.task_done()
+
+    def enfileirar(self, chave: str, **payload) -> bool:
+        """Enfileira handler(**payload). False = fila cheia, processou na hora (backpressure)."""
+        if not self.workers:
+            self._executar(payload, time.monotonic())
+            return False
+
+        i = self._shard(chave)
+        self._garantir_worker(i)
+        try:
+            self._filas[i].put((payload, time.monotonic()), timeout=self.enqueue_timeout)
+        except queue.Full:
+            print(f"[WARN] Fila do webhook cheia (shard {i}); processando na própria request")
+            self._conta(inline=1)
+            with self._locks[i]:
+                self._executar(payload, time.monotonic())
+            return False
+
+        self._conta(enqueued=1, max_depth=self.profundidade())
+        return True
+
+    def profundidade(self) -> int:
+        return sum(f.qsize() for f in self._filas)
+
+    def drenar(self, timeout: float = None) -> bool:
+        """Espera a fila esvaziar (True) ou o timeout acabar (False)."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        for fila in self._filas:
+            with fila.all_tasks_done:
+                while fila.unfinished_tasks:
+                    restante = None if limite is None else limite - time.monotonic()
+                    if restante is not None and restante <= 0:
+                        return False
+                    fila.all_tasks_done.wait(restante)
+        return True
+
+    def relatorio(self) -> dict:
+        with self._stats_lock:
+            s = dict(self.stats)
+        feitos = max(1, s["processed"])
+        return {
+            "workers": self.workers,
+            "depth": self.profundidade(),
+            "depth_by_worker": [f.qsize() for f in self._filas],
+            "capacity": sum(f.maxsize for f in self._filas),
+            "enqueued": s["enqueued"],
+            "processed": s["processed"],
+            "errors": s["errors"],
+            "inline_backpressure": s["inline"],
+            "max_depth": s["max_depth"],
+            "wait_ms_avg": round(s["wait_ms_total"] / feitos, 1),
+            "wait_ms_max": round(s["wait_ms_max"], 1),
+            "run_ms_avg": round(s["run_ms_total"] / feitos, 1),
+            "run_ms_max": round(s["run_ms_max"], 1),
+        }
+
+
+def criar_fila(handler) -> WebhookQueue:
+    fila = WebhookQueue(handler, WEBHOOK_WORKERS, WEBHOOK_QUEUE_MAX, WEBHOOK_ENQUEUE_TIMEOUT)
+    atexit.register(fila.drenar, WEBHOOK_DRAIN_TIMEOUT)
+    return fila